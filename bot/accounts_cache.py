@@ -0,0 +1,103 @@
+import threading
+import time
+from config import DEFAULT_HOURLY_RATE, ACCOUNTS_CACHE_TTL
+
+
+class Account:
+    """Строка листа "Счета": сотрудник, его ставка, баланс и номер строки в таблице"""
+    __slots__ = ("user_id", "name", "hourly_rate", "balance", "row")
+
+    def __init__(self, user_id, name, hourly_rate, balance, row):
+        self.user_id = user_id
+        self.name = name
+        self.hourly_rate = hourly_rate
+        self.balance = balance
+        self.row = row
+
+    def to_row(self):
+        return [self.user_id, self.name, self.hourly_rate, self.balance]
+
+
+# Кэш user_id -> Account. Локальные изменения записываются в него сразу, ручные правки листа
+# приходят через sheet_sync. Если синхронизация не обновляла кэш ACCOUNTS_CACHE_TTL секунд
+# (или после invalidate), лист перечитывается целиком
+_accounts = {}
+_last_row = 1  # Номер последней занятой строки (первая — заголовок)
+_loaded_at = None
+_lock = threading.Lock()
+
+
+def _to_float(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def is_fresh():
+    return _loaded_at is not None and time.monotonic() - _loaded_at < ACCOUNTS_CACHE_TTL
+
+
+def invalidate():
+    """Помечает кэш устаревшим — при следующем обращении лист будет прочитан заново"""
+    global _loaded_at
+    _loaded_at = None
+
+
+def load(records):
+    """Заполняет кэш по всем строкам листа "Счета" (первая строка — заголовок)"""
+    global _accounts, _last_row, _loaded_at
+    accounts = {}
+    for i, row in enumerate(records[1:], start=2):
+        if not row or not row[0]:
+            continue
+        row = row + [""] * (4 - len(row))
+        accounts[row[0]] = Account(row[0], row[1], _to_float(row[2], DEFAULT_HOURLY_RATE), _to_float(row[3], 0), i)
+    with _lock:
+        _accounts = accounts
+        _last_row = max(len(records), 1)
+        _loaded_at = time.monotonic()
+
+
+def apply_rows(rows):
+    """Учитывает изменённые строки листа [(номер строки, значения)], не перечитывая лист.
+       Кэш, который ещё не загружался, не трогает"""
+    global _last_row, _loaded_at
+    if _loaded_at is None:
+        return
+    with _lock:
+        for number, row in rows:
+            if number == 1:
+                continue  # Заголовок
+            row = list(row) + [""] * (4 - len(row))
+            for account in [a for a in _accounts.values() if a.row == number and a.user_id != row[0]]:
+                del _accounts[account.user_id]  # Строку сотрудника удалили или заменили другим
+            if row[0]:
+                _accounts[row[0]] = Account(row[0], row[1], _to_float(row[2], DEFAULT_HOURLY_RATE),
+                                            _to_float(row[3], 0), number)
+                _last_row = max(_last_row, number)
+        _loaded_at = time.monotonic()
+
+
+def get(user_id):
+    return _accounts.get(str(user_id))
+
+
+def all_accounts():
+    return list(_accounts.values())
+
+
+def add(user_id, name, hourly_rate, balance):
+    """Добавляет сотрудника, записанного в конец листа, и возвращает его Account"""
+    global _last_row
+    with _lock:
+        _last_row += 1
+        account = Account(str(user_id), name, hourly_rate, balance, _last_row)
+        _accounts[account.user_id] = account
+    return account
+
+
+def set_balance(user_id, balance):
+    account = _accounts.get(str(user_id))
+    if account:
+        account.balance = balance
@@ -0,0 +1,182 @@
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from config import ARCHIVE_AFTER_DAYS
+from shift_index import TIME_FORMAT
+import write_queue
+import sheet_sync
+import work_with_sheets
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_TITLE = "Итоги по месяцам"
+SUMMARY_HEADER = ["Месяц", "ID", "Имя", "Смен", "Часы", "Зарплата"]
+
+# Архивирование листа событий и листа "Транзакции": закрытые смены старше ARCHIVE_AFTER_DAYS дней
+# переносятся в помесячные листы ("События 05-2025", "Транзакции 05-2025"), а в основных листах
+# остаются только недавние записи и последняя (в том числе открытая) смена каждого сотрудника.
+# Каждый лист архивируется отдельным шагом: дописать строки в помесячные листы, для событий — пересчитать
+# "Итоги по месяцам" по этим листам, переписать основной лист. Шаг можно повторить после сбоя:
+# строки, которые уже есть в помесячном листе, второй раз не дописываются, а итоги месяца
+# не прибавляются, а считаются заново по всему помесячному листу.
+
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value, TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_or_add_worksheet(title, header, width=0):
+    """Лист с таким названием; новый создаётся с заголовком header и не уже width столбцов"""
+    worksheet = work_with_sheets.get_worksheets().get(title)
+    if worksheet is not None:
+        return work_with_sheets.wrap_worksheet(worksheet)
+    cols = max(len(header), width, len(SUMMARY_HEADER))
+    worksheet = work_with_sheets.wrap_worksheet(work_with_sheets.add_worksheet(title, rows=1000, cols=cols))
+    if header:
+        worksheet.append_row(header)
+    return worksheet
+
+
+def _split_header(records):
+    if records and _parse_time(records[0][0] if records[0] else None) is None:
+        return records[:1], records[1:]
+    return [], records
+
+
+def _split_events(rows, cutoff):
+    """Делит строки событий на остающиеся и архивные (по месяцам)"""
+    last_check_in = {}  # user_id -> номер строки последнего прихода
+    for i, row in enumerate(rows):
+        if len(row) > 3 and row[3] == "Приход":
+            last_check_in[row[1]] = i
+
+    keep, archive = [], defaultdict(list)
+    for i, row in enumerate(rows):
+        event_time = _parse_time(row[0]) if row else None
+        if event_time is None or event_time >= cutoff or len(row) < 4 or i >= last_check_in.get(row[1], 0):
+            keep.append(row)
+        else:
+            archive[event_time.strftime("%m-%Y")].append(row)
+    return keep, archive
+
+
+def _split_by_time(rows, cutoff):
+    keep, archive = [], defaultdict(list)
+    for row in rows:
+        event_time = _parse_time(row[0]) if row else None
+        if event_time is None or event_time >= cutoff:
+            keep.append(row)
+        else:
+            archive[event_time.strftime("%m-%Y")].append(row)
+    return keep, archive
+
+
+def _month_summary(archive):
+    """Строки итогов: смены, часы и зарплата по сотрудникам за каждый месяц"""
+    totals = {}
+    for month, rows in archive.items():
+        for row in rows:
+            if len(row) < 4 or row[3] != "Уход":
+                continue
+            total = totals.setdefault((month, row[1]), [month, row[1], row[2], 0, 0.0, 0.0])
+            total[3] += 1
+            try:
+                total[4] += float(row[4])
+                total[5] += float(row[5])
+            except (IndexError, ValueError):
+                pass
+    return [[month, user_id, name, shifts, round(hours, 2), round(salary, 2)]
+            for month, user_id, name, shifts, hours, salary in totals.values()]
+
+
+def _update_summary(summary):
+    """Записывает итоги в лист "Итоги по месяцам". summary посчитаны по всему помесячному листу,
+       поэтому у каждой пары (месяц, сотрудник) одна строка, значения которой заменяются"""
+    worksheet = _get_or_add_worksheet(SUMMARY_TITLE, SUMMARY_HEADER)
+    rows = {}  # (месяц, user_id) -> номер строки
+    for i, row in enumerate(worksheet.get_all_values(), start=1):
+        if len(row) > 1 and row[0] != SUMMARY_HEADER[0]:
+            rows[(row[0], row[1])] = i
+    updates, appends = [], []
+    for values in summary:
+        i = rows.get((values[0], str(values[1])))
+        if i is None:
+            appends.append(values)
+        else:
+            updates.append({"range": f"A{i}:F{i}", "values": [values]})
+    if updates:
+        worksheet.batch_update(updates)
+    if appends:
+        worksheet.append_rows(appends)
+
+
+def _row_key(row):
+    values = [str(value) for value in row]
+    while values and not values[-1]:
+        values.pop()
+    return tuple(values)
+
+
+def _missing_rows(existing, rows):
+    """Строки rows, которых ещё нет среди existing (повтор после сбоя не дописывает их второй раз)"""
+    left = Counter(_row_key(row) for row in existing)
+    missing = []
+    for row in rows:
+        key = _row_key(row)
+        if left[key]:
+            left[key] -= 1
+        else:
+            missing.append(row)
+    return missing
+
+
+def _rewrite(worksheet, rows, old_length):
+    """Заменяет содержимое листа строками rows"""
+    width = max((len(row) for row in rows), default=1)
+    worksheet.update(range_name="A1", values=[row + [""] * (width - len(row)) for row in rows])
+    if old_length > len(rows):
+        worksheet.delete_rows(len(rows) + 1, old_length)
+
+
+def _archive_sheet(worksheet, prefix, split, cutoff, sync_key=None, summarize=False, renumber=None):
+    """Один шаг архивирования листа. summarize — пересчитать "Итоги по месяцам" (для листа событий),
+       renumber(old_rows) — сообщить, из какой прежней строки пришла каждая строка переписанного листа"""
+    records = worksheet.get_all_values()
+    header, rows = _split_header(records)
+    keep, archive = split(rows, cutoff)
+    if not archive:
+        return archive
+    months = {}  # месяц -> все строки помесячного листа после дописывания
+    for month in sorted(archive, key=lambda m: (m[3:], m[:2])):
+        width = max(len(row) for row in archive[month])
+        target = _get_or_add_worksheet(f"{prefix} {month}", header[0] if header else [], width)
+        existing = target.get_all_values()
+        missing = _missing_rows(existing, archive[month])
+        if missing:
+            target.append_rows(missing)
+        months[month] = existing + missing
+    if summarize:
+        _update_summary(_month_summary(months))  # До перезаписи: иначе при сбое итоги этих строк потерялись бы
+    _rewrite(worksheet, header + keep, len(records))
+    if sync_key:
+        sheet_sync.rewrite(sync_key, records, header + keep)  # Строки листа сдвинулись
+    if renumber:
+        numbers = {id(row): number for number, row in enumerate(records, start=1)}
+        renumber([numbers[id(row)] for row in header + keep])
+    return archive
+
+
+def archive(now=None):
+    """Переносит старые закрытые смены и транзакции в помесячные листы. Возвращает число перенесённых строк"""
+    cutoff = (now or datetime.now()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    write_queue.flush()
+    with write_queue.exclusive():  # Пока листы переписываются, очередь в них не пишет
+        events = _archive_sheet(work_with_sheets.sheet, "События", _split_events, cutoff, "events", summarize=True,
+                                renumber=work_with_sheets.storage.renumber_events)
+        transactions = _archive_sheet(work_with_sheets.sheet_transaction, "Транзакции", _split_by_time, cutoff)
+    moved = sum(len(rows) for rows in events.values()) + sum(len(rows) for rows in transactions.values())
+    logger.info("В архив перенесено строк: %s", moved)
+    return moved
@@ -0,0 +1,72 @@
+import logging
+from datetime import datetime, timedelta
+from config import AUTO_CHECK_OUT_TIME, DEFAULT_LUNCH_TIME
+import write_queue
+import work_with_sheets
+
+logger = logging.getLogger(__name__)
+
+# Автоматическое закрытие забытых смен: в AUTO_CHECK_OUT_TIME все смены, по которым не отмечен "Уход",
+# закрываются ближайшим AUTO_CHECK_OUT_TIME после последнего события (приход в 23:30 при закрытии в 23:00
+# закрывается в 23:00 следующего дня). Незаконченный обед закрывается через DEFAULT_LUNCH_TIME секунд
+# после начала. Часы и зарплата считаются так же, как при обычном уходе.
+# Ежедневный проход запускает только основной процесс (main.start_services). Проход берёт блокировки
+# сотрудников (в режиме SQLite — записи в общей базе, sheets_gateway.user_lock) и под ними заново читает
+# состояние смены из хранилища, поэтому уход не запишется дважды и при ручном /close_shifts в другом процессе.
+
+
+def _check_out_time(day):
+    return datetime.combine(day, datetime.strptime(AUTO_CHECK_OUT_TIME, "%H:%M").time())
+
+
+def next_run(now=None):
+    """Ближайшее время автоматического закрытия смен"""
+    now = now or datetime.now()
+    run_at = _check_out_time(now.date())
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+def _close_time(state):
+    """Время, которым закрывается смена: ближайшее AUTO_CHECK_OUT_TIME не раньше последнего события"""
+    close_time = _check_out_time(state.last_event_time.date())
+    if state.last_event_time > close_time:  # Событие после закрытия — смена закрывается на следующий день
+        close_time += timedelta(days=1)
+    return close_time
+
+
+def find_due(now=None):
+    """user_id незакрытых смен, которые пора закрыть"""
+    now = now or datetime.now()
+    return sorted(user_id for user_id, state in work_with_sheets.storage.get_open_shifts().items()
+                  if _close_time(state) <= now)
+
+
+def close_shifts(user_ids, now=None):
+    """Закрывает смены сотрудников user_ids за один проход.
+       Возвращает [(user_id, имя, время ухода, часы, зарплата, баланс)] по закрытым сменам"""
+    now = now or datetime.now()
+    closed = []
+    with write_queue.exclusive():  # Все записи уходят в таблицу одной пачкой после прохода
+        for user_id in user_ids:
+            state = work_with_sheets.get_shift_state(user_id)  # Перечитываем под блокировкой сотрудника
+            if state is None or state.last_event_type == "Уход":
+                continue  # Сотрудник успел отметить уход сам (или смену закрыл другой процесс)
+            close_time = _close_time(state)
+            if close_time > now:
+                continue
+            account = work_with_sheets.get_account(user_id)
+            name = account.name if account else str(user_id)
+
+            if state.last_event_type == "Начал обед":
+                lunch_end = min(state.last_event_time + timedelta(seconds=DEFAULT_LUNCH_TIME), close_time)
+                work_with_sheets.log_event(user_id, name, "Закончил обед", time=lunch_end)
+
+            work_hours, salary = work_with_sheets.calculate_work_time(user_id, close_time)
+            new_balance = work_with_sheets.update_balance(user_id, salary) if account else None
+            work_with_sheets.log_event(user_id, name, "Уход", time=close_time, work_hours=work_hours, salary=salary)
+            if account:
+                work_with_sheets.add_event_transaction(user_id, name, "Заработок", salary, new_balance)
+            closed.append((user_id, name, close_time, work_hours, salary, new_balance))
+    write_queue.flush()
+    logger.info("Автоматически закрыто смен: %s", len(closed))
+    return closed
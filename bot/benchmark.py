@@ -0,0 +1,237 @@
+"""Нагрузочный прогон бота на локальной имитации Google-таблицы (fake_sheets).
+
+Для каждого размера истории заполняет лист событий прошлыми сменами, затем проигрывает
+рабочий день через обработчики main.py (обновления подаются в Dispatcher, ответы Telegram
+подменены): все сотрудники одновременно нажимают "Приход", затем "Начал обед", "Закончил обед"
+и "Уход", а администратор открывает балансы и выдаёт зарплату. Печатает p50/p99
+задержки по обработчикам и число запросов к таблице на одно действие.
+
+Запуск из каталога bot (config.py лежит в корне репозитория):
+    PYTHONPATH=.. python benchmark.py --employees 50 --sizes 1000,10000,100000,500000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message
+
+import fake_sheets
+from fake_updates import make_update, FIRST_USER_ID
+
+TIME_FORMAT = "%d-%m-%Y %H:%M:%S"
+ADMIN_ID = 1
+
+
+def build_spreadsheet(employees, history_rows, latency, quota):
+    """Создаёт таблицу с employees сотрудниками и примерно history_rows строками закрытых смен"""
+    spreadsheet = fake_sheets.FakeSpreadsheet(latency=latency, quota=quota)
+    users = [(FIRST_USER_ID + i, f"Сотрудник {i}") for i in range(employees)]
+
+    events = [["Время", "ID", "Имя", "Событие", "Часы", "Зарплата"]]
+    days = max(1, history_rows // (4 * employees))
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    for day in range(days):
+        date = start + timedelta(days=day)
+        for user_id, name in users:
+            events.append([(date + timedelta(hours=9)).strftime(TIME_FORMAT), user_id, name, "Приход"])
+            events.append([(date + timedelta(hours=13)).strftime(TIME_FORMAT), user_id, name, "Начал обед"])
+            events.append([(date + timedelta(hours=14)).strftime(TIME_FORMAT), user_id, name, "Закончил обед"])
+            events.append([(date + timedelta(hours=18)).strftime(TIME_FORMAT), user_id, name, "Уход", 8, 8000])
+    spreadsheet.sheet1.rows = [[str(v) for v in row] for row in events]
+
+    spreadsheet.add_worksheet("Счета", values=[["ID", "Имя", "Ставка", "Баланс"]] +
+                              [[user_id, name, 1000, 0] for user_id, name in users])
+    spreadsheet.add_worksheet("Транзакции", values=[["Время", "ID", "Имя", "Тип", "Сумма", "Баланс"]])
+    return spreadsheet, users
+
+
+def use_spreadsheet(spreadsheet, backend):
+    """Переключает work_with_sheets на новую таблицу и свежее хранилище"""
+    import work_with_sheets
+    import write_queue
+    import accounts_cache
+    import shift_index
+    import event_store
+    from storage import SheetsStorage, SqliteStorage
+
+    # Как в боте: запросы идут через планировщик квоты и замеряются метриками
+    sheet = work_with_sheets.wrap_worksheet(spreadsheet.sheet1)
+    sheet_accounts = work_with_sheets.wrap_worksheet(spreadsheet.worksheet("Счета"))
+    sheet_transaction = work_with_sheets.wrap_worksheet(spreadsheet.worksheet("Транзакции"))
+    write_queue.register("events", sheet)
+    write_queue.register("accounts", sheet_accounts)
+    write_queue.register("transactions", sheet_transaction)
+    accounts_cache.invalidate()
+    shift_index.reset()
+    event_store.reset()
+    if backend == "sqlite":
+        work_with_sheets.storage = SqliteStorage(":memory:", sheet, sheet_accounts, sheet_transaction)
+    else:
+        work_with_sheets.storage = SheetsStorage(sheet, sheet_accounts)
+
+
+class FakeSession(BaseSession):
+    """Сессия Telegram без сети: на любой запрос отвечает успехом и запоминает отправленные тексты"""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.sent.append((method.chat_id, method.text))
+            return Message(message_id=1, date=datetime.now(), chat=Chat(id=method.chat_id, type="private"),
+                           text=method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_callback(user_id, data):
+    """Обновление с нажатием inline-кнопки под сообщением бота"""
+    update = make_update(user_id, "")
+    message = update.pop("message")
+    return {"update_id": update["update_id"],
+            "callback_query": {"id": str(update["update_id"]), "from": message["from"], "chat_instance": "1",
+                               "message": message, "data": data}}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def run_day(main, spreadsheet, users, backend):
+    """Проигрывает один рабочий день через обработчики main.py и возвращает задержки, запросы к таблице,
+       ошибки и память под события"""
+    import sheets_gateway
+    import write_queue
+    from buttons import PayCallback
+
+    latencies = defaultdict(list)
+    calls = defaultdict(Counter)
+    errors = Counter()
+
+    async def feed(handler, update):
+        started = time.perf_counter()
+        try:
+            await main.dp.feed_raw_update(main.bot, update)
+        except Exception as e:
+            errors[f"{handler}: {type(e).__name__}"] += 1
+        latencies[handler].append(time.perf_counter() - started)
+
+    async def phase(handler, *coroutines):
+        """Выполняет обращения одновременно, как если бы их прислали разные пользователи"""
+        before = Counter(spreadsheet.stats)
+        await asyncio.gather(*coroutines)
+        calls[handler].update(spreadsheet.stats - before)
+
+    async def timed(handler, func):
+        started = time.perf_counter()
+        await func()
+        latencies[handler].append(time.perf_counter() - started)
+
+    use_spreadsheet(spreadsheet, backend)
+    await phase("load_storage", timed("load_storage", sheets_gateway.load_storage))
+    memory = None
+    if backend == "sheets":
+        import event_store
+        rows = spreadsheet.sheet1.rows
+        raw = sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows)
+        memory = raw, event_store.memory_bytes()
+
+    sent = len(main.bot.session.sent)
+    for action in ["Приход", "Начал обед", "Закончил обед", "Уход"]:
+        handler = f"worker_action:{action}"
+        await phase(handler, *(feed(handler, make_update(user_id, action)) for user_id, _ in users))
+        await phase("write_queue.flush", timed("write_queue.flush", lambda: asyncio.to_thread(write_queue.flush)))
+    failed = [text for chat_id, text in main.bot.session.sent[sent:] if text.startswith("Не получилось")]
+    if failed:
+        errors[f"worker_action: {failed[0]}"] += len(failed)
+
+    await phase("show_all_balances", feed("show_all_balances", make_update(ADMIN_ID, "Просмотреть информацию")))
+    for user_id, _ in users[:10]:  # Диалог администратора: выбор сотрудника, сумма
+        await phase("choose_employee", feed("choose_employee", make_update(ADMIN_ID, "Выдать зарплату")))
+        await phase("enter_salary_amount", feed("enter_salary_amount",
+                                                make_callback(ADMIN_ID, PayCallback(user_id=str(user_id)).pack())))
+        await phase("process_salary_payment", feed("process_salary_payment", make_update(ADMIN_ID, "100")))
+    await phase("write_queue.flush", timed("write_queue.flush", lambda: asyncio.to_thread(write_queue.flush)))
+    return latencies, calls, errors, memory
+
+
+def report(size, latencies, calls, errors, memory):
+    print(f"\n=== История: {size} строк ===")
+    if memory:
+        raw, compact = memory
+        print(f"Память под события: строки листа {raw / 2 ** 20:.1f} МБ, столбцы {compact / 2 ** 20:.1f} МБ "
+              f"({compact / raw:.0%})")
+    print(f"{'обработчик':<30}{'вызовов':>8}{'p50, мс':>10}{'p99, мс':>10}{'запросов/вызов':>16}{'строк/вызов':>13}")
+    for handler, values in latencies.items():
+        count = len(values)
+        requests = sum(v for k, v in calls[handler].items() if not k.startswith("rows_"))
+        rows = calls[handler]["rows_read"] + calls[handler]["rows_write"]
+        print(f"{handler:<30}{count:>8}{percentile(values, 0.5) * 1000:>10.1f}{percentile(values, 0.99) * 1000:>10.1f}"
+              f"{requests / count:>16.2f}{rows / count:>13.0f}")
+    for error, count in errors.items():
+        print(f"ошибка {error}: {count}")
+
+
+def prepare(quota):
+    """Готовит main.py к прогону: временные файлы, администратор, Telegram без сети
+       и квота планировщика под квоту имитации таблицы"""
+    import config
+    data_dir = tempfile.mkdtemp()
+    config.TOKEN = config.TOKEN or "42:BENCHMARK"
+    config.ADMINS_ID = [ADMIN_ID]
+    config.WRITE_JOURNAL_PATH = os.path.join(data_dir, "write_journal.jsonl")
+    config.FSM_STORAGE_PATH = os.path.join(data_dir, "fsm.db")
+    config.LEDGER_PATH = os.path.join(data_dir, "ledger.jsonl")  # Не пишем прогон в журнал балансов бота
+    config.LEDGER_SNAPSHOT_PATH = os.path.join(data_dir, "ledger_snapshot.json")
+    config.NOTIFY_CHAT_INTERVAL, config.NOTIFY_GLOBAL_RATE = 0, 10 ** 6  # Уведомления не ждут лимитов Telegram
+    import main
+    import notifier
+    import sheets_scheduler
+    for kind in sheets_scheduler._buckets:  # Планировщик не даёт имитации ответить 429, как и настоящей таблице
+        sheets_scheduler._buckets[kind] = sheets_scheduler.TokenBucket(quota, config.SHEETS_BURST)
+    main.bot.session = FakeSession()
+    notifier.start(main.bot)
+    return main
+
+
+async def run(args):
+    latency = fake_sheets.LatencyModel(scale=args.latency_scale)
+    quota = fake_sheets.Quota(args.quota, args.quota)
+    spreadsheet, _ = build_spreadsheet(args.employees, 0, latency, quota)
+    fake_sheets.install(spreadsheet)  # Подключение, которое откроет work_with_sheets.connect
+    main = prepare(args.quota)
+    try:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            spreadsheet, users = build_spreadsheet(args.employees, size, latency, quota)
+            report(size, *await run_day(main, spreadsheet, users, args.backend))
+    finally:
+        await main.stop_services()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=50)
+    parser.add_argument("--sizes", default="1000,10000,100000,500000", help="Размеры истории событий, через запятую")
+    parser.add_argument("--backend", choices=["sheets", "sqlite"], default="sheets")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Множитель задержки сети, 0 — без задержек")
+    parser.add_argument("--quota", type=int, default=300, help="Запросов в минуту на чтение и на запись")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
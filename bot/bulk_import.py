@@ -0,0 +1,193 @@
+import csv
+import io
+import logging
+from datetime import datetime
+from shift_index import ShiftState, TIME_FORMAT
+import write_queue
+import work_with_sheets
+
+logger = logging.getLogger(__name__)
+
+# Массовый импорт событий из CSV/XLSX. Строки в формате листа событий: Время, ID, Имя, Событие
+# (имя можно не заполнять — берётся из листа "Счета"). Все события проверяются за один проход
+# по отсортированному списку: порядок Приход → обеды → Уход для каждого сотрудника, начиная
+# с его последней записи в таблице. Часы и зарплата считаются по тем же правилам, что при уходе.
+# Импорт только дописывает историю: события раньше последней записи сотрудника отклоняются, потому что
+# вставка в середину изменила бы уже посчитанные смены, начисления и балансы.
+
+TIME_FORMATS = (TIME_FORMAT, "%d-%m-%Y %H:%M")
+NEXT_EVENTS = {
+    None: ("Приход",),
+    "Уход": ("Приход",),
+    "Приход": ("Начал обед", "Уход"),
+    "Начал обед": ("Закончил обед",),
+    "Закончил обед": ("Начал обед", "Уход"),
+}
+
+
+class ImportPlan:
+    """Результат проверки: строки для записи, итоги по сотрудникам и ошибки"""
+    __slots__ = ("events", "totals", "errors")
+
+    def __init__(self):
+        self.events = []  # [(время, user_id, имя, событие, часы, зарплата)]
+        self.totals = {}  # user_id -> [имя, смен, часов, зарплата]
+        self.errors = []  # [(номер строки, текст)]
+
+
+def read_rows(content, filename):
+    """Читает строки документа: CSV (разделитель определяется автоматически, кодировка UTF-8 или cp1251) или XLSX.
+       Если файл не читается, выбрасывает ValueError"""
+    if filename.lower().endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("Для импорта XLSX нужен пакет openpyxl, отправьте файл в формате CSV")
+        try:
+            workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+            return [["" if value is None else value for value in row]
+                    for row in workbook.active.iter_rows(values_only=True)]
+        except Exception as e:  # Повреждённый файл: BadZipFile, ошибки openpyxl, KeyError из архива
+            raise ValueError(f"файл XLSX повреждён или не является таблицей ({type(e).__name__})")
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = content.decode("cp1251")  # CSV, сохранённый Excel в Windows
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return list(csv.reader(io.StringIO(text), dialect))
+
+
+def _parse_time(value):
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0)
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), time_format)
+        except ValueError:
+            pass
+    return None
+
+
+def parse(rows):
+    """Разбирает строки документа. Возвращает [[номер строки, user_id, время, событие]] и ошибки"""
+    events, errors = [], []
+    now = datetime.now()
+    for line, row in enumerate(rows, start=1):
+        if not any(str(value).strip() for value in row):
+            continue
+        row = list(row) + [""] * (4 - len(row))
+        event_time = _parse_time(row[0])
+        if event_time is None:
+            if line > 1:  # Первая строка может быть заголовком
+                errors.append((line, f"неверное время «{row[0]}»"))
+            continue
+        if event_time > now:
+            errors.append((line, f"время в будущем «{row[0]}»"))
+            continue
+        user_id = str(row[1]).strip()
+        if user_id.endswith(".0"):  # Числа из XLSX
+            user_id = user_id[:-2]
+        event = str(row[3]).strip()
+        if event not in NEXT_EVENTS:
+            errors.append((line, f"неизвестное событие «{event}»"))
+            continue
+        events.append([line, user_id, event_time.strftime(TIME_FORMAT), event])
+    return events, errors
+
+
+def plan(events):
+    """Проверяет события всех сотрудников за один проход и считает часы, зарплату и начисления.
+       События сотрудника с хотя бы одной ошибкой не импортируются"""
+    result = ImportPlan()
+    events = sorted(events, key=lambda e: (e[1], datetime.strptime(e[2], TIME_FORMAT)))  # Сортировка устойчива
+
+    def flush_user(user_events, failed):
+        if not failed:
+            result.events.extend(user_events)
+
+    user_id, state, account, user_events, failed = None, None, None, [], False
+    for line, event_user_id, raw_time, event in events:
+        event_time = datetime.strptime(raw_time, TIME_FORMAT)
+        if event_user_id != user_id:
+            flush_user(user_events, failed)
+            user_id, user_events, failed = event_user_id, [], False
+            account = work_with_sheets.get_account(user_id)
+            current = work_with_sheets.get_shift_state(user_id)
+            state = ShiftState()
+            if current:  # Продолжаем с последней записи сотрудника в таблице
+                state.last_event_type, state.last_event_time = current.last_event_type, current.last_event_time
+                state.check_in, state.lunch_events = current.check_in, list(current.lunch_events)
+            if account is None:
+                result.errors.append((line, f"сотрудник {user_id} не зарегистрирован"))
+                failed = True
+        if failed:
+            continue
+
+        error = None
+        if state.last_event_time and event_time < state.last_event_time:
+            error = f"{event} {raw_time} раньше предыдущей записи {state.last_event_time.strftime(TIME_FORMAT)}"
+        elif event not in NEXT_EVENTS[state.last_event_type]:
+            error = f'"{event}" не может идти после "{state.last_event_type}"'
+        elif event != "Приход" and state.last_event_time.date() != event_time.date():
+            error = f'"{event}" в другой день, чем "{state.last_event_type}"'
+        if error:
+            result.errors.append((line, f"{account.name}: {error}"))
+            failed = True
+            continue
+
+        work_hours = salary = None
+        if event == "Уход":
+            work_hours, salary = work_with_sheets.shift_work_time(state.check_in, state.lunch_events, event_time,
+                                                                   account.hourly_rate)
+        state.apply(event, event_time)
+        user_events.append((event_time, user_id, account.name, event, work_hours, salary))
+    flush_user(user_events, failed)
+
+    result.events.sort(key=lambda e: e[0])  # В таблицу события пишутся в порядке времени
+    for event_time, user_id, name, event, work_hours, salary in result.events:
+        totals = result.totals.setdefault(user_id, [name, 0, 0, 0])
+        if event == "Уход":
+            totals[1] += 1
+            totals[2] = round(totals[2] + work_hours, 2)
+            totals[3] = round(totals[3] + salary, 2)
+    return result
+
+
+def commit(events):
+    """Проверяет события заново (данные могли измениться после предпросмотра) и записывает их одной пачкой.
+       Возвращает ImportPlan с тем, что было записано"""
+    result = plan(events)
+    with write_queue.exclusive():  # Все строки уйдут в таблицу одним append_rows на лист
+        for event_time, user_id, name, event, work_hours, salary in result.events:
+            if event == "Уход":
+                new_balance = work_with_sheets.update_balance(user_id, salary)
+                work_with_sheets.log_event(user_id, name, event, time=event_time, work_hours=work_hours, salary=salary)
+                work_with_sheets.add_event_transaction(user_id, name, "Заработок", salary, new_balance)
+            else:
+                work_with_sheets.log_event(user_id, name, event, time=event_time)
+    write_queue.flush()
+    logger.info("Импортировано событий: %s", len(result.events))
+    return result
+
+
+def format_plan(result, errors=(), limit=30):
+    """Текст предпросмотра импорта (без Markdown: в ошибках встречаются данные из файла)"""
+    shifts = sum(totals[1] for totals in result.totals.values())
+    hours = round(sum(totals[2] for totals in result.totals.values()), 2)
+    salary = round(sum(totals[3] for totals in result.totals.values()), 2)
+    lines = [f"Событий: {len(result.events)}, сотрудников: {len(result.totals)}, смен: {shifts}",
+             f"Часов: {hours}, начислений: {salary} руб."]
+    for name, user_shifts, user_hours, user_salary in list(result.totals.values())[:limit]:
+        lines.append(f"{name}: смен {user_shifts}, {user_hours} ч, {user_salary} руб.")
+    if len(result.totals) > limit:
+        lines.append(f"… и ещё {len(result.totals) - limit}")
+    errors = sorted(list(errors) + result.errors)
+    if errors:
+        lines.append(f"\nОшибки ({len(errors)}). Такие строки и все события сотрудника с ошибкой порядка не импортируются:")
+        lines += [f"строка {line}: {text}" for line, text in errors[:limit]]
+        if len(errors) > limit:
+            lines.append(f"… и ещё {len(errors) - limit}")
+    return "\n".join(lines)[:4000]
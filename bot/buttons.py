@@ -1,6 +1,7 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters.callback_data import CallbackData
-from work_with_sheets import get_all_accounts
+from config import PICKER_PAGE_SIZE
+from sheets_gateway import get_all_accounts
 
 # Кнопки для сотрудников
 worker_kb = ReplyKeyboardMarkup(
@@ -21,18 +22,51 @@ admin_kb = ReplyKeyboardMarkup(
 )
 
 
-# Определяем CallbackData-класс
+# Определяем CallbackData-класс. В callback_data передаётся только ID (ограничение Telegram — 64 байта)
 class PayCallback(CallbackData, prefix="pay"):
     user_id: str
-    name: str
-
-def get_employee_keyboard():
-    """Создаёт выпадающий список сотрудников (имя отображается, но передаётся ID)"""
-    accounts = get_all_accounts()
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=f"{name} ({balance} руб.)", callback_data=PayCallback(user_id=user_id, name=name).pack())]
-            for user_id, name, state, balance in accounts
-        ]
-    )
-    return keyboard
\ No newline at end of file
+
+
+# Переход на другую страницу списка сотрудников
+class PageCallback(CallbackData, prefix="emp_page"):
+    page: int
+    query: str = ""
+
+
+# callback_data ограничен 64 байтами: "emp_page:<страница>:" занимает до 16, остальное — запрос
+MAX_QUERY_BYTES = 40
+
+
+def _clean_query(query):
+    """Запрос для callback_data: без ":" (разделитель полей) и не длиннее MAX_QUERY_BYTES байт в UTF-8"""
+    query = query.casefold().replace(":", "")
+    return query.encode()[:MAX_QUERY_BYTES].decode(errors="ignore")  # Не разрезаем символ посередине
+
+
+def _matches(name, query):
+    """Совпадение по началу имени или фамилии"""
+    return any(word.startswith(query) for word in name.casefold().split())
+
+
+async def get_employee_keyboard(page=0, query=""):
+    """Создаёт постраничный список сотрудников (имя отображается, но передаётся ID).
+       query — начало имени или фамилии для поиска"""
+    query = _clean_query(query)
+    accounts = sorted((row for row in await get_all_accounts() if not query or _matches(row[1], query)),
+                      key=lambda row: row[1].casefold())
+    pages = max(1, -(-len(accounts) // PICKER_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+
+    buttons = [
+        [InlineKeyboardButton(text=f"{name} ({balance} руб.)", callback_data=PayCallback(user_id=user_id).pack())]
+        for user_id, name, rate, balance in accounts[page * PICKER_PAGE_SIZE:(page + 1) * PICKER_PAGE_SIZE]
+    ]
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="◀️", callback_data=PageCallback(page=page - 1, query=query).pack()))
+        navigation.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(text="▶️", callback_data=PageCallback(page=page + 1, query=query).pack()))
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -0,0 +1,327 @@
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time
+from shift_index import TIME_FORMAT
+
+# Компактное хранилище событий листа в памяти. Вместо списка строк из get_all_values
+# события лежат по столбцам в массивах array: время (секунды эпохи), номер сотрудника,
+# код типа события, часы и зарплата. Время разбирается один раз при загрузке.
+# Для каждого сотрудника хранятся отсортированные по времени позиции его событий,
+# поэтому события сотрудника за период находятся двоичным поиском.
+# Для строк листа событий запоминается, какое событие в какой строке: ручная правка строки заменяет
+# именно это событие. Номер строки своей записи становится известен, когда очередь её отправит.
+
+_lock = threading.Lock()
+_built = False
+_ts = array("q")  # Время события, секунды эпохи
+_users = array("l")  # Номер сотрудника в _user_ids
+_types = array("h")  # Номер типа события в _type_names
+_hours = array("d")  # Часы для "Уход", иначе NaN
+_salary = array("d")  # Зарплата для "Уход", иначе NaN
+_user_ids = []  # номер -> user_id
+_user_numbers = {}  # user_id -> номер
+_type_names = []  # код -> тип события
+_type_codes = {}  # тип события -> код
+_by_user = {}  # номер сотрудника -> (array времени, array позиций), по возрастанию времени
+_rows = array("l")  # Позиция -> строка листа; UNKNOWN_ROW — ещё не отправлена, NO_ROW — не в листе (архив)
+_by_row = array("l")  # Строка листа - 1 -> позиция или -1
+
+UNKNOWN_ROW = 0
+NO_ROW = -1
+DELETED = -1  # Код типа события, строка которого очищена вручную: в выборки и replay не попадает
+
+
+class Event:
+    """Событие сотрудника"""
+    __slots__ = ("time", "event", "work_hours", "salary")
+
+    def __init__(self, time, event, work_hours=None, salary=None):
+        self.time = time
+        self.event = event
+        self.work_hours = work_hours
+        self.salary = salary
+
+    def __repr__(self):
+        return f"Event({self.time:%d-%m-%Y %H:%M:%S}, {self.event!r}, {self.work_hours!r}, {self.salary!r})"
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _parse_ts(value, hours):
+    """Время строки листа в секундах эпохи. hours — кэш начала часа ("ДД-ММ-ГГГГ ЧЧ" -> секунды эпохи):
+       в истории тысячи строк приходятся на один час, поэтому strptime вызывается один раз на час"""
+    minutes, seconds = value[14:16], value[17:19]
+    if (len(value) != 19 or value[13] != ":" or value[16] != ":" or not minutes.isdigit() or not seconds.isdigit()
+            or minutes > "59" or seconds > "59"):
+        return int(datetime.strptime(value, TIME_FORMAT).timestamp())  # Нестандартная запись
+    hour = value[:13]
+    start = hours.get(hour)
+    if start is None:
+        start = hours[hour] = int(datetime.strptime(hour, "%d-%m-%Y %H").timestamp())
+    return start + int(minutes) * 60 + int(seconds)
+
+
+def _user_number(user_id):
+    number = _user_numbers.get(user_id)
+    if number is None:
+        number = _user_numbers[user_id] = len(_user_ids)
+        _user_ids.append(user_id)
+    return number
+
+
+def _type_code(event_type):
+    code = _type_codes.get(event_type)
+    if code is None:
+        code = _type_codes[event_type] = len(_type_names)
+        _type_names.append(event_type)
+    return code
+
+
+def _append(user_id, event_type, ts, work_hours, salary, row=UNKNOWN_ROW):
+    """Добавляет событие в столбцы (вызывается под _lock)"""
+    number = _user_number(str(user_id))
+    position = len(_ts)
+    _ts.append(ts)
+    _users.append(number)
+    _types.append(_type_code(event_type))
+    _hours.append(_to_float(work_hours))
+    _salary.append(_to_float(salary))
+    _rows.append(row)
+    if row > 0:
+        _map_row(row, position)
+    _index(number, ts, position)
+
+
+def _index(number, ts, position):
+    times, positions = _by_user.setdefault(number, (array("q"), array("l")))
+    if not times or ts >= times[-1]:
+        times.append(ts)
+        positions.append(position)
+    else:  # Событие, добавленное задним числом
+        index = bisect_right(times, ts)
+        times.insert(index, ts)
+        positions.insert(index, position)
+
+
+def _map_row(row, position):
+    while len(_by_row) < row:
+        _by_row.append(-1)
+    _by_row[row - 1] = position
+
+
+def _unindex(position):
+    times, positions = _by_user[_users[position]]
+    index = bisect_left(times, _ts[position])
+    while positions[index] != position:
+        index += 1
+    del times[index]
+    del positions[index]
+
+
+def _reset():
+    global _ts, _users, _types, _hours, _salary, _user_ids, _user_numbers, _type_names, _type_codes, _by_user
+    global _rows, _by_row
+    _ts, _users, _types = array("q"), array("l"), array("h")
+    _hours, _salary = array("d"), array("d")
+    _rows, _by_row = array("l"), array("l")
+    _user_ids, _user_numbers = [], {}
+    _type_names, _type_codes, _by_user = [], {}, {}
+
+
+def is_built():
+    return _built
+
+
+def _parse_row(row, hours):
+    """(время, user_id, тип, часы, зарплата) строки листа или None для заголовка и испорченной строки"""
+    if len(row) < 4:
+        return None
+    try:
+        ts = _parse_ts(row[0], hours)
+    except ValueError:
+        return None
+    return ts, str(row[1]), row[3], row[4] if len(row) > 4 else None, row[5] if len(row) > 5 else None
+
+
+def build(records, sheet_rows=0):
+    """Загружает события из строк листа. Первые sheet_rows строк прочитаны из листа (их номера известны),
+       остальные — ещё не отправленные строки очереди"""
+    global _built
+    hours = {}
+    with _lock:
+        _reset()
+        _by_row.extend(array("l", [-1]) * sheet_rows)
+        for i, row in enumerate(records):
+            if len(row) < 4:
+                continue
+            try:
+                ts = _parse_ts(row[0], hours)
+            except ValueError:
+                continue  # Заголовок или испорченная строка
+            _append(row[1], row[3], ts, row[4] if len(row) > 4 else None,
+                    row[5] if len(row) > 5 else None, i + 1 if i < sheet_rows else UNKNOWN_ROW)
+        _built = True
+
+
+def replay():
+    """Все события в порядке строк листа: (user_id, тип, время)"""
+    for position in range(len(_ts)):
+        if _types[position] != DELETED:
+            yield _user_ids[_users[position]], _type_names[_types[position]], datetime.fromtimestamp(_ts[position])
+
+
+def user_replay(user_id):
+    """События сотрудника в порядке строк листа: [(тип, время)]"""
+    with _lock:
+        number = _user_numbers.get(str(user_id))
+        if number is None:
+            return []
+        return [(_type_names[_types[position]], datetime.fromtimestamp(_ts[position]))
+                for position in sorted(_by_user[number][1])]
+
+
+def reset():
+    """Очищает хранилище — оно будет загружено заново при следующем обращении"""
+    global _built
+    with _lock:
+        _reset()
+        _built = False
+
+
+def append(user_id, event_type, event_time, work_hours=None, salary=None, row=UNKNOWN_ROW):
+    """Учитывает новое событие. row — его строка в листе, если уже известна"""
+    with _lock:
+        _append(user_id, event_type, int(event_time.timestamp()), work_hours, salary, row)
+
+
+def numbered(rows):
+    """Свои строки легли в лист: [(номер строки, значения)]. Событие находится по сотруднику, времени и типу
+       среди тех, чья строка ещё не известна"""
+    hours = {}
+    with _lock:
+        for number, row in rows:
+            parsed = _parse_row(row, hours)
+            user = _user_numbers.get(parsed[1]) if parsed else None
+            if user is None:
+                continue
+            ts, _, event_type, _, _ = parsed
+            times, positions = _by_user[user]
+            index = bisect_left(times, ts)
+            while index < len(times) and times[index] == ts:
+                position = positions[index]
+                if _rows[position] == UNKNOWN_ROW and _type_names[_types[position]] == event_type:
+                    _rows[position] = number
+                    _map_row(number, position)
+                    break
+                index += 1
+
+
+def _day_events(affected):
+    """{(user_id, дата): события сотрудника за этот день} (вызывается под _lock)"""
+    result = {}
+    for user_id, day in affected:
+        start = int(datetime.combine(day, time.min).timestamp())
+        end = int(datetime.combine(day, time.max).timestamp())
+        number = _user_numbers.get(user_id)
+        if number is None:
+            result[(user_id, day)] = []
+            continue
+        times, positions = _by_user[number]
+        result[(user_id, day)] = [_event(position) for position in positions[bisect_left(times, start):
+                                                                              bisect_right(times, end)]]
+    return result
+
+
+def replace_rows(changed):
+    """Заменяет события строк листа, изменённых вручную: [(номер строки, значения)]. Очищенная или
+       испорченная строка удаляет событие, заполненная пустая — добавляет. Возвращает
+       {(user_id, дата): (события дня до правки, после правки)} для каждого затронутого дня сотрудника"""
+    hours = {}
+    with _lock:
+        edits, affected = [], set()
+        for number, row in changed:
+            position = _by_row[number - 1] if number <= len(_by_row) else -1
+            if position >= 0 and _types[position] == DELETED:
+                position = -1
+            parsed = _parse_row(row, hours)
+            if position >= 0:
+                affected.add((_user_ids[_users[position]], datetime.fromtimestamp(_ts[position]).date()))
+            if parsed is not None:
+                affected.add((parsed[1], datetime.fromtimestamp(parsed[0]).date()))
+            edits.append((number, position, parsed))
+        before = _day_events(affected)
+        for number, position, parsed in edits:
+            if position >= 0:
+                _unindex(position)
+            if parsed is None:
+                if position >= 0:
+                    _types[position] = DELETED
+                continue
+            ts, user_id, event_type, work_hours, salary = parsed
+            if position < 0:
+                _append(user_id, event_type, ts, work_hours, salary, number)
+                continue
+            _ts[position] = ts
+            _users[position] = _user_number(user_id)
+            _types[position] = _type_code(event_type)
+            _hours[position] = _to_float(work_hours)
+            _salary[position] = _to_float(salary)
+            _index(_users[position], ts, position)
+        after = _day_events(affected)
+        return {key: (before[key], after[key]) for key in affected}
+
+
+def renumber(old_rows):
+    """Лист переписан (архивирование): old_rows[i] — прежний номер строки, которая теперь в строке i + 1.
+       События строк, которых больше нет в листе, остаются в хранилище без номера строки"""
+    global _by_row
+    with _lock:
+        for position in _by_row:
+            if position >= 0:
+                _rows[position] = NO_ROW
+        by_row = array("l")
+        for new, old in enumerate(old_rows, start=1):
+            position = _by_row[old - 1] if 0 < old <= len(_by_row) else -1
+            by_row.append(position)
+            if position >= 0:
+                _rows[position] = new
+        _by_row = by_row
+
+
+def events(user_id, start=None, end=None):
+    """События сотрудника с start по end включительно (границы можно не задавать), по возрастанию времени"""
+    with _lock:
+        number = _user_numbers.get(str(user_id))
+        if number is None:
+            return []
+        times, positions = _by_user[number]
+        low = bisect_left(times, int(start.timestamp())) if start else 0
+        high = bisect_right(times, int(end.timestamp())) if end else len(times)
+        return [_event(position) for position in positions[low:high]]
+
+
+def _event(position):
+    hours, salary = _hours[position], _salary[position]
+    return Event(datetime.fromtimestamp(_ts[position]), _type_names[_types[position]],
+                 None if math.isnan(hours) else hours, None if math.isnan(salary) else salary)
+
+
+def count():
+    return len(_ts)
+
+
+def memory_bytes():
+    """Примерный объём памяти под столбцы и позиции, в байтах"""
+    with _lock:
+        columns = sum(column.buffer_info()[1] * column.itemsize
+                      for column in (_ts, _users, _types, _hours, _salary, _rows, _by_row))
+        offsets = sum(times.buffer_info()[1] * times.itemsize + positions.buffer_info()[1] * positions.itemsize
+                      for times, positions in _by_user.values())
+        return columns + offsets
@@ -0,0 +1,236 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+
+# Локальная имитация Google-таблицы с интерфейсом gspread: хранит строки в памяти,
+# добавляет задержку сети, считает запросы и, как настоящий API, отвечает 429 при превышении квоты.
+# Используется в benchmark.py, чтобы измерять бота без доступа к сети.
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeAPIError(Exception):
+    """Ошибка API с тем же набором полей, что у gspread.exceptions.APIError"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.response = FakeResponse(code)
+
+
+class LatencyModel:
+    """Задержка запроса: базовое время ответа плюс время на передачу каждой строки"""
+
+    def __init__(self, base=0.15, per_row=0.000002, scale=1.0):
+        self.base = base
+        self.per_row = per_row
+        self.scale = scale  # 0 — без задержек, только подсчёт запросов
+
+    def wait(self, rows):
+        if self.scale:
+            time.sleep(self.scale * (self.base + self.per_row * rows))
+
+
+class Quota:
+    """Квота запросов в минуту (по умолчанию как у Sheets API: 300 чтений и 300 записей)"""
+
+    def __init__(self, reads_per_minute=300, writes_per_minute=300):
+        self.limits = {"read": reads_per_minute, "write": writes_per_minute}
+        self.calls = {"read": deque(), "write": deque()}
+        self.lock = threading.Lock()
+
+    def take(self, kind):
+        now = time.monotonic()
+        with self.lock:
+            calls = self.calls[kind]
+            while calls and now - calls[0] >= 60:
+                calls.popleft()
+            if len(calls) >= self.limits[kind]:
+                raise FakeAPIError(429, f"Quota exceeded for {kind} requests per minute")
+            calls.append(now)
+
+
+def _a1_to_rowcol(label):
+    letters, digits = re.match(r"([A-Z]+)(\d+)", label.upper()).groups()
+    col = 0
+    for char in letters:
+        col = col * 26 + ord(char) - ord("A") + 1
+    return int(digits), col
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, rows=None, grid_rows=0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.rows = [[str(v) for v in row] for row in rows or []]
+        self.grid_rows = grid_rows  # Размер сетки листа: строки за её пределами не читаются и не пишутся
+        self.lock = threading.Lock()
+
+    def _request(self, kind, method, rows):
+        self.spreadsheet.quota.take(kind)
+        if kind == "write":
+            self.spreadsheet.revision += 1
+        self.spreadsheet.latency.wait(rows)
+        stats = self.spreadsheet.stats
+        stats[method] += 1
+        stats[f"rows_{kind}"] += rows
+
+    @property
+    def row_count(self):
+        return max(self.grid_rows, len(self.rows))
+
+    def _check_grid(self, range_name, *rows):
+        """Как и API, отклоняет диапазон, выходящий за сетку листа"""
+        if max(rows) > self.row_count:
+            raise FakeAPIError(400, f"Range ('{self.title}'!{range_name}) exceeds grid limits. "
+                                    f"Max rows: {self.row_count}")
+
+    def get_all_values(self, **kwargs):
+        self._request("read", "get_all_values", len(self.rows))
+        with self.lock:
+            return [list(row) for row in self.rows]
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        self._request("write", "append_rows" if len(values) > 1 else "append_row", len(values))
+        with self.lock:
+            # Как и в Sheets, строки дописываются после последней непустой строки
+            while self.rows and not any(self.rows[-1]):
+                self.rows.pop()
+            start = len(self.rows) + 1
+            self.rows.extend([str(v) for v in row] for row in values)
+            self.grid_rows = self.row_count  # Не хватило сетки — лист растёт на недостающие строки
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:Z{start + len(values) - 1}"}}
+
+    def _range(self, range_name):
+        """Строки диапазона вида "A10:F20" или "A10:F" (до конца листа), без пустых строк в конце"""
+        first, _, last = range_name.partition(":")
+        start = _a1_to_rowcol(first)[0]
+        end = int(re.sub(r"[A-Z]", "", last.upper()) or len(self.rows)) if last else start
+        self._check_grid(range_name, start, end)
+        rows = [list(row) for row in self.rows[start - 1:end]]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    def get(self, range_name, **kwargs):
+        with self.lock:
+            rows = self._range(range_name)
+        self._request("read", "get", len(rows))
+        return rows
+
+    def col_values(self, col, **kwargs):
+        with self.lock:
+            values = [row[col - 1] if len(row) >= col else "" for row in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        self._request("read", "col_values", len(values))
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        with self.lock:
+            result = [self._range(range_name) for range_name in ranges]
+        self._request("read", "batch_get", sum(len(rows) for rows in result))
+        return result
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        cells.extend([""] * (col - len(cells)))
+        cells[col - 1] = str(value)
+
+    def update_cell(self, row, col, value):
+        self._request("write", "update_cell", 1)
+        with self.lock:
+            self._check_grid(f"R{row}C{col}", row)
+            self._set(row, col, value)
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._request("write", "update", len(values))
+        row, col = _a1_to_rowcol((range_name or "A1").split(":")[0])
+        with self.lock:
+            self._check_grid(range_name or "A1", row + len(values) - 1)
+            for i, cells in enumerate(values):
+                for j, value in enumerate(cells):
+                    self._set(row + i, col + j, value)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._request("write", "delete_rows", 0)
+        with self.lock:
+            end_index = min(end_index or start_index, self.row_count)
+            self.grid_rows = self.row_count - max(0, end_index - start_index + 1)
+            del self.rows[start_index - 1:end_index]
+
+    def batch_update(self, data, **kwargs):
+        self._request("write", "batch_update", len(data))
+        with self.lock:
+            for item in data:
+                row, col = _a1_to_rowcol(item["range"].split(":")[0])
+                self._check_grid(item["range"], row + len(item["values"]) - 1)
+            for item in data:
+                row, col = _a1_to_rowcol(item["range"].split(":")[0])
+                for i, values in enumerate(item["values"]):
+                    for j, value in enumerate(values):
+                        self._set(row + i, col + j, value)
+
+
+class FakeSpreadsheet:
+    title = "Таблица"
+
+    def __init__(self, latency=None, quota=None):
+        self.latency = latency or LatencyModel()
+        self.quota = quota or Quota()
+        self.stats = Counter()
+        self.revision = 0  # Растёт при каждой записи, как modifiedTime файла в Drive
+        self.worksheets_by_title = {}
+        self.sheet1 = self.add_worksheet("Лист1")
+
+    def add_worksheet(self, title, rows=1000, cols=26, values=None, **kwargs):
+        worksheet = FakeWorksheet(self, title, values, rows)
+        self.worksheets_by_title[title] = worksheet
+        return worksheet
+
+    def worksheet(self, title):
+        return self.worksheets_by_title[title]
+
+    def worksheets(self):
+        return list(self.worksheets_by_title.values())
+
+    def values_batch_get(self, ranges, params=None):
+        """Диапазоны разных листов ("'Лист'!A1:F10") одним запросом, в формате ответа Sheets API"""
+        value_ranges = []
+        for range_name in ranges:
+            title, _, cells = range_name.rpartition("!")
+            worksheet = self.worksheets_by_title[title.strip("'").replace("''", "'")]
+            with worksheet.lock:
+                rows = worksheet._range(cells)
+            value_ranges.append({"range": range_name, "values": rows} if rows else {"range": range_name})
+        worksheet._request("read", "values_batch_get", sum(len(item.get("values", [])) for item in value_ranges))
+        return {"valueRanges": value_ranges}
+
+    def get_lastUpdateTime(self):
+        self.stats["get_lastUpdateTime"] += 1
+        return str(self.revision)
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, name):
+        return self.spreadsheet
+
+
+def install(spreadsheet):
+    """Подменяет авторизацию gspread, чтобы work_with_sheets работал с имитацией таблицы"""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+    gspread.authorize = lambda creds: FakeClient(spreadsheet)
+    ServiceAccountCredentials.from_json_keyfile_name = classmethod(lambda cls, *args, **kwargs: None)
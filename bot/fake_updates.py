@@ -0,0 +1,69 @@
+"""Локальный источник обновлений Telegram для проверки режима webhook без Telegram.
+
+Отправляет на webhook обновления, как если бы employees сотрудников одновременно нажимали
+"Приход", "Начал обед", "Закончил обед" и "Уход", и печатает скорость приёма и скорость обработки:
+после приёма ждёт, пока процессы-обработчики закончат все отправленные обновления.
+
+Запуск из каталога bot (webhook.py уже запущен):
+    PYTHONPATH=.. python fake_updates.py --employees 200
+"""
+import argparse
+import asyncio
+import itertools
+import time
+import aiohttp
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+FIRST_USER_ID = 100000
+_update_ids = itertools.count(1)
+
+
+def make_update(user_id, text):
+    """Обновление с текстовым сообщением в том же формате, что присылает Telegram"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"Сотрудник {user_id - FIRST_USER_ID}"}
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=200)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--timeout", type=float, default=300, help="Сколько ждать обработки, в секундах")
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    users = [FIRST_USER_ID + i for i in range(args.employees)]
+    async with aiohttp.ClientSession(headers=headers) as session:
+
+        async def processed():
+            async with session.get(args.url + "/processed") as response:
+                return int(await response.text())
+
+        for text in ["/start", "Приход", "Начал обед", "Закончил обед", "Уход"]:
+            target = await processed() + len(users)
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(session.post(args.url, json=make_update(user_id, text))
+                                               for user_id in users))
+            accepted = time.perf_counter() - started
+            failed = sum(1 for response in responses if response.status != 200)
+            target -= failed
+            while await processed() < target and time.perf_counter() - started < args.timeout:
+                await asyncio.sleep(0.05)
+            done = await processed()
+            elapsed = time.perf_counter() - started
+            print(f"{text}: {len(users)} обновлений, приём {accepted:.2f} с ({len(users) / accepted:.0f}/с), "
+                  f"обработка {elapsed:.2f} с ({len(users) / elapsed:.0f}/с), ошибок приёма {failed}"
+                  + ("" if done >= target else f", не обработано за {args.timeout} с: {target - done}"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from config import FSM_STORAGE_PATH, FSM_FLUSH_INTERVAL, FSM_STATE_TTL
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_updated ON fsm (updated_at);
+"""
+
+
+def _key(key: StorageKey):
+    return ":".join(str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                           key.business_connection_id, key.destiny))
+
+
+class SqliteFSMStorage(BaseStorage):
+    """Хранилище состояний диалогов (выплата, ручная запись) в SQLite.
+
+    Все состояния держатся в памяти: чтение и запись — обращение к словарю. Изменённые ключи
+    раз в FSM_FLUSH_INTERVAL секунд записываются в базу одной транзакцией, поэтому
+    незаконченный диалог переживает перезапуск. Диалоги, не менявшиеся дольше FSM_STATE_TTL
+    секунд, считаются брошенными и удаляются.
+
+    В режиме webhook обновления одного пользователя всегда обрабатывает один процесс, так что
+    у каждого ключа один хозяин и кэши процессов не расходятся; база у процессов общая.
+    """
+
+    def __init__(self, path=FSM_STORAGE_PATH, flush_interval=FSM_FLUSH_INTERVAL, ttl=FSM_STATE_TTL):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self._cache = {}  # ключ -> [state, data, updated_at]
+        self._dirty = set()
+        self._task = None
+        self._load()
+
+    def _load(self):
+        """Загружает из базы все незаконченные диалоги, брошенные удаляет"""
+        deadline = time.time() - self.ttl
+        with self.lock:
+            self.db.execute("DELETE FROM fsm WHERE updated_at < ?", (deadline,))
+            self.db.commit()
+            for key, state, data, updated_at in self.db.execute("SELECT key, state, data, updated_at FROM fsm"):
+                self._cache[key] = [state, json.loads(data), updated_at]
+        if self._cache:
+            logger.info("Восстановлено состояний диалогов: %s", len(self._cache))
+
+    def _entry(self, key):
+        """Запись кэша по ключу; брошенный диалог сбрасывается"""
+        entry = self._cache.get(key)
+        if entry is not None and entry[2] < time.time() - self.ttl:
+            self._cache.pop(key)
+            self._dirty.add(key)
+            entry = None
+        return entry
+
+    def _touch(self, key, state, data):
+        if state is None and not data:
+            self._cache.pop(key, None)  # Пустое состояние не храним
+        else:
+            self._cache[key] = [state, data, time.time()]
+        self._dirty.add(key)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def set_state(self, key: StorageKey, state=None):
+        key = _key(key)
+        entry = self._entry(key)
+        self._touch(key, state.state if isinstance(state, State) else state, entry[1] if entry else {})
+
+    async def get_state(self, key: StorageKey):
+        entry = self._entry(_key(key))
+        return entry[0] if entry else None
+
+    async def set_data(self, key: StorageKey, data):
+        key = _key(key)
+        entry = self._entry(key)
+        self._touch(key, entry[0] if entry else None, dict(data))
+
+    async def get_data(self, key: StorageKey):
+        entry = self._entry(_key(key))
+        return dict(entry[1]) if entry else {}
+
+    def _write(self, rows, deleted):
+        """Одна транзакция на все накопленные изменения"""
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)", rows)
+            self.db.executemany("DELETE FROM fsm WHERE key = ?", deleted)
+            self.db.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.ttl,))
+            self.db.commit()
+
+    async def flush(self):
+        """Записывает изменённые состояния в базу"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows, deleted = [], []
+        for key in dirty:
+            entry = self._cache.get(key)
+            if entry is None:
+                deleted.append((key,))
+            else:
+                rows.append((key, entry[0], json.dumps(entry[1], ensure_ascii=False), entry[2]))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows, deleted)
+        except Exception as e:
+            self._dirty |= dirty  # Повторим в следующий раз
+            logger.error("Не удалось сохранить состояния диалогов: %s", e)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        if self.db is None:
+            return
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        with self.lock:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+from datetime import datetime
+from config import LEDGER_PATH, LEDGER_SNAPSHOT_PATH, LEDGER_SNAPSHOT_EVERY
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки файла, журнал может вести только один процесс
+    fcntl = None
+
+# Журнал изменений баланса — история для проверки: каждое начисление и выплата дописывается в конец
+# файла (с fsync). Баланс ведёт хранилище (лист "Счета" или база), по журналу он не восстанавливается.
+# Журнал пишется после изменения баланса в хранилище, поэтому при падении между ними запись может
+# потеряться; тогда при следующем изменении баланс в хранилище разойдётся с последним в журнале,
+# и сначала запишется корректировка на разницу — так же учитываются ручные правки баланса в таблице.
+# Все процессы бота (режим webhook) пишут в один файл под блокировкой и перед записью дочитывают
+# записи других процессов, поэтому изменения, сделанные другим процессом, корректировками не считаются.
+# Раз в LEDGER_SNAPSHOT_EVERY записей сохраняется снимок последних балансов со смещением в журнале,
+# чтобы при старте не читать журнал целиком.
+_balances = {}  # user_id -> баланс после последней записи журнала
+_seq = 0  # Номер последней записи журнала
+_offset = 0  # До какого места журнал прочитан
+_since_snapshot = 0
+_journal = None
+_loaded = False
+_lock = threading.Lock()
+_user_locks = {}  # user_id -> threading.Lock
+
+
+def user_lock(user_id):
+    """Блокировка баланса одного сотрудника: изменения разных сотрудников идут параллельно"""
+    with _lock:
+        return _user_locks.setdefault(str(user_id), threading.Lock())
+
+
+def _read_tail():
+    """Дочитывает записи журнала после _offset, в том числе сделанные другими процессами"""
+    global _seq, _offset
+    if not os.path.exists(LEDGER_PATH):
+        return
+    with open(LEDGER_PATH, "rb") as f:
+        f.seek(_offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Строка, недописанная при падении
+            _offset += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry["seq"] <= _seq:
+                continue
+            _balances[entry["user_id"]] = entry["balance"]
+            _seq = entry["seq"]
+
+
+class _FileLock:
+    """Блокировка журнала между процессами"""
+
+    def __enter__(self):
+        if fcntl:
+            fcntl.flock(_journal.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        if fcntl:
+            fcntl.flock(_journal.fileno(), fcntl.LOCK_UN)
+
+
+def _load():
+    """Загружает последние балансы из снимка и хвоста журнала (вызывается под _lock)"""
+    global _balances, _seq, _offset, _journal, _loaded
+    _balances, _seq, _offset = {}, 0, 0
+    _journal = open(LEDGER_PATH, "ab")
+    with _FileLock():
+        if os.path.exists(LEDGER_SNAPSHOT_PATH):
+            with open(LEDGER_SNAPSHOT_PATH, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            _balances, _seq, _offset = snapshot["balances"], snapshot["seq"], snapshot["offset"]
+        _read_tail()
+    _loaded = True
+
+
+def _snapshot():
+    """Сохраняет снимок балансов (вызывается под _lock и блокировкой журнала)"""
+    global _since_snapshot
+    tmp_path = f"{LEDGER_SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"seq": _seq, "offset": _offset, "balances": _balances}, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, LEDGER_SNAPSHOT_PATH)
+    _since_snapshot = 0
+
+
+def load():
+    """Открывает журнал при старте бота"""
+    with _lock:
+        if not _loaded:
+            _load()
+
+
+def _write(entry):
+    """Дописывает запись в журнал (вызывается под _lock и блокировкой журнала, после _read_tail)"""
+    global _seq, _offset, _since_snapshot
+    _seq += 1
+    entry = dict(seq=_seq, time=datetime.now().strftime("%d-%m-%Y %H:%M:%S"), **entry)
+    line = (json.dumps(entry, ensure_ascii=False) + "\n").encode()
+    _journal.write(line)
+    _journal.flush()
+    os.fsync(_journal.fileno())
+    _offset += len(line)
+    _balances[entry["user_id"]] = entry["balance"]
+    _since_snapshot += 1
+    if _since_snapshot >= LEDGER_SNAPSHOT_EVERY:
+        _snapshot()
+
+
+def record(user_id, amount, balance):
+    """Записывает изменение баланса на amount, после которого баланс в хранилище стал balance"""
+    user_id = str(user_id)
+    with _lock:
+        if not _loaded:
+            _load()
+        with _FileLock():
+            _read_tail()
+            opening = balance - amount
+            last = _balances.get(user_id)
+            if last is not None and round(opening - last, 2):
+                _write({"user_id": user_id, "amount": round(opening - last, 2), "balance": opening,
+                        "type": "adjustment"})
+            _write({"user_id": user_id, "amount": amount, "balance": balance})
+        return balance
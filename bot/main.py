@@ -1,18 +1,28 @@
 import logging
 import asyncio
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from config import TOKEN, ADMINS_ID
-from work_with_sheets import *
-from buttons import worker_kb, admin_kb, get_employee_keyboard, PayCallback
+from config import TOKEN, ADMINS_ID, METRICS_HOST, METRICS_PORT, ARCHIVE_INTERVAL, SYNC_INTERVAL
+from datetime import datetime, timedelta
+import sheets_gateway as sheets
+import write_queue
+import metrics
+import notifier
+import auto_close
+import bulk_import
+from fsm_storage import SqliteFSMStorage
+from buttons import worker_kb, admin_kb, get_employee_keyboard, PayCallback, PageCallback
 
 # Логирование
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=SqliteFSMStorage())  # Незаконченные диалоги переживают перезапуск
+dp.message.middleware(metrics.MetricsMiddleware())
+dp.callback_query.middleware(metrics.MetricsMiddleware())
 
 
 @dp.message(Command("start"))
@@ -21,7 +31,7 @@ async def start(message: types.Message):
     user_id = message.from_user.id
     name = message.from_user.full_name
 
-    result = add_user(user_id, name)  # Добавляем пользователя
+    result = await sheets.add_user(user_id, name)  # Добавляем пользователя
     buttons = worker_kb
     if user_id in ADMINS_ID:
         buttons = admin_kb
@@ -33,25 +43,101 @@ async def start(message: types.Message):
 
 
 async def notify_admins(message: str):
-    """Отправляет сообщение всем администраторам"""
-    for admin_id in ADMINS_ID:
-        try:
-            await bot.send_message(admin_id, message, parse_mode="Markdown")
-        except Exception as e:
-            print(f"Ошибка отправки админу {admin_id}: {e}")
+    """Отправляет сообщение всем администраторам в фоне, не задерживая ответ пользователю"""
+    notifier.notify_admins(message)
 
 
 @dp.message(lambda message: message.text == "Просмотреть информацию")
 async def show_all_balances(message: types.Message):
     """Показывает балансы всех сотрудников"""
     if message.from_user.id in ADMINS_ID:
-        balances = get_all_balances()
+        balances = await sheets.get_all_balances()
         text = "\n".join([f"{name}: {balance} руб." for name, balance in balances])
         await message.answer(f"Балансы сотрудников:\n{text}")
     else:
         await message.answer("У вас нет прав администратора.")
 
 
+@dp.message(Command("refresh"))
+async def refresh_accounts(message: types.Message):
+    """Перечитывает лист "Счета" после ручных правок в таблице"""
+    if message.from_user.id in ADMINS_ID:
+        await sheets.reload_accounts()
+        await message.answer("Данные сотрудников обновлены из таблицы.")
+    else:
+        await message.answer("У вас нет прав администратора.")
+
+
+@dp.message(Command("stats"))
+async def show_stats(message: types.Message):
+    """Показывает время работы обработчиков и статистику запросов к таблице"""
+    if message.from_user.id in ADMINS_ID:
+        await message.answer(metrics.summary())
+    else:
+        await message.answer("У вас нет прав администратора.")
+
+
+@dp.message(Command("report"))
+async def show_report(message: types.Message, command: CommandObject):
+    """Отчёт по часам, обедам, заработку и выплатам: /report [day|week|month] [ДД-ММ-ГГГГ]"""
+    if message.from_user.id not in ADMINS_ID:
+        await message.answer("У вас нет прав администратора.")
+        return
+
+    args = (command.args or "").split()
+    period = args[0] if args and args[0] in ("day", "week", "month") else "month"
+    try:
+        date = datetime.strptime(args[-1], "%d-%m-%Y") if args and args[-1][:1].isdigit() else None
+    except ValueError:
+        await message.answer("❌ Неверный формат. Пример: `/report week 03-05-2025`", parse_mode="Markdown")
+        return
+
+    await message.answer(await sheets.get_report(period, date))
+
+
+@dp.message(Command("history"))
+async def show_history(message: types.Message, command: CommandObject):
+    """События сотрудника за период: /history [ДД-ММ-ГГГГ [ДД-ММ-ГГГГ]], по умолчанию — за последние 7 дней"""
+    args = (command.args or "").split()
+    try:
+        dates = [datetime.strptime(arg, "%d-%m-%Y") for arg in args[:2]]
+    except ValueError:
+        await message.answer("❌ Неверный формат. Пример: `/history 01-05-2025 07-05-2025`", parse_mode="Markdown")
+        return
+    start = dates[0] if dates else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=6)
+    end = (dates[1] if len(dates) > 1 else dates[0] if dates else datetime.now()).replace(hour=23, minute=59, second=59)
+
+    events = await sheets.get_events(message.from_user.id, start, end)
+    lines = []
+    for event in events:
+        line = f"{event.time.strftime('%d-%m %H:%M')} {event.event}"
+        if event.work_hours is not None:
+            line += f": {event.work_hours} ч, {event.salary} руб."
+        lines.append(line)
+    period = f"{start.strftime('%d-%m-%Y')} — {end.strftime('%d-%m-%Y')}"
+    await message.answer(f"События за {period}:\n" + ("\n".join(lines[-100:]) if lines else "нет записей"))
+
+
+@dp.message(Command("archive"))
+async def archive_old_records(message: types.Message):
+    """Переносит старые закрытые смены и транзакции в помесячные листы"""
+    if message.from_user.id in ADMINS_ID:
+        moved = await sheets.archive()
+        await message.answer(f"Перенесено в архив строк: {moved}")
+    else:
+        await message.answer("У вас нет прав администратора.")
+
+
+@dp.message(Command("close_shifts"))
+async def close_shifts(message: types.Message):
+    """Закрывает забытые смены, не дожидаясь AUTO_CHECK_OUT_TIME"""
+    if message.from_user.id in ADMINS_ID:
+        closed = await close_open_shifts()
+        await message.answer(f"Закрыто смен: {len(closed)}")
+    else:
+        await message.answer("У вас нет прав администратора.")
+
+
 class SalaryPayment(StatesGroup):
     choosing_employee = State()
     entering_amount = State()
@@ -61,7 +147,8 @@ class SalaryPayment(StatesGroup):
 async def choose_employee(message: types.Message, state: FSMContext):
     """Выбор сотрудника для выдачи зарплаты"""
     if message.from_user.id in ADMINS_ID:
-        await message.answer("Выберите сотрудника:", reply_markup=get_employee_keyboard())
+        await message.answer("Выберите сотрудника или введите начало имени для поиска:",
+                             reply_markup=await get_employee_keyboard())
         await state.set_state(SalaryPayment.choosing_employee)
     else:
         await message.answer("У вас нет прав администратора.")
@@ -71,7 +158,7 @@ async def choose_employee(message: types.Message, state: FSMContext):
 async def enter_salary_amount(call: types.CallbackQuery, state: FSMContext, callback_data: dict):
     """Получаем ID выбранного сотрудника и запрашиваем сумму"""
     user_id = callback_data.user_id  # Получаем ID сотрудника
-    name = get_user_name(user_id)
+    name = await sheets.get_user_name(user_id)
     await state.update_data(user_id=user_id)
 
     await call.message.answer(f"Введите сумму для выплаты *{name}*:", parse_mode="Markdown")
@@ -83,12 +170,14 @@ async def process_salary_payment(message: types.Message, state: FSMContext):
     """Обрабатываем выплату зарплаты"""
     data = await state.get_data()
     user_id = data["user_id"]  # Получаем ID сотрудника
-    name = get_user_name(user_id)
+    name = await sheets.get_user_name(user_id)
     amount = float(message.text)
 
-    new_balance = update_balance(user_id, -amount)
+    async with sheets.user_lock(user_id):  # Выплата не пересечётся с уходом этого же сотрудника
+        new_balance = await sheets.update_balance(user_id, -amount)
+        if new_balance is not None:
+            await sheets.add_event_transaction(int(user_id), name, "Выплата", amount, new_balance)
     if new_balance is not None:
-        add_event_transaction(int(user_id), name, "Выплата", amount, new_balance)
         await message.answer(f"Сотруднику *{name}* выплачено *{amount} руб.*\nНовый баланс: *{new_balance} руб.*",
                              parse_mode="Markdown")
         # Отправляем уведомление сотруднику
@@ -114,7 +203,8 @@ class ManualEntry(StatesGroup):
 @dp.message(lambda message: message.text == "Добавить запись в таблицу")
 async def start_manual_entry(message: types.Message, state: FSMContext):
     if message.from_user.id in ADMINS_ID:
-        await message.answer("Выберите сотрудника для добавления записи:", reply_markup=get_employee_keyboard())
+        await message.answer("Выберите сотрудника для добавления записи или введите начало имени для поиска:",
+                             reply_markup=await get_employee_keyboard())
         await state.set_state(ManualEntry.choosing_employee)
     else:
         await message.answer("У вас нет прав администратора.")
@@ -123,13 +213,98 @@ async def start_manual_entry(message: types.Message, state: FSMContext):
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 
+class BulkImport(StatesGroup):
+    waiting_document = State()
+    confirming = State()
+
+
+@dp.message(Command("import"))
+async def start_bulk_import(message: types.Message, state: FSMContext):
+    """Массовое добавление событий из файла"""
+    if message.from_user.id in ADMINS_ID:
+        await message.answer("Отправьте файл CSV или XLSX со столбцами: Время (`ДД-ММ-ГГГГ HH:MM`), ID, Имя, Событие.\n"
+                             "События сотрудника добавляются только после его последней записи в таблице: "
+                             "вставить смены между уже записанными нельзя, такие строки попадут в ошибки",
+                             parse_mode="Markdown")
+        await state.set_state(BulkImport.waiting_document)
+    else:
+        await message.answer("У вас нет прав администратора.")
+
+
+@dp.message(StateFilter(BulkImport.waiting_document))
+async def preview_bulk_import(message: types.Message, state: FSMContext):
+    """Проверяет файл и показывает, что будет добавлено"""
+    if not message.document:
+        await message.answer("Отправьте файл CSV или XLSX")
+        return
+    try:
+        content = await bot.download(message.document)
+        rows = bulk_import.read_rows(content.read(), message.document.file_name or "")
+    except Exception as e:  # read_rows сообщает о повреждённом файле через ValueError, остальное — сбой загрузки
+        await state.clear()
+        await message.answer(f"❌ Не удалось прочитать файл: {e}")
+        return
+    events, errors = bulk_import.parse(rows)
+    plan = await sheets.plan_import(events)
+    if not plan.events:
+        await message.answer("Нечего импортировать.\n" + bulk_import.format_plan(plan, errors))
+        await state.clear()
+        return
+    await state.update_data(events=events)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Импортировать", callback_data="import_confirm"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="import_cancel"),
+    ]])
+    await message.answer(bulk_import.format_plan(plan, errors), reply_markup=keyboard)
+    await state.set_state(BulkImport.confirming)
+
+
+@dp.callback_query(StateFilter(BulkImport.confirming))
+async def confirm_bulk_import(call: types.CallbackQuery, state: FSMContext):
+    """Записывает события из файла одной пачкой"""
+    data = await state.get_data()
+    await state.clear()
+    await call.answer()
+    if call.data != "import_confirm":
+        await call.message.answer("Импорт отменён.")
+        return
+    plan = await sheets.commit_import(data["events"])
+    await call.message.answer("✅ Импорт завершён.\n" + bulk_import.format_plan(plan))
+    await notify_admins(f"Импортировано событий: {len(plan.events)}, начислено: "
+                        f"{round(sum(totals[3] for totals in plan.totals.values()), 2)} руб.")
+
+
+@dp.callback_query(PageCallback.filter())
+async def change_employee_page(call: types.CallbackQuery, callback_data: PageCallback):
+    """Листает список сотрудников"""
+    keyboard = await get_employee_keyboard(callback_data.page, callback_data.query)
+    await call.message.edit_reply_markup(reply_markup=keyboard)
+    await call.answer()
+
+
+@dp.callback_query(lambda call: call.data == "noop")
+async def ignore_noop(call: types.CallbackQuery):
+    await call.answer()
+
+
+@dp.message(StateFilter(SalaryPayment.choosing_employee, ManualEntry.choosing_employee),
+            lambda message: message.text and not message.text.startswith("/"))
+async def search_employee(message: types.Message):
+    """Ищет сотрудника по началу имени или фамилии"""
+    keyboard = await get_employee_keyboard(query=message.text.strip())
+    if keyboard.inline_keyboard:
+        await message.answer("Найденные сотрудники:", reply_markup=keyboard)
+    else:
+        await message.answer("Сотрудники не найдены. Введите другое имя:")
+
+
 @dp.callback_query(StateFilter(ManualEntry.choosing_employee), PayCallback.filter())
 async def get_manual_entry_text(call: types.CallbackQuery, state: FSMContext, callback_data: dict):
     """Предлагает логичное следующее событие на основе последнего"""
     user_id = callback_data.user_id
-    name = get_user_name(user_id)
+    name = await sheets.get_user_name(user_id)
 
-    last_type, last_time = get_last_event(user_id)
+    last_type, last_time = await sheets.get_last_event(user_id)
     await state.update_data(user_id=user_id, name=name)
 
     # Определим доступные действия
@@ -202,14 +377,15 @@ async def enter_event_time(message: types.Message, state: FSMContext):
         return
 
     if event == "Уход":
-        work_hours, salary = calculate_work_time(user_id, event_time)
-        new_balance = update_balance(user_id, salary)
-        log_event(user_id, name, event, time=event_time, work_hours=work_hours, salary=salary)
-        add_event_transaction(user_id, name, "Заработок", salary, new_balance)
+        async with sheets.user_lock(user_id):
+            work_hours, salary = await sheets.calculate_work_time(user_id, event_time)
+            new_balance = await sheets.update_balance(user_id, salary)
+            await sheets.log_event(user_id, name, event, time=event_time, work_hours=work_hours, salary=salary)
+            await sheets.add_event_transaction(user_id, name, "Заработок", salary, new_balance)
         text = f"✅ Добавлен *Уход* для *{name}* в {event_time.strftime('%H:%M %d-%m-%Y')}\nОтработано: *{work_hours}* ч\nЗарплата: *{salary}* руб.\nТекущий баланс: *{new_balance}* руб."
 
     else:
-        log_event(user_id, name, event, time=event_time)
+        await sheets.log_event(user_id, name, event, time=event_time)
         text = f"Добавлено: *{event}* для *{name}* в {event_time.strftime('%H:%M %d-%m-%Y')}"
 
     await notify_admins(text)
@@ -225,43 +401,123 @@ async def enter_event_time(message: types.Message, state: FSMContext):
 @dp.message(lambda message: message.text in ["Приход", "Уход", "Начал обед", "Закончил обед"])
 async def worker_action(message: types.Message):
     user_id = message.from_user.id
-    name = get_user_name(user_id)
+    name = await sheets.get_user_name(user_id)
     action = message.text
     try:
-        # Проверяем и исправляем предыдущее событие
-        fix_message = check_and_fix_records(user_id, name, action)
-        if fix_message:
-            await message.answer(fix_message)
-            await notify_admins(f'Сотрудник *{name}* выбрал "{action}"" и получил ошибку: \n'
-                                f"_{fix_message}_")
-            return
-
-        if action == "Уход":
-            work_hours, salary = calculate_work_time(user_id)
-            new_balance = update_balance(user_id, salary)
-            log_event(user_id, name, action, work_hours=work_hours, salary=salary)
-            add_event_transaction(user_id, name, "Заработок", salary, new_balance)
-            await message.answer(f"Вы отработали *{work_hours}* часов и заработали *{salary}* руб.\n"
-                                 f"Ваш текущий баланс: *{new_balance} руб.*", parse_mode='Markdown')
-
-            # Уведомляем всех администраторов
-            await notify_admins(f"Сотрудник *{name}* ушёл с работы.\n"
-                                f"Отработано: *{work_hours}* часов\n"
-                                f"Зарплата: *{salary}* руб.\n"
-                                f"Текущий баланс: *{new_balance}* руб.")
-        else:
-            log_event(user_id, name, action)
-            await message.answer(f"Записано: {action}")
-            await notify_admins(f"Сотрудник *{name}* отметил: {action}")
+        # Действия одного сотрудника выполняются по очереди (например, двойное нажатие "Уход")
+        async with sheets.user_lock(user_id):
+            # Проверяем и исправляем предыдущее событие
+            fix_message = await sheets.check_and_fix_records(user_id, name, action)
+            if fix_message:
+                await message.answer(fix_message)
+                await notify_admins(f'Сотрудник *{name}* выбрал "{action}"" и получил ошибку: \n'
+                                    f"_{fix_message}_")
+                return
+
+            if action == "Уход":
+                work_hours, salary = await sheets.calculate_work_time(user_id)
+                new_balance = await sheets.update_balance(user_id, salary)
+                await sheets.log_event(user_id, name, action, work_hours=work_hours, salary=salary)
+                await sheets.add_event_transaction(user_id, name, "Заработок", salary, new_balance)
+                await message.answer(f"Вы отработали *{work_hours}* часов и заработали *{salary}* руб.\n"
+                                     f"Ваш текущий баланс: *{new_balance} руб.*", parse_mode='Markdown')
+
+                # Уведомляем всех администраторов
+                await notify_admins(f"Сотрудник *{name}* ушёл с работы.\n"
+                                    f"Отработано: *{work_hours}* часов\n"
+                                    f"Зарплата: *{salary}* руб.\n"
+                                    f"Текущий баланс: *{new_balance}* руб.")
+            else:
+                await sheets.log_event(user_id, name, action)
+                await message.answer(f"Записано: {action}")
+                await notify_admins(f"Сотрудник *{name}* отметил: {action}")
     except Exception as e:
         print(e)
         await bot.send_message(user_id, f"Не получилось выполнить действие. Ошибка: _{e}_", parse_mode="Markdown")
 
 
+async def archive_periodically():
+    """Раз в ARCHIVE_INTERVAL секунд архивирует старые записи, чтобы основные листы не росли"""
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+        try:
+            await sheets.archive()
+        except Exception as e:
+            logger.exception("Ошибка архивирования: %s", e)
+
+
+async def sync_periodically():
+    """Раз в SYNC_INTERVAL секунд подтягивает ручные правки таблицы"""
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        try:
+            await sheets.sync()
+        except Exception as e:
+            logger.exception("Ошибка синхронизации с таблицей: %s", e)
+
+
+async def close_open_shifts():
+    """Закрывает забытые смены и сообщает о них сотрудникам и администраторам"""
+    closed = await sheets.close_open_shifts()
+    lines = []
+    for user_id, name, close_time, work_hours, salary, new_balance in closed:
+        text = f"Смена закрыта автоматически в {close_time.strftime('%H:%M %d-%m-%Y')}\nОтработано: *{work_hours}* ч\nЗарплата: *{salary}* руб."
+        notifier.send(int(user_id), text)
+        lines.append(f"*{name}*: уход в {close_time.strftime('%H:%M %d-%m-%Y')}, {work_hours} ч, {salary} руб.")
+    if lines:
+        await notify_admins("Автоматически закрыты смены:\n" + "\n".join(lines))
+    return closed
+
+
+async def close_shifts_daily():
+    """Закрывает забытые смены при запуске (если бот был выключен в AUTO_CHECK_OUT_TIME) и затем каждый день"""
+    while True:
+        try:
+            await close_open_shifts()
+        except Exception as e:
+            logger.exception("Ошибка автоматического закрытия смен: %s", e)
+        await asyncio.sleep((auto_close.next_run() - datetime.now()).total_seconds())
+
+
+async def warm_up(notify=True):
+    """Открывает таблицу и загружает данные, пока бот уже принимает сообщения"""
+    try:
+        seconds = await sheets.warm_up()  # Один раз читаем таблицу, дальше данные обновляются локально
+        if notify:
+            await notify_admins(f"Бот запущен, данные загружены за {seconds:.1f} с")
+    except Exception as e:
+        logger.exception("Ошибка загрузки данных из таблицы: %s", e)
+        await notify_admins(f"Бот запущен, но данные из таблицы загрузить не удалось: _{e}_")
+
+
+async def start_services(primary=True):
+    """Запускает фоновые службы бота. primary=False — для дополнительных процессов в режиме webhook"""
+    notifier.start(bot)
+    write_queue.start()  # Досылаем изменения, оставшиеся в журнале после прошлого запуска
+    if METRICS_PORT:
+        await metrics.start_server(METRICS_HOST, METRICS_PORT)  # Метрики в формате Prometheus: /metrics
+    asyncio.create_task(warm_up(notify=primary))  # О запуске сообщает только основной процесс
+    if primary:
+        asyncio.create_task(archive_periodically())
+        asyncio.create_task(close_shifts_daily())
+        if SYNC_INTERVAL:
+            asyncio.create_task(sync_periodically())
+
+
+async def stop_services():
+    await notifier.stop()
+    await dp.storage.close()
+    sheets.shutdown()
+    write_queue.stop()
+
+
 async def main():
-    await notify_admins("Бот запущен")
+    await start_services()
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await stop_services()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from aiogram import BaseMiddleware
+from config import SLOW_CALL_THRESHOLD, SHEETS_QUOTA_PER_MINUTE
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Запросы к Drive API: у них своя квота, в счётчик запросов к таблице за минуту они не входят
+DRIVE_METHODS = {"get_lastUpdateTime"}
+
+# Пользователь и действие, которые вызвали текущий запрос (для журнала медленных вызовов)
+current_call = contextvars.ContextVar("current_call", default=(None, None))
+
+
+class Histogram:
+    """Гистограмма длительностей в формате Prometheus"""
+    __slots__ = ("counts", "total", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+
+_lock = threading.Lock()
+_handler_seconds = {}  # handler -> Histogram
+_handler_errors = {}  # handler -> число ошибок
+_sheets_seconds = {}  # (метод, лист) -> Histogram
+_sheets_rows = {}  # (метод, лист) -> число переданных строк
+_sheets_errors = {}  # (метод, лист, код ошибки) -> число ошибок
+_sheets_recent = deque()  # Время запросов к таблице за последнюю минуту
+
+
+def _log_if_slow(kind, name, seconds):
+    if SLOW_CALL_THRESHOLD and seconds >= SLOW_CALL_THRESHOLD:
+        user_id, action = current_call.get()
+        logger.warning("Медленный %s %s: %.2f с (пользователь %s, действие %s)", kind, name, seconds, user_id, action)
+
+
+def observe_handler(handler, seconds, error=False):
+    with _lock:
+        _handler_seconds.setdefault(handler, Histogram()).observe(seconds)
+        if error:
+            _handler_errors[handler] = _handler_errors.get(handler, 0) + 1
+    _log_if_slow("обработчик", handler, seconds)
+
+
+def observe_sheets_call(method, worksheet, seconds, rows, error_code=None):
+    key = (method, worksheet)
+    now = time.monotonic()
+    with _lock:
+        _sheets_seconds.setdefault(key, Histogram()).observe(seconds)
+        _sheets_rows[key] = _sheets_rows.get(key, 0) + rows
+        if error_code is not None:
+            _sheets_errors[key + (error_code,)] = _sheets_errors.get(key + (error_code,), 0) + 1
+        if method not in DRIVE_METHODS:
+            _sheets_recent.append(now)
+        while _sheets_recent and now - _sheets_recent[0] >= 60:
+            _sheets_recent.popleft()
+    _log_if_slow("запрос к таблице", f"{method} ({worksheet})", seconds)
+
+
+def sheets_requests_last_minute():
+    now = time.monotonic()
+    with _lock:
+        return sum(1 for t in _sheets_recent if now - t < 60)
+
+
+def error_code(e):
+    """Код HTTP-ошибки gspread (429, 500, ...) или имя исключения"""
+    response = getattr(e, "response", None)
+    code = getattr(response, "status_code", None) or getattr(e, "code", None)
+    return str(code) if code else type(e).__name__
+
+
+def _rows_of(method, args, kwargs, result):
+    if method in ("get_all_values", "get_values", "get", "batch_get", "col_values"):
+        return len(result or [])
+    if method == "values_batch_get":
+        return sum(len(value_range.get("values", [])) for value_range in (result or {}).get("valueRanges", []))
+    if method == "append_rows" or method == "batch_update":
+        return len(args[0] if args else kwargs.get("values", kwargs.get("data", [])))
+    return 1
+
+
+class InstrumentedWorksheet:
+    """Обёртка над листом gspread, которая замеряет каждый запрос к таблице"""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, item):
+        attr = getattr(self._worksheet, item)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                # Метод берётся заново при каждом вызове: после переподключения лист может быть другим
+                result = getattr(self._worksheet, item)(*args, **kwargs)
+            except Exception as e:
+                observe_sheets_call(item, self._worksheet.title, time.perf_counter() - started, 0, error_code(e))
+                raise
+            observe_sheets_call(item, self._worksheet.title, time.perf_counter() - started,
+                                _rows_of(item, args, kwargs, result))
+            return result
+        return call
+
+
+def instrument(worksheet):
+    return InstrumentedWorksheet(worksheet)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика aiogram и запоминает пользователя и действие"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        user = getattr(event, "from_user", None)
+        action = getattr(event, "text", None) or getattr(event, "data", None)
+        token = current_call.set((user.id if user else None, action))
+        started = time.perf_counter()
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            observe_handler(name, time.perf_counter() - started, error)
+            current_call.reset(token)
+
+
+def _labels(**labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels.items())
+
+
+def _render_histogram(lines, metric, histogram, labels):
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f"{metric}_bucket{{{labels},le=\"{bound}\"}} {cumulative}")
+    lines.append(f"{metric}_sum{{{labels}}} {histogram.total}")
+    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+
+def render():
+    """Возвращает метрики в текстовом формате Prometheus"""
+    lines = []
+    with _lock:
+        lines.append("# TYPE bot_handler_seconds histogram")
+        for handler, histogram in _handler_seconds.items():
+            _render_histogram(lines, "bot_handler_seconds", histogram, _labels(handler=handler))
+        lines.append("# TYPE bot_handler_errors_total counter")
+        for handler, count in _handler_errors.items():
+            lines.append(f"bot_handler_errors_total{{{_labels(handler=handler)}}} {count}")
+        lines.append("# TYPE bot_sheets_call_seconds histogram")
+        for (method, worksheet), histogram in _sheets_seconds.items():
+            _render_histogram(lines, "bot_sheets_call_seconds", histogram, _labels(method=method, worksheet=worksheet))
+        lines.append("# TYPE bot_sheets_rows_total counter")
+        for (method, worksheet), rows in _sheets_rows.items():
+            lines.append(f"bot_sheets_rows_total{{{_labels(method=method, worksheet=worksheet)}}} {rows}")
+        lines.append("# TYPE bot_sheets_errors_total counter")
+        for (method, worksheet, code), count in _sheets_errors.items():
+            lines.append(f"bot_sheets_errors_total{{{_labels(method=method, worksheet=worksheet, code=code)}}} {count}")
+    lines.append("# TYPE bot_sheets_requests_last_minute gauge")
+    lines.append(f"bot_sheets_requests_last_minute {sheets_requests_last_minute()}")
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Краткая сводка для команды /stats"""
+    lines = ["Обработчики:"]
+    with _lock:
+        for handler, h in sorted(_handler_seconds.items(), key=lambda item: -item[1].total):
+            lines.append(f"{handler}: {h.count} выз., среднее {h.total / h.count * 1000:.0f} мс, "
+                         f"макс {h.max * 1000:.0f} мс, ошибок {_handler_errors.get(handler, 0)}")
+        lines.append("\nЗапросы к таблице:")
+        for (method, worksheet), h in sorted(_sheets_seconds.items(), key=lambda item: -item[1].total):
+            errors = {code: n for (m, w, code), n in _sheets_errors.items() if (m, w) == (method, worksheet)}
+            lines.append(f"{method} ({worksheet}): {h.count} выз., среднее {h.total / h.count * 1000:.0f} мс, "
+                         f"строк {_sheets_rows.get((method, worksheet), 0)}, "
+                         f"ошибок {sum(errors.values())} (429: {errors.get('429', 0)})")
+    lines.append(f"\nЗапросов к таблице за минуту: {sheets_requests_last_minute()} из {SHEETS_QUOTA_PER_MINUTE}")
+    return "\n".join(lines)
+
+
+async def start_server(host, port):
+    """Запускает локальный HTTP-сервер с метриками по адресу /metrics"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from aiogram.exceptions import TelegramRetryAfter
+from config import ADMINS_ID, NOTIFY_CHAT_INTERVAL, NOTIFY_GLOBAL_RATE, NOTIFY_DIGEST_WINDOW
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096  # Ограничение Telegram на длину сообщения
+MAX_ATTEMPTS = 5
+
+# Уведомления отправляются в фоне: у каждого чата своя очередь и своя задача-отправитель,
+# поэтому медленный или недоступный чат не задерживает остальных и ответ сотруднику.
+_bot = None
+_queues = {}  # chat_id -> asyncio.Queue с текстами
+_senders = {}  # chat_id -> задача-отправитель
+_digests = {}  # chat_id -> тексты, накопленные для сводки
+_digest_tasks = {}
+_global_lock = None
+_next_send_at = 0.0
+
+
+def start(bot):
+    global _bot, _global_lock
+    _bot = bot
+    _global_lock = asyncio.Lock()
+
+
+def send(chat_id, text):
+    """Ставит сообщение в очередь отправки (или в сводку, если включён режим сводок)"""
+    if NOTIFY_DIGEST_WINDOW:
+        _digests.setdefault(chat_id, []).append(text)
+        if chat_id not in _digest_tasks:
+            _digest_tasks[chat_id] = asyncio.create_task(_flush_digest(chat_id))
+    else:
+        _enqueue(chat_id, text)
+
+
+def notify_admins(text):
+    """Отправляет сообщение всем администраторам, не дожидаясь доставки"""
+    for admin_id in ADMINS_ID:
+        send(admin_id, text)
+
+
+def _enqueue(chat_id, text):
+    if chat_id not in _queues:
+        _queues[chat_id] = asyncio.Queue()
+        _senders[chat_id] = asyncio.create_task(_sender(chat_id))
+    _queues[chat_id].put_nowait(text)
+
+
+def _enqueue_digest(chat_id, texts):
+    """Ставит в очередь сводку из texts. Длинная сводка делится на сообщения по границам событий,
+       чтобы не разрывать разметку Markdown"""
+    if len(texts) == 1:
+        _enqueue(chat_id, texts[0])
+        return
+    message = f"Сводка событий ({len(texts)}):"
+    for text in texts:
+        if len(message) + len(text) + 2 > MAX_MESSAGE_LENGTH:
+            _enqueue(chat_id, message)
+            message = text
+        else:
+            message += "\n\n" + text
+    _enqueue(chat_id, message)
+
+
+async def _flush_digest(chat_id):
+    """Через NOTIFY_DIGEST_WINDOW секунд объединяет накопленные события в одно сообщение"""
+    await asyncio.sleep(NOTIFY_DIGEST_WINDOW)
+    del _digest_tasks[chat_id]
+    texts = _digests.pop(chat_id, [])
+    if texts:
+        _enqueue_digest(chat_id, texts)
+
+
+async def _wait_global_slot():
+    """Ограничивает общую скорость отправки NOTIFY_GLOBAL_RATE сообщениями в секунду"""
+    global _next_send_at
+    async with _global_lock:
+        loop = asyncio.get_running_loop()
+        delay = _next_send_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        _next_send_at = max(loop.time(), _next_send_at) + 1 / NOTIFY_GLOBAL_RATE
+
+
+async def _deliver(chat_id, text):
+    for attempt in range(MAX_ATTEMPTS):
+        await _wait_global_slot()
+        try:
+            await _bot.send_message(chat_id, text, parse_mode="Markdown")
+            return
+        except TelegramRetryAfter as e:
+            logger.warning("Ограничение Telegram для чата %s, повтор через %s с", chat_id, e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.error("Ошибка отправки в чат %s: %s", chat_id, e)
+            return
+    logger.error("Не удалось отправить сообщение в чат %s после %s попыток", chat_id, MAX_ATTEMPTS)
+
+
+async def _sender(chat_id):
+    queue = _queues[chat_id]
+    while True:
+        text = await queue.get()
+        try:
+            await _deliver(chat_id, text)
+        finally:
+            queue.task_done()
+        await asyncio.sleep(NOTIFY_CHAT_INTERVAL)  # Не чаще одного сообщения в чат за интервал
+
+
+async def stop():
+    """Отправляет накопленные сводки, дожидается очередей и останавливает отправителей"""
+    for chat_id, task in list(_digest_tasks.items()):
+        task.cancel()
+        _digest_tasks.pop(chat_id, None)
+        texts = _digests.pop(chat_id, [])
+        if texts:
+            _enqueue_digest(chat_id, texts)
+    for queue in _queues.values():
+        await queue.join()
+    for task in _senders.values():
+        task.cancel()
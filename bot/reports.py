@@ -0,0 +1,218 @@
+import threading
+from datetime import datetime
+from shift_index import TIME_FORMAT
+
+PERIODS = ("day", "week", "month")
+PERIOD_NAMES = {"day": "день", "week": "неделю", "month": "месяц"}
+
+
+class Totals:
+    """Итоги сотрудника за период"""
+    __slots__ = ("hours", "lunch_seconds", "earnings", "payouts", "shifts")
+
+    def __init__(self):
+        self.hours = 0.0
+        self.lunch_seconds = 0.0
+        self.earnings = 0.0
+        self.payouts = 0.0
+        self.shifts = 0
+
+
+def period_key(period, date):
+    if period == "day":
+        return date.date() if isinstance(date, datetime) else date
+    if period == "week":
+        return tuple(date.isocalendar()[:2])
+    return date.year, date.month
+
+
+# Итоги период -> ключ периода -> сотрудник для дней, недель и месяцев. Строятся одним проходом по истории
+# событий и транзакций, а дальше обновляются при каждой записи в log_event и add_event_transaction.
+_totals = {period: {} for period in PERIODS}
+_names = {}  # user_id -> имя
+_lunch_started = {}  # user_id -> начало текущего обеда
+_lock = threading.Lock()
+_built = False
+
+
+def is_built():
+    return _built
+
+
+def _add(user_id, when, field, value):
+    for period in PERIODS:
+        totals = _totals[period].setdefault(period_key(period, when), {}).setdefault(user_id, Totals())
+        setattr(totals, field, getattr(totals, field) + value)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _apply_event(user_id, name, event, when, work_hours, salary):
+    _names[user_id] = name
+    if event == "Начал обед":
+        _lunch_started[user_id] = when
+    elif event == "Закончил обед":
+        started = _lunch_started.pop(user_id, None)
+        if started:
+            _add(user_id, when, "lunch_seconds", (when - started).total_seconds())
+    elif event == "Уход":
+        _lunch_started.pop(user_id, None)
+        _add(user_id, when, "hours", _to_float(work_hours))
+        _add(user_id, when, "earnings", _to_float(salary))
+        _add(user_id, when, "shifts", 1)
+
+
+def _apply_transaction(user_id, name, type, amount, when):
+    _names.setdefault(user_id, name)
+    if type == "Выплата":
+        _add(user_id, when, "payouts", _to_float(amount))
+
+
+def apply_event(user_id, name, event, when, work_hours=None, salary=None):
+    with _lock:
+        _apply_event(str(user_id), name, event, when, work_hours, salary)
+
+
+def apply_transaction(user_id, name, type, amount, when):
+    with _lock:
+        _apply_transaction(str(user_id), name, type, amount, when)
+
+
+def _day_totals(events):
+    """Итоги по событиям сотрудника (event_store.Event по возрастанию времени): {дата: Totals}"""
+    result, lunch_started = {}, None
+    for event in events:
+        totals = result.setdefault(event.time.date(), Totals())
+        if event.event == "Начал обед":
+            lunch_started = event.time
+        elif event.event == "Закончил обед":
+            if lunch_started:
+                totals.lunch_seconds += (event.time - lunch_started).total_seconds()
+            lunch_started = None
+        elif event.event == "Уход":
+            lunch_started = None
+            totals.hours += _to_float(event.work_hours)
+            totals.earnings += _to_float(event.salary)
+            totals.shifts += 1
+    return result
+
+
+def _add_day(user_id, day, totals, sign):
+    """Прибавляет (sign = 1) или вычитает (sign = -1) итоги событий дня, кроме выплат"""
+    for period in PERIODS:
+        by_user = _totals[period].setdefault(period_key(period, day), {})
+        target = by_user.setdefault(user_id, Totals())
+        for field in ("hours", "lunch_seconds", "earnings", "shifts"):
+            setattr(target, field, getattr(target, field) + sign * getattr(totals, field))
+        if (not target.shifts and not target.payouts
+                and abs(target.hours) + abs(target.earnings) + abs(target.lunch_seconds) < 1e-6):
+            del by_user[user_id]  # После правки у сотрудника не осталось записей за период
+
+
+def replace_events(user_id, before, after):
+    """Заменяет вклад событий сотрудника before на after — события тех же дней до и после ручной правки листа.
+       Записи этих дней, которых нет среди событий (например, в архивных листах), не затрагиваются"""
+    user_id = str(user_id)
+    with _lock:
+        if not _built:
+            return
+        for day, totals in _day_totals(before).items():
+            _add_day(user_id, day, totals, -1)
+        for day, totals in _day_totals(after).items():
+            _add_day(user_id, day, totals, 1)
+
+
+def replace_day(user_id, name, day, events):
+    """Пересчитывает итоги сотрудника за день day по всем его событиям этого дня"""
+    user_id = str(user_id)
+    with _lock:
+        if not _built:
+            return
+        if name:
+            _names.setdefault(user_id, name)
+        current = _totals["day"].get(day, {}).get(user_id)
+        if current is not None:
+            old = Totals()
+            for field in ("hours", "lunch_seconds", "earnings", "shifts"):
+                setattr(old, field, getattr(current, field))
+            _add_day(user_id, day, old, -1)
+        for totals in _day_totals(events).values():
+            _add_day(user_id, day, totals, 1)
+
+
+def _rows_with_time(rows, width):
+    parsed = []
+    for row in rows:
+        if len(row) < 4:
+            continue
+        try:
+            when = datetime.strptime(row[0], TIME_FORMAT)
+        except ValueError:
+            continue  # Заголовок
+        parsed.append((when, row + [""] * (width - len(row))))
+    parsed.sort(key=lambda item: item[0])
+    return parsed
+
+
+def _clear():
+    for period in PERIODS:
+        _totals[period].clear()
+    _names.clear()
+    _lunch_started.clear()
+
+
+def build(event_rows, transaction_rows):
+    """Строит итоги по всей истории событий и транзакций"""
+    global _built
+    with _lock:
+        _clear()
+        for when, row in _rows_with_time(event_rows, 6):
+            _apply_event(row[1], row[2], row[3], when, row[4], row[5])
+        for when, row in _rows_with_time(transaction_rows, 6):
+            _apply_transaction(row[1], row[2], row[3], row[4], when)
+        _built = True
+
+
+def extend(events, transactions):
+    """Добавляет к итогам новые записи: события (время, user_id, имя, событие, часы, зарплата)
+       и транзакции (время, user_id, имя, тип, сумма), каждые по возрастанию времени.
+       Если итоги ещё не строились, строит их по этим записям"""
+    global _built
+    with _lock:
+        if not _built:
+            _clear()
+        for when, user_id, name, event, work_hours, salary in events:
+            _apply_event(str(user_id), name, event, when, work_hours, salary)
+        for when, user_id, name, type, amount in transactions:
+            _apply_transaction(str(user_id), name, type, amount, when)
+        _built = True
+
+
+def report(period, date):
+    """Возвращает [(имя, Totals)] за период, содержащий дату date"""
+    key = period_key(period, date)
+    with _lock:
+        return sorted(((_names.get(user_id, user_id), totals) for user_id, totals in _totals[period].get(key, {}).items()),
+                      key=lambda item: item[0])
+
+
+def format_report(period, date):
+    rows = report(period, date)
+    if period == "day":
+        title = date.strftime("%d-%m-%Y")
+    elif period == "week":
+        title = f"неделю {date.isocalendar()[1]} {date.isocalendar()[0]} г."
+    else:
+        title = date.strftime("%m-%Y")
+    if not rows:
+        return f"За {title} записей нет."
+    lines = [f"Отчёт за {title}:"]
+    for name, t in rows:
+        lines.append(f"{name}: смен {t.shifts}, {round(t.hours, 2)} ч, обед {round(t.lunch_seconds / 3600, 2)} ч, "
+                     f"заработок {round(t.earnings, 2)} руб., выплачено {round(t.payouts, 2)} руб.")
+    return "\n".join(lines)
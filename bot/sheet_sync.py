@@ -0,0 +1,273 @@
+import logging
+import re
+import time
+import zlib
+from array import array
+from config import SYNC_BLOCK_SIZE, SYNC_VERIFY_BLOCKS, SYNC_VERIFY_PERIOD
+import write_queue
+from metrics import error_code
+
+logger = logging.getLogger(__name__)
+
+# Синхронизация с ручными правками таблицы без полного перечитывания листов.
+# Для каждого листа хранится только контрольная сумма каждой строки (8 байт на строку).
+# Раз в SYNC_INTERVAL секунд у Drive запрашивается время последнего изменения файла (через планировщик,
+# у Drive своя квота). Если файл не менялся, из таблицы ничего не читается. Если менялся — одним запросом
+# на все листы (values_batch_get) читаются строки после известного конца каждого листа, блоки со своими
+# непроверенными записями и SYNC_VERIFY_BLOCKS следующих по кругу блоков по SYNC_BLOCK_SIZE строк.
+# Строки, чьи суммы не совпали, считаются изменёнными вручную и передаются хранилищу.
+# Drive не отличает свои изменения от ручных, поэтому каждое изменение файла начинает проверку всего
+# листа по кругу от текущего блока. Пока файл меняется, проверка идёт по SYNC_VERIFY_BLOCKS блоков за
+# синхронизацию; если первое изменение прохода было SYNC_VERIFY_PERIOD секунд назад, а проход не закончен,
+# оставшиеся блоки читаются одним запросом (при SYNC_VERIFY_PERIOD = 0 проход идёт по SYNC_VERIFY_BLOCKS
+# блоков за синхронизацию и после того, как файл перестал меняться).
+# Квота: не больше одного чтения за синхронизацию (12 в минуту при SYNC_INTERVAL = 5 из 60) и только когда
+# файл менялся; плюс одно чтение на окончание прохода раз в SYNC_VERIFY_PERIOD секунд.
+# Сроки: дописанные строки находятся при следующей синхронизации (до SYNC_INTERVAL секунд), правка старой
+# строки — до SYNC_VERIFY_PERIOD + SYNC_INTERVAL секунд.
+# Свои записи из очереди (write_queue) помечаются как ещё не проверенные: при первой проверке
+# их сумма просто запоминается, а не считается ручной правкой.
+
+UNVERIFIED = -1  # Строка записана ботом, её содержимое в таблице ещё не видели
+MISSING = -2  # Строка появилась в таблице (например, перед нашими строками), но ещё не прочитана
+
+_replicas = {}  # ключ листа -> Replica
+_revision = None  # Функция, возвращающая время последнего изменения таблицы
+_read_ranges = None  # Функция, читающая диапазоны нескольких листов одним запросом
+_last_revision = None
+
+
+def _row_hash(row):
+    return zlib.crc32("\x1f".join(str(value) for value in row).rstrip("\x1f").encode())
+
+
+class Replica:
+    """Контрольные суммы строк листа и сведения о том, какие из них нужно проверить"""
+
+    def __init__(self, key, worksheet, last_column, on_sync):
+        self.key = key
+        self.worksheet = worksheet
+        self.last_column = last_column  # Последний столбец, который читается (например, "F")
+        self.on_sync = on_sync  # on_sync(appended, changed): [(номер строки, значения)]
+        self.hashes = None  # Суммы строк листа, None — ещё не известны
+        self.next_block = 0
+        self.verify_left = 0  # Сколько блоков осталось проверить после последнего изменения файла
+        self.deadline = None  # К какому времени (time.monotonic()) проход должен закончиться
+        self.pending_blocks = set()  # Блоки со строками UNVERIFIED или MISSING
+        self.known = 0  # Сколько строк было известно при последнем plan
+        self.blocks = []  # Блоки, выбранные последним plan
+        self.advance = (0, 0)  # Следующий блок круга и остаток круга после чтения блоков plan
+
+    def baseline(self, records):
+        """Запоминает суммы по полностью прочитанному листу"""
+        self.hashes = array("q", (_row_hash(row) for row in records))
+        self.pending_blocks = set()
+        self.verify_left = 0
+        self.deadline = None
+
+    def note_write(self, start_row, count, updated_rows):
+        """Учитывает строки, записанные ботом"""
+        if self.hashes is None:
+            return
+        if count:
+            start = start_row or len(self.hashes) + 1
+            if start > len(self.hashes) + 1:
+                # Перед нашими строками кто-то дописал свои — их прочитаем при следующей синхронизации
+                self._mark(range(len(self.hashes) + 1, start), MISSING)
+            self._mark(range(start, start + count), UNVERIFIED)
+        self._mark(updated_rows, UNVERIFIED)
+
+    def _mark(self, rows, value):
+        for row in rows:
+            while len(self.hashes) < row:
+                self.hashes.append(MISSING)
+            if value == UNVERIFIED or self.hashes[row - 1] != UNVERIFIED:
+                self.hashes[row - 1] = value
+            self.pending_blocks.add((row - 1) // SYNC_BLOCK_SIZE)
+
+    def compare(self, records):
+        """Сравнивает суммы с полностью прочитанным листом. Возвращает (дописанные, изменённые) строки"""
+        appended, changed = [], []
+        for number, row in enumerate(records, start=1):
+            row = list(row)
+            old = self.hashes[number - 1] if number <= len(self.hashes) else MISSING
+            if old == MISSING:
+                appended.append((number, row))
+            elif old != UNVERIFIED and old != _row_hash(row):
+                changed.append((number, row))
+        return appended, changed
+
+    def _pick_blocks(self, total, count):
+        """Блоки для проверки: сначала со своими записями, затем count следующих по кругу.
+           Возвращает (блоки, следующий блок круга, сколько блоков круга останется)"""
+        blocks = [block for block in sorted(self.pending_blocks) if block < total]
+        next_block, verify_left = self.next_block, self.verify_left
+        for _ in range(min(count, total, verify_left)):
+            next_block %= total
+            if next_block not in blocks:
+                blocks.append(next_block)
+            next_block += 1
+            verify_left -= 1
+        return blocks, next_block, verify_left
+
+    def plan(self, modified, now):
+        """Диапазоны для чтения в этой синхронизации (пустой список — читать нечего).
+           modified — файл менялся с прошлой синхронизации, now — time.monotonic()"""
+        known = len(self.hashes)
+        total = (known + SYNC_BLOCK_SIZE - 1) // SYNC_BLOCK_SIZE
+        if modified:
+            self.verify_left = total
+            if self.deadline is None and SYNC_VERIFY_PERIOD:
+                self.deadline = now + SYNC_VERIFY_PERIOD
+            count = SYNC_VERIFY_BLOCKS
+        elif self.verify_left > 0 and not SYNC_VERIFY_PERIOD:
+            count = SYNC_VERIFY_BLOCKS
+        elif self.verify_left > 0 and self.deadline is not None and now >= self.deadline:
+            count = self.verify_left  # Срок прохода вышел: остаток круга одним запросом
+        else:
+            self.blocks = []
+            return []
+        self.known = known
+        # Круг продвигается в apply: если чтение не удалось, те же блоки будут выбраны снова
+        self.blocks, *self.advance = self._pick_blocks(total, count)
+        # Хвост читается с последней известной строки, а не со следующей: если в сетке листа нет
+        # свободных строк (после дописывания их обычно нет), диапазон за её концом API отклоняет
+        ranges = [f"A{max(known, 1)}:{self.last_column}"]
+        for block in self.blocks:
+            start = block * SYNC_BLOCK_SIZE + 1
+            ranges.append(f"A{start}:{self.last_column}{min(start + SYNC_BLOCK_SIZE - 1, known)}")
+        return ranges
+
+    def apply(self, tail, values):
+        """Сверяет прочитанное по plan. Возвращает (дописанные, изменённые) строки"""
+        known = self.known
+        self.next_block, self.verify_left = self.advance
+        if self.verify_left <= 0:
+            self.deadline = None
+        appended, changed = [], []
+        for block, rows in zip(self.blocks, values):
+            start = block * SYNC_BLOCK_SIZE + 1
+            for number in range(start, min(start + SYNC_BLOCK_SIZE, known + 1)):
+                row = list(rows[number - start]) if number - start < len(rows) else []
+                row_hash, old = _row_hash(row), self.hashes[number - 1]
+                self.hashes[number - 1] = row_hash
+                if old == MISSING:
+                    appended.append((number, row))
+                elif old != UNVERIFIED and old != row_hash:
+                    changed.append((number, row))
+            self.pending_blocks.discard(block)
+        for number, row in enumerate(tail[1:] if known else tail, start=known + 1):
+            row = list(row)
+            self.hashes.append(_row_hash(row))
+            appended.append((number, row))
+        appended.sort()  # Строки MISSING идут перед строками хвоста
+        return appended, changed
+
+    def read(self, ranges):
+        """Читает диапазоны plan одним запросом к листу. Возвращает (дописанные, изменённые) строки"""
+        try:
+            tail, *values = self.worksheet.batch_get(ranges)
+        except Exception as e:
+            if error_code(e) != "400":
+                raise
+            # Строки листа удалены вручную, и известный конец за пределами сетки: перечитываем весь лист
+            logger.warning("Лист %s короче известного (%s), перечитываю целиком", self.key, e)
+            records = self.worksheet.get_all_values()
+            appended, changed = self.compare(records)
+            self.baseline(records)
+            return appended, changed
+        return self.apply(tail, values)
+
+
+def register(key, worksheet, last_column, on_sync):
+    """Подключает синхронизацию листа. on_sync(appended, changed) вызывается после каждой синхронизации"""
+    _replicas[key] = Replica(key, worksheet, last_column, on_sync)
+
+
+def set_revision(func):
+    global _revision
+    _revision = func
+
+
+def set_reader(func):
+    """func(["'Лист'!A1:F10", ...]) читает диапазоны разных листов одним запросом и возвращает их строки"""
+    global _read_ranges
+    _read_ranges = func
+
+
+def baseline(key, records):
+    """Запоминает состояние листа, только что прочитанного целиком"""
+    if key in _replicas:
+        _replicas[key].baseline(records)
+
+
+def rewrite(key, records, new_records):
+    """Лист переписан целиком (архивирование) под write_queue.exclusive(). records — прочитанное перед
+       перезаписью: ручные правки в них, ещё не переданные хранилищу, передаются сейчас, иначе после новой
+       точки отсчёта их уже не найти. new_records — записанное, по нему запоминаются суммы.
+       Строки, дописанные вручную между чтением и перезаписью, остаются за концом new_records
+       и находятся следующей синхронизацией как дописанные"""
+    replica = _replicas.get(key)
+    if replica is None:
+        return
+    if replica.hashes is not None:
+        appended, changed = replica.compare(records)
+        if appended or changed:
+            logger.info("Лист %s перед перезаписью: дописано строк %s, изменено %s",
+                        key, len(appended), len(changed))
+            replica.on_sync(appended, changed)
+    replica.baseline(new_records)
+
+
+def _note_flush(key, updated_range, count, updated_rows):
+    replica = _replicas.get(key)
+    if replica is not None:
+        match = re.search(r"![A-Z]+(\d+)", updated_range or "")
+        replica.note_write(int(match.group(1)) if match else None, count, updated_rows)
+
+
+write_queue.set_on_flush(_note_flush)
+
+
+def _title_range(replica, range_name):
+    return "'{}'!{}".format(replica.worksheet.title.replace("'", "''"), range_name)
+
+
+def sync():
+    """Подтягивает ручные правки всех листов. Возвращает число изменённых и дописанных строк"""
+    global _last_revision
+    revision = _revision() if _revision else None
+    modified = revision is None or revision != _last_revision
+    now = time.monotonic()
+    total = 0
+    with write_queue.exclusive():  # Пока листы читаются, наши записи в них не уходят
+        results, plans = {}, []
+        for replica in _replicas.values():
+            if replica.hashes is None:
+                replica.baseline(replica.worksheet.get_all_values())  # Первый запуск: суммы по всему листу
+                continue
+            ranges = replica.plan(modified, now)
+            if ranges:
+                plans.append((replica, ranges))
+        if len(plans) > 1 and _read_ranges:
+            try:
+                values = _read_ranges([_title_range(replica, name) for replica, ranges in plans for name in ranges])
+            except Exception as e:
+                if error_code(e) != "400":
+                    raise
+                values = None  # Диапазон за сеткой одного из листов: каждый лист читается отдельно
+            if values is not None:
+                for replica, ranges in plans:
+                    results[replica.key] = replica.apply(values[0], values[1:len(ranges)])
+                    values = values[len(ranges):]
+        for replica, ranges in plans:
+            if replica.key not in results:
+                results[replica.key] = replica.read(ranges)
+        for replica in _replicas.values():
+            appended, changed = results.get(replica.key, ([], []))
+            if appended or changed:
+                logger.info("Лист %s: дописано строк %s, изменено %s", replica.key, len(appended), len(changed))
+            replica.on_sync(appended, changed)
+            total += len(appended) + len(changed)
+    _last_revision = revision
+    return total
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import contextvars
+import functools
+from contextlib import AsyncExitStack
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from config import SHEETS_MAX_IN_FLIGHT
+import work_with_sheets
+import sheets_scheduler
+import archiver
+import auto_close
+import bulk_import
+import sheet_sync
+import ledger
+from storage import USER_LOCK_TTL
+
+logger = logging.getLogger(__name__)
+
+# Блокирующие вызовы gspread выполняются в отдельном пуле потоков,
+# чтобы медленный запрос к таблице не останавливал обработку остальных сообщений.
+# В пул попадают только вызовы, прошедшие семафор, поэтому потоков в нём столько же, сколько разрешено запросов
+executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_IN_FLIGHT, thread_name_prefix="sheets")
+_in_flight = None  # Семафор создаётся при первом вызове, уже внутри работающего event loop
+_user_locks = {}  # user_id -> _UserLock
+USER_LOCK_POLL = 0.05  # Как часто проверять, не освободил ли сотрудника другой процесс, в секундах
+
+
+def _get_semaphore():
+    global _in_flight
+    if _in_flight is None:
+        _in_flight = asyncio.Semaphore(SHEETS_MAX_IN_FLIGHT)
+    return _in_flight
+
+
+class _UserLock:
+    """asyncio.Lock сотрудника, а если хранилище общее для нескольких процессов (режим webhook) —
+    ещё и блокировка в хранилище: выплату администратора обрабатывает не тот процесс, что уход сотрудника.
+    Блокировка в хранилище продлевается, пока её держат: закрытие смен и импорт ждут записи в таблицу
+    с повторами дольше USER_LOCK_TTL"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock = asyncio.Lock()
+        self.renewal = None
+
+    async def __aenter__(self):
+        await self.lock.acquire()
+        if not work_with_sheets.storage.shared:
+            return
+        try:
+            while not await run(work_with_sheets.storage.lock_user, self.user_id):
+                await asyncio.sleep(USER_LOCK_POLL)
+        except BaseException:
+            self.lock.release()
+            raise
+        self.renewal = asyncio.create_task(self._renew())
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(USER_LOCK_TTL / 3)
+            try:
+                # Без семафора запросов к таблице: продление не должно ждать медленные запросы
+                renewed = await asyncio.to_thread(work_with_sheets.storage.renew_user, self.user_id)
+            except Exception as e:
+                logger.error("Не удалось продлить блокировку сотрудника %s: %s", self.user_id, e)
+                continue
+            if not renewed:
+                logger.error("Блокировка сотрудника %s истекла, пока её держали", self.user_id)
+
+    async def __aexit__(self, *exc_info):
+        try:
+            if self.renewal is not None:
+                self.renewal.cancel()
+                self.renewal = None
+            if work_with_sheets.storage.shared:
+                await run(work_with_sheets.storage.unlock_user, self.user_id)
+        finally:
+            self.lock.release()
+
+
+def user_lock(user_id):
+    """Асинхронная блокировка сотрудника: действия с его балансом выполняются по очереди,
+    а разные сотрудники обслуживаются параллельно"""
+    user_id = str(user_id)
+    if user_id not in _user_locks:
+        _user_locks[user_id] = _UserLock(user_id)
+    return _user_locks[user_id]
+
+
+def _with_priority(priority, func, *args, **kwargs):
+    sheets_scheduler.priority.set(priority)
+    return func(*args, **kwargs)
+
+
+async def run(func, *args, priority=sheets_scheduler.WORKER, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков, ограничивая число одновременных запросов к таблице"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # Чтобы в потоке были видны пользователь и действие для метрик
+    async with _get_semaphore():
+        return await loop.run_in_executor(
+            executor, functools.partial(context.run, _with_priority, priority, func, *args, **kwargs))
+
+
+def _awaitable(func, priority=sheets_scheduler.WORKER):
+    """Создаёт асинхронную версию функции из work_with_sheets"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, priority=priority, **kwargs)
+    return wrapper
+
+
+log_event = _awaitable(work_with_sheets.log_event)
+add_event_transaction = _awaitable(work_with_sheets.add_event_transaction)
+get_user_name = _awaitable(work_with_sheets.get_user_name)
+check_and_fix_records = _awaitable(work_with_sheets.check_and_fix_records)
+calculate_work_time = _awaitable(work_with_sheets.calculate_work_time)
+add_user = _awaitable(work_with_sheets.add_user)
+get_balance = _awaitable(work_with_sheets.get_balance)
+update_balance = _awaitable(work_with_sheets.update_balance)
+get_all_balances = _awaitable(work_with_sheets.get_all_balances, sheets_scheduler.ADMIN)
+get_all_accounts = _awaitable(work_with_sheets.get_all_accounts, sheets_scheduler.ADMIN)
+get_last_event = _awaitable(work_with_sheets.get_last_event)
+get_events = _awaitable(work_with_sheets.get_events)
+load_storage = _awaitable(work_with_sheets.load_storage)
+reload_accounts = _awaitable(work_with_sheets.reload_accounts, sheets_scheduler.ADMIN)
+get_report = _awaitable(work_with_sheets.get_report, sheets_scheduler.ADMIN)
+plan_import = _awaitable(bulk_import.plan, sheets_scheduler.ADMIN)
+archive = _awaitable(archiver.archive, sheets_scheduler.BACKGROUND)
+sync = _awaitable(sheet_sync.sync, sheets_scheduler.BACKGROUND)
+
+
+connect = _awaitable(work_with_sheets.connect)
+
+
+async def close_open_shifts(now=None):
+    """Закрывает забытые смены. На время прохода действия этих сотрудников ждут, чтобы уход не записался дважды"""
+    user_ids = await run(auto_close.find_due, now, priority=sheets_scheduler.BACKGROUND)
+    async with AsyncExitStack() as stack:
+        for user_id in user_ids:  # user_ids отсортированы, поэтому блокировки всегда берутся в одном порядке
+            await stack.enter_async_context(user_lock(user_id))
+        return await run(auto_close.close_shifts, user_ids, now, priority=sheets_scheduler.BACKGROUND)
+
+
+async def commit_import(events):
+    """Записывает импортированные события. На время записи действия этих сотрудников ждут"""
+    async with AsyncExitStack() as stack:
+        for user_id in sorted({event[1] for event in events}):
+            await stack.enter_async_context(user_lock(user_id))
+        return await run(bulk_import.commit, events, priority=sheets_scheduler.ADMIN)
+
+
+async def warm_up():
+    """Открывает таблицу и загружает смены, затем счета. Возвращает время загрузки в секундах"""
+    started = perf_counter()
+    await connect()
+    connected = perf_counter()
+    await asyncio.gather(load_storage(), run(ledger.load))
+    # Только после load_storage: в режиме sqlite он переносит таблицу в пустую базу,
+    # а счета, добавленные раньше, выглядели бы как непустая база, и события не перенеслись бы
+    await reload_accounts()
+    logger.info("Подключение к таблице: %.2f с, загрузка данных: %.2f с",
+                                     connected - started, perf_counter() - connected)
+    return perf_counter() - started
+
+
+def shutdown():
+    """Дожидается завершения запущенных запросов и останавливает пул потоков"""
+    executor.shutdown(wait=True)
@@ -0,0 +1,127 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from config import SHEETS_QUOTA_PER_MINUTE, SHEETS_BURST, SHEETS_MAX_RETRIES, SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_MAX
+from config import DRIVE_QUOTA_PER_MINUTE
+from metrics import error_code, DRIVE_METHODS
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше число, тем раньше запрос получает квоту
+WORKER = 0  # Отметки сотрудников
+BACKGROUND = 1  # Фоновая запись из очереди
+ADMIN = 2  # Просмотр балансов и списков сотрудников
+
+priority = contextvars.ContextVar("sheets_priority", default=BACKGROUND)
+
+READ_METHODS = {"get_all_values", "get_values", "get", "batch_get", "row_values", "col_values", "values_batch_get"}
+# Повтор после 5xx может записать строки второй раз: такие запросы повторяет write_queue, сверив конец листа
+APPEND_METHODS = {"append_row", "append_rows"}
+
+
+class TokenBucket:
+    """Квота запросов в минуту. Ожидающие запросы получают токены в порядке приоритета"""
+
+    def __init__(self, per_minute, capacity):
+        self.rate = per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiters = []  # Куча (приоритет, номер)
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, request_priority):
+        with self.condition:
+            entry = (request_priority, next(self.counter))
+            heapq.heappush(self.waiters, entry)
+            while True:
+                self._refill()
+                if self.waiters[0] == entry:
+                    if self.tokens >= 1:
+                        heapq.heappop(self.waiters)
+                        self.tokens -= 1
+                        self.condition.notify_all()
+                        return
+                    self.condition.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.condition.wait()
+
+    def drain(self):
+        """Обнуляет запас токенов после ответа 429, чтобы остальные запросы тоже притормозили"""
+        with self.condition:
+            self._refill()
+            self.tokens = 0
+
+
+_buckets = {
+    "read": TokenBucket(SHEETS_QUOTA_PER_MINUTE, SHEETS_BURST),
+    "write": TokenBucket(SHEETS_QUOTA_PER_MINUTE, SHEETS_BURST),
+    "drive": TokenBucket(DRIVE_QUOTA_PER_MINUTE, SHEETS_BURST),
+}
+
+
+def _bucket(method):
+    if method in DRIVE_METHODS:
+        return _buckets["drive"]
+    return _buckets["read" if method in READ_METHODS else "write"]
+
+
+_reauthorize = None  # Функция переподключения к таблице, задаётся в work_with_sheets
+
+
+def set_reauthorize(func):
+    global _reauthorize
+    _reauthorize = func
+
+
+def _is_retryable(method, e):
+    code = error_code(e)
+    return code.isdigit() and (code == "429" or 500 <= int(code) < 600 and method not in APPEND_METHODS)
+
+
+def call(method, func, *args, **kwargs):
+    """Выполняет запрос к таблице в пределах квоты, повторяя его при 429 и 5xx с экспоненциальной задержкой
+       (добавление строк при 5xx не повторяется: неизвестно, записались ли они)"""
+    bucket = _bucket(method)
+    for attempt in range(SHEETS_MAX_RETRIES + 1):
+        bucket.acquire(priority.get())
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if error_code(e) == "401" and _reauthorize and attempt < SHEETS_MAX_RETRIES:
+                _reauthorize()  # Токен истёк — переподключаемся и сразу повторяем запрос
+                continue
+            if attempt == SHEETS_MAX_RETRIES or not _is_retryable(method, e):
+                raise
+            if error_code(e) == "429":
+                bucket.drain()
+            delay = random.uniform(0, min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt))
+            logger.warning("Запрос %s вернул %s, повтор через %.1f с", method, error_code(e), delay)
+            time.sleep(delay)
+
+
+class ScheduledWorksheet:
+    """Обёртка над листом, пропускающая все запросы через планировщик"""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, item):
+        attr = getattr(self._worksheet, item)
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: call(item, attr, *args, **kwargs)
+
+
+def schedule(worksheet):
+    return ScheduledWorksheet(worksheet)
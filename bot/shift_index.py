@@ -0,0 +1,84 @@
+import threading
+
+TIME_FORMAT = "%d-%m-%Y %H:%M:%S"
+LUNCH_EVENTS = ("Начал обед", "Закончил обед")
+
+
+class ShiftState:
+    """Состояние смены сотрудника: последнее событие, время прихода и события обеда после него"""
+    __slots__ = ("last_event_type", "last_event_time", "check_in", "lunch_events")
+
+    def __init__(self):
+        self.last_event_type = None
+        self.last_event_time = None
+        self.check_in = None
+        self.lunch_events = []  # [(тип, время)] в порядке записи в таблицу
+
+    def apply(self, event_type, event_time):
+        self.last_event_type = event_type
+        self.last_event_time = event_time
+        if event_type == "Приход":
+            # Новая смена — события обеда прошлой смены больше не нужны
+            self.check_in = event_time
+            self.lunch_events = []
+        elif event_type in LUNCH_EVENTS:
+            self.lunch_events.append((event_type, event_time))
+
+
+# Индекс user_id -> ShiftState. Строится один раз по листу событий и дальше обновляется в log_event
+_states = {}
+_lock = threading.Lock()
+_built = False
+
+
+def is_built():
+    return _built
+
+
+def build(entries):
+    """Строит индекс по событиям листа (user_id, тип, время) в порядке строк"""
+    global _states, _built
+    states = {}
+    for user_id, event_type, event_time in entries:
+        states.setdefault(user_id, ShiftState()).apply(event_type, event_time)
+    with _lock:
+        _states = states
+        _built = True
+
+
+def reset():
+    """Сбрасывает индекс — он будет построен заново при следующем обращении"""
+    global _states, _built
+    with _lock:
+        _states = {}
+        _built = False
+
+
+def apply(user_id, event_type, event_time):
+    """Учитывает новое событие пользователя"""
+    with _lock:
+        _states.setdefault(str(user_id), ShiftState()).apply(event_type, event_time)
+
+
+def rebuild(user_id, entries):
+    """Строит состояние сотрудника заново по его событиям (тип, время) в порядке строк листа"""
+    state = None
+    for event_type, event_time in entries:
+        state = state or ShiftState()
+        state.apply(event_type, event_time)
+    with _lock:
+        if state is None:
+            _states.pop(str(user_id), None)
+        else:
+            _states[str(user_id)] = state
+
+
+def open_shifts():
+    """Состояния всех сотрудников, у которых последнее событие — не "Уход" """
+    with _lock:
+        return {user_id: state for user_id, state in _states.items() if state.last_event_type != "Уход"}
+
+
+def get(user_id):
+    """Возвращает состояние смены пользователя или None, если событий нет"""
+    return _states.get(str(user_id))
@@ -0,0 +1,610 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from config import DEFAULT_HOURLY_RATE, ACCOUNTS_CACHE_TTL
+import shift_index
+import event_store
+import accounts_cache
+import reports
+import write_queue
+import sheet_sync
+from shift_index import ShiftState, TIME_FORMAT, LUNCH_EVENTS
+from accounts_cache import Account
+from event_store import Event
+
+logger = logging.getLogger(__name__)
+
+
+USER_LOCK_TTL = 60  # Через столько секунд блокировка сотрудника, оставшаяся от упавшего процесса, снимается
+# (пока процесс жив, он продлевает её, см. sheets_gateway._UserLock)
+
+
+class Storage:
+    """Хранилище данных бота. Строки событий, транзакций и счетов имеют тот же формат, что и в таблице"""
+
+    shared = False  # Хранилище общее для нескольких процессов бота: сотрудника нужно блокировать через lock_user
+
+    def load(self):
+        """Подготавливает хранилище при старте бота"""
+        raise NotImplementedError
+
+    def add_event(self, row, event_time):
+        raise NotImplementedError
+
+    def add_transaction(self, row):
+        raise NotImplementedError
+
+    def get_shift(self, user_id):
+        """Возвращает ShiftState пользователя или None, если событий нет"""
+        raise NotImplementedError
+
+    def get_open_shifts(self):
+        """Возвращает {user_id: ShiftState} всех незакрытых смен"""
+        raise NotImplementedError
+
+    def get_events(self, user_id, start=None, end=None):
+        """Возвращает события сотрудника (event_store.Event) с start по end включительно, по возрастанию времени"""
+        raise NotImplementedError
+
+    def reload_accounts(self):
+        """Подхватывает изменения, внесённые в лист "Счета" вручную"""
+        raise NotImplementedError
+
+    def sync_events(self, appended, changed):
+        """Учитывает строки листа событий, дописанные или изменённые вручную: [(номер строки, значения)].
+           Изменённая строка заменяет событие этой строки, и итоги отчётов за его день пересчитываются.
+           Балансы правка событий не меняет: они ведутся по начислениям и выплатам"""
+        raise NotImplementedError
+
+    def renumber_events(self, old_rows):
+        """Лист событий переписан (архивирование): old_rows[i] — прежний номер строки, которая теперь в строке i + 1"""
+        raise NotImplementedError
+
+    def sync_accounts(self, rows):
+        """Учитывает строки листа "Счета", дописанные или изменённые вручную"""
+        raise NotImplementedError
+
+    def get_account(self, user_id):
+        raise NotImplementedError
+
+    def get_accounts(self):
+        raise NotImplementedError
+
+    def add_account(self, user_id, name, hourly_rate, balance):
+        raise NotImplementedError
+
+    def set_balance(self, user_id, balance):
+        raise NotImplementedError
+
+    def add_balance(self, user_id, amount):
+        """Прибавляет amount к балансу и возвращает новый баланс. Два изменения баланса одного
+           сотрудника не теряют друг друга (вызывающий держит ledger.user_lock)"""
+        raise NotImplementedError
+
+    def update_reports(self, read_sheets):
+        """Строит или дополняет итоги для отчётов (модуль reports).
+           read_sheets() возвращает строки событий и транзакций всех листов таблицы, включая архивные"""
+        raise NotImplementedError
+
+    def lock_user(self, user_id):
+        """Пытается занять сотрудника для остальных процессов бота. Возвращает True, если получилось"""
+        return True
+
+    def renew_user(self, user_id):
+        """Продлевает блокировку сотрудника, занятого этим процессом. Возвращает False, если её уже нет"""
+        return True
+
+    def unlock_user(self, user_id):
+        pass
+
+
+class SheetsStorage(Storage):
+    """Данные хранятся в Google-таблице: чтение из индекса смен и кэша счетов, запись через очередь"""
+
+    def __init__(self, sheet, sheet_accounts):
+        self.sheet = sheet
+        self.sheet_accounts = sheet_accounts
+        self.load_lock = threading.Lock()
+        write_queue.set_on_append("events", event_store.numbered)
+
+    def load(self):
+        # Очередь не пишет в лист, пока он читается и дополняется неотправленными строками
+        with write_queue.exclusive(), self.load_lock:
+            if not shift_index.is_built():
+                records = self.sheet.get_all_values()
+                sheet_sync.baseline("events", records)
+                # Время разбирается один раз: строки листа сразу складываются в компактное хранилище событий
+                event_store.build(write_queue.with_pending("events", records), len(records))
+                shift_index.build(event_store.replay())
+
+    def add_event(self, row, event_time):
+        write_queue.append_row("events", row)
+        if shift_index.is_built():
+            shift_index.apply(row[1], row[3], event_time)
+            event_store.append(row[1], row[3], event_time, *row[4:6])
+        if reports.is_built():
+            reports.apply_event(row[1], row[2], row[3], event_time, *row[4:6])
+
+    def add_transaction(self, row):
+        write_queue.append_row("transactions", row)
+        if reports.is_built():
+            reports.apply_transaction(row[1], row[2], row[3], row[4], _parse_time(row[0]))
+
+    def get_shift(self, user_id):
+        if not shift_index.is_built():
+            self.load()  # Если индекс уже строится при старте, load дождётся его
+        return shift_index.get(user_id)
+
+    def get_open_shifts(self):
+        if not shift_index.is_built():
+            self.load()
+        return shift_index.open_shifts()
+
+    def get_events(self, user_id, start=None, end=None):
+        if not shift_index.is_built():
+            self.load()
+        return event_store.events(user_id, start, end)
+
+    def reload_accounts(self):
+        with write_queue.exclusive():
+            records = self.sheet_accounts.get_all_values()
+            sheet_sync.baseline("accounts", records)
+            records = write_queue.with_pending("accounts", records)
+        accounts_cache.load(records)
+
+    def sync_events(self, appended, changed):
+        if not shift_index.is_built():
+            return
+        if changed:
+            # Заменяются только события изменённых строк: смены пересчитываются для их сотрудников,
+            # итоги отчётов — для их дней
+            days = event_store.replace_rows(changed)
+            for user_id in {user_id for user_id, _ in days}:
+                shift_index.rebuild(user_id, event_store.user_replay(user_id))
+            for (user_id, _), (before, after) in days.items():
+                reports.replace_events(user_id, before, after)
+        for number, row in appended:
+            event_time = _parse_time(row[0]) if row else None
+            if event_time is None or len(row) < 4:
+                continue
+            shift_index.apply(row[1], row[3], event_time)
+            event_store.append(row[1], row[3], event_time, *row[4:6], row=number)
+            if reports.is_built():
+                reports.apply_event(row[1], row[2], row[3], event_time, *row[4:6])
+
+    def renumber_events(self, old_rows):
+        event_store.renumber(old_rows)
+
+    def sync_accounts(self, rows):
+        accounts_cache.apply_rows(rows)
+
+    def update_reports(self, read_sheets):
+        # Дальше итоги обновляются при каждой записи события и транзакции
+        if not reports.is_built():
+            reports.build(*read_sheets())
+
+    def _ensure_accounts(self):
+        if not accounts_cache.is_fresh():
+            self.reload_accounts()
+
+    def get_account(self, user_id):
+        self._ensure_accounts()
+        return accounts_cache.get(user_id)
+
+    def get_accounts(self):
+        self._ensure_accounts()
+        return accounts_cache.all_accounts()
+
+    def add_account(self, user_id, name, hourly_rate, balance):
+        write_queue.append_row("accounts", [user_id, name, hourly_rate, balance])
+        return accounts_cache.add(user_id, name, hourly_rate, balance)
+
+    def set_balance(self, user_id, balance):
+        account = accounts_cache.get(user_id)
+        write_queue.update_cell("accounts", account.row, 4, balance)
+        accounts_cache.set_balance(user_id, balance)
+
+    def add_balance(self, user_id, amount):
+        # Баланс считается от значения в листе, так что ручная правка не теряется
+        balance = self.get_account(user_id).balance + amount
+        self.set_balance(user_id, balance)
+        return balance
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    name TEXT,
+    event TEXT NOT NULL,
+    work_hours REAL,
+    salary REAL,
+    row INTEGER  -- Строка листа событий: NULL — ещё не известна, 0 — строки нет в листе (перенесена в архив)
+);
+CREATE INDEX IF NOT EXISTS events_user ON events (user_id, id);
+CREATE INDEX IF NOT EXISTS events_user_event ON events (user_id, event, id);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_user_ts ON events (user_id, ts);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    user_id TEXT PRIMARY KEY,
+    name TEXT,
+    hourly_rate REAL NOT NULL,
+    balance REAL NOT NULL,
+    row INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    name TEXT,
+    type TEXT,
+    amount REAL,
+    balance REAL
+);
+CREATE INDEX IF NOT EXISTS transactions_user ON transactions (user_id, ts);
+
+-- Дни сотрудников, события которых изменены вручную: итоги отчётов за них пересчитываются
+CREATE TABLE IF NOT EXISTS event_edits (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_locks (
+    user_id TEXT PRIMARY KEY,
+    owner INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value, TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _event_values(row):
+    """(время, user_id, имя, событие, часы, зарплата) строки листа событий или None для заголовка
+       и испорченной строки"""
+    event_time = _parse_time(row[0]) if row else None
+    if event_time is None or len(row) < 4:
+        return None
+    row = list(row) + [""] * (6 - len(row))
+    return int(event_time.timestamp()), str(row[1]), row[2], row[3], _to_float(row[4]), _to_float(row[5])
+
+
+class SqliteStorage(Storage):
+    """Локальное хранилище в SQLite: все чтения и записи идут в базу,
+    а Google-таблица обновляется асинхронно через очередь записи как зеркало"""
+
+    shared = True
+
+    def __init__(self, path, sheet, sheet_accounts, sheet_transaction):
+        self.sheet = sheet
+        self.sheet_accounts = sheet_accounts
+        self.sheet_transaction = sheet_transaction
+        # База может быть общей для нескольких процессов бота (режим webhook)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        # В базах, созданных до столбца events.row, номера строк событий проставляются по листу при загрузке
+        self.number_events = "row" not in [column[1] for column in self.db.execute("PRAGMA table_info(events)")]
+        if self.number_events:
+            try:
+                self.db.execute("ALTER TABLE events ADD COLUMN row INTEGER")
+            except sqlite3.OperationalError:
+                pass  # Столбец только что добавил другой процесс бота
+        self.db.execute("CREATE INDEX IF NOT EXISTS events_row ON events (row)")
+        self.lock = threading.Lock()
+        self.accounts_synced_at = None
+        self.reports_lock = threading.Lock()
+        self.reported_ids = None  # (id события, id транзакции, id правки), до которых учтены итоги отчётов
+        write_queue.set_on_append("accounts", self._accounts_appended)
+        write_queue.set_on_append("events", self._events_appended)
+
+    def load(self):
+        """При первом запуске переносит данные из таблицы в базу"""
+        with self.lock:
+            empty = self.db.execute("SELECT NOT EXISTS (SELECT 1 FROM events) "
+                                    "AND NOT EXISTS (SELECT 1 FROM accounts)").fetchone()[0]
+        if empty:
+            self._import_sheets()
+        elif self.number_events:
+            self._number_events()
+            self.number_events = False
+
+    def _import_sheets(self):
+        with write_queue.exclusive():
+            records = self.sheet.get_all_values()
+            sheet_sync.baseline("events", records)
+            sheet_rows = len(records)
+            records = write_queue.with_pending("events", records)
+            transaction_records = write_queue.with_pending("transactions", self.sheet_transaction.get_all_values())
+
+        events = []
+        for i, row in enumerate(records):
+            values = _event_values(row)
+            if values is not None:
+                events.append(values + (i + 1 if i < sheet_rows else None,))
+
+        transactions = []
+        for row in transaction_records:
+            event_time = _parse_time(row[0]) if row else None
+            if event_time is None or len(row) < 6:
+                continue
+            transactions.append((int(event_time.timestamp()), row[1], row[2], row[3],
+                                 _to_float(row[4]), _to_float(row[5])))
+
+        with self.lock, self.db:
+            self.db.executemany("INSERT INTO events (ts, user_id, name, event, work_hours, salary, row) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?)", events)
+            self.db.executemany("INSERT INTO transactions (ts, user_id, name, type, amount, balance) "
+                                "VALUES (?, ?, ?, ?, ?, ?)", transactions)
+        self.reload_accounts()
+
+    def _number_events(self):
+        """Проставляет номера строк листа событиям, импортированным до появления столбца events.row"""
+        with write_queue.exclusive():
+            records = self.sheet.get_all_values()
+        with self.lock, self.db:
+            for number, row in enumerate(records, start=1):
+                values = _event_values(row)
+                if values is not None:
+                    self._set_row(number, values)
+
+    def _set_row(self, number, values):
+        """Запоминает строку листа у события с тем же сотрудником, временем и типом, чья строка ещё не известна
+           (вызывается под self.lock). Возвращает False, если такого события нет"""
+        ts, user_id, _, event = values[:4]
+        cursor = self.db.execute("UPDATE events SET row = ?1 WHERE id = (SELECT id FROM events WHERE user_id = ?2 "
+                                 "AND ts = ?3 AND event = ?4 AND (row IS NULL OR row = ?1) ORDER BY id LIMIT 1)",
+                                 (number, user_id, ts, event))
+        return cursor.rowcount > 0
+
+    def _events_appended(self, rows):
+        """Строки событий легли в лист: запоминаем их номера"""
+        with self.lock, self.db:
+            for number, row in rows:
+                values = _event_values(row)
+                if values is not None:
+                    self._set_row(number, values)
+
+    def add_event(self, row, event_time):
+        values = row + [None] * (6 - len(row))
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO events (ts, user_id, name, event, work_hours, salary) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (int(event_time.timestamp()), str(values[1]), values[2], values[3], values[4], values[5]))
+        write_queue.append_row("events", row)
+
+    def add_transaction(self, row):
+        event_time = _parse_time(row[0])
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO transactions (ts, user_id, name, type, amount, balance) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (int(event_time.timestamp()), str(row[1]), row[2], row[3], row[4], row[5]))
+        write_queue.append_row("transactions", row)
+
+    def get_shift(self, user_id):
+        user_id = str(user_id)
+        with self.lock:
+            last = self.db.execute("SELECT event, ts FROM events WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+                                   (user_id,)).fetchone()
+            if last is None:
+                return None
+            check_in = self.db.execute("SELECT id, ts FROM events WHERE user_id = ? AND event = 'Приход' "
+                                       "ORDER BY id DESC LIMIT 1", (user_id,)).fetchone()
+            lunches = self.db.execute("SELECT event, ts FROM events WHERE user_id = ? AND id > ? "
+                                      "AND event IN (?, ?) ORDER BY id",
+                                      (user_id, check_in[0] if check_in else 0) + LUNCH_EVENTS).fetchall()
+        state = ShiftState()
+        if check_in:
+            state.check_in = datetime.fromtimestamp(check_in[1])
+        state.lunch_events = [(event, datetime.fromtimestamp(ts)) for event, ts in lunches]
+        state.last_event_type = last[0]
+        state.last_event_time = datetime.fromtimestamp(last[1])
+        return state
+
+    def get_open_shifts(self):
+        with self.lock:
+            user_ids = [row[0] for row in self.db.execute(
+                "SELECT e.user_id FROM events e JOIN (SELECT MAX(id) AS id FROM events GROUP BY user_id) last "
+                "ON e.id = last.id WHERE e.event != 'Уход'")]
+        return {user_id: self.get_shift(user_id) for user_id in user_ids}
+
+    def get_events(self, user_id, start=None, end=None):
+        start = int(start.timestamp()) if start else 0
+        end = int(end.timestamp()) if end else 2 ** 62
+        with self.lock:
+            rows = self.db.execute("SELECT ts, event, work_hours, salary FROM events WHERE user_id = ? "
+                                   "AND ts BETWEEN ? AND ? ORDER BY ts, id", (str(user_id), start, end)).fetchall()
+        return [Event(datetime.fromtimestamp(ts), event, work_hours, salary) for ts, event, work_hours, salary in rows]
+
+    def reload_accounts(self):
+        """Обновляет имена и ставки из листа "Счета". Баланс ведётся в базе, кроме новых сотрудников"""
+        with write_queue.exclusive():
+            records = self.sheet_accounts.get_all_values()
+            sheet_sync.baseline("accounts", records)
+            records = write_queue.with_pending("accounts", records)
+        self._upsert_accounts(enumerate(records[1:], start=2))
+
+    def _upsert_accounts(self, rows):
+        with self.lock, self.db:
+            for i, row in rows:
+                if i == 1 or not row or not row[0]:
+                    continue
+                row = list(row) + [""] * (4 - len(row))
+                self.db.execute("INSERT INTO accounts (user_id, name, hourly_rate, balance, row) "
+                                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+                                "name = excluded.name, hourly_rate = excluded.hourly_rate, row = excluded.row",
+                                (row[0], row[1], _to_float(row[2], DEFAULT_HOURLY_RATE), _to_float(row[3], 0), i))
+        self.accounts_synced_at = time.monotonic()
+
+    def sync_events(self, appended, changed):
+        # Строки уже в таблице — в очередь записи их не ставим
+        with self.lock, self.db:
+            for number, row in changed:
+                values = _event_values(row)
+                old = self.db.execute("SELECT id, user_id, ts FROM events WHERE row = ?", (number,)).fetchone()
+                if old is not None:
+                    self._note_edit(old[1], old[2])
+                if values is None:
+                    if old is not None:
+                        self.db.execute("DELETE FROM events WHERE id = ?", (old[0],))
+                    continue
+                self._note_edit(values[1], values[0])
+                if old is None:
+                    self.db.execute("INSERT INTO events (ts, user_id, name, event, work_hours, salary, row) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?)", values + (number,))
+                else:
+                    self.db.execute("UPDATE events SET ts = ?, user_id = ?, name = ?, event = ?, work_hours = ?, "
+                                    "salary = ? WHERE id = ?", values + (old[0],))
+            for number, row in appended:
+                values = _event_values(row)
+                # Среди "дописанных" есть и строки, которые записали другие процессы бота:
+                # в базе они уже есть, у них только запоминается номер строки
+                if values is not None and not self._set_row(number, values):
+                    self.db.execute("INSERT INTO events (ts, user_id, name, event, work_hours, salary, row) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?)", values + (number,))
+
+    def _note_edit(self, user_id, ts):
+        self.db.execute("INSERT INTO event_edits (user_id, day) VALUES (?, ?)",
+                        (user_id, datetime.fromtimestamp(ts).date().isoformat()))
+
+    def renumber_events(self, old_rows):
+        with self.lock, self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS renumber (old INTEGER PRIMARY KEY, new INTEGER)")
+            self.db.execute("DELETE FROM renumber")
+            self.db.executemany("INSERT INTO renumber (old, new) VALUES (?, ?)",
+                                ((old, new) for new, old in enumerate(old_rows, start=1)))
+            self.db.execute("UPDATE events SET row = COALESCE((SELECT new FROM renumber WHERE old = events.row), 0) "
+                            "WHERE row > 0")
+
+    def sync_accounts(self, rows):
+        if self.accounts_synced_at is not None:
+            self._upsert_accounts(rows)
+
+    def update_reports(self, read_sheets):
+        """Итоги строятся по базе, где лежат записи всех процессов бота, и дочитываются по id"""
+        with self.reports_lock:
+            if self.reported_ids is None or not reports.is_built():
+                with self.lock:
+                    # Правки, сделанные до построения итогов, уже видны в самих событиях
+                    edit_id = self.db.execute("SELECT COALESCE(MAX(id), 0) FROM event_edits").fetchone()[0]
+                self.reported_ids = (0, 0, edit_id)
+                reports.build([], [])
+            event_id, transaction_id, edit_id = self.reported_ids
+            with self.lock:
+                events = self.db.execute("SELECT id, ts, user_id, name, event, work_hours, salary FROM events "
+                                         "WHERE id > ? ORDER BY ts, id", (event_id,)).fetchall()
+                transactions = self.db.execute("SELECT id, ts, user_id, name, type, amount FROM transactions "
+                                               "WHERE id > ? ORDER BY ts, id", (transaction_id,)).fetchall()
+                edits = self.db.execute("SELECT id, user_id, day FROM event_edits WHERE id > ? ORDER BY id",
+                                        (edit_id,)).fetchall()
+            reports.extend([(datetime.fromtimestamp(ts), *values) for _, ts, *values in events],
+                           [(datetime.fromtimestamp(ts), *values) for _, ts, *values in transactions])
+            # Изменённые события уже учтены в итогах со старыми значениями: их дни пересчитываются целиком
+            for user_id, day in {(user_id, day) for _, user_id, day in edits}:
+                day = datetime.strptime(day, "%Y-%m-%d").date()
+                start, end = datetime.combine(day, datetime.min.time()), datetime.combine(day, datetime.max.time())
+                with self.lock:
+                    name = self.db.execute("SELECT name FROM events WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+                                           (user_id,)).fetchone()
+                reports.replace_day(user_id, name[0] if name else None, day, self.get_events(user_id, start, end))
+            self.reported_ids = (max((row[0] for row in events), default=event_id),
+                                 max((row[0] for row in transactions), default=transaction_id),
+                                 max((row[0] for row in edits), default=edit_id))
+
+    def lock_user(self, user_id):
+        now = time.time()
+        with self.lock, self.db:
+            cursor = self.db.execute("INSERT INTO user_locks (user_id, owner, expires) VALUES (?, ?, ?) "
+                                     "ON CONFLICT (user_id) DO UPDATE SET owner = excluded.owner, "
+                                     "expires = excluded.expires WHERE user_locks.expires < ?",
+                                     (str(user_id), os.getpid(), now + USER_LOCK_TTL, now))
+            return cursor.rowcount == 1
+
+    def renew_user(self, user_id):
+        with self.lock, self.db:
+            cursor = self.db.execute("UPDATE user_locks SET expires = ? WHERE user_id = ? AND owner = ?",
+                                     (time.time() + USER_LOCK_TTL, str(user_id), os.getpid()))
+            return cursor.rowcount == 1
+
+    def unlock_user(self, user_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM user_locks WHERE user_id = ? AND owner = ?", (str(user_id), os.getpid()))
+
+    def _ensure_accounts(self):
+        if self.accounts_synced_at is None or time.monotonic() - self.accounts_synced_at >= ACCOUNTS_CACHE_TTL:
+            self.reload_accounts()
+
+    def get_account(self, user_id):
+        self._ensure_accounts()
+        with self.lock:
+            row = self.db.execute("SELECT user_id, name, hourly_rate, balance, row FROM accounts WHERE user_id = ?",
+                                  (str(user_id),)).fetchone()
+        return Account(*row) if row else None
+
+    def get_accounts(self):
+        self._ensure_accounts()
+        with self.lock:
+            rows = self.db.execute("SELECT user_id, name, hourly_rate, balance, row FROM accounts "
+                                   "ORDER BY row = 0, row")
+            return [Account(*row) for row in rows.fetchall()]
+
+    def add_account(self, user_id, name, hourly_rate, balance):
+        # Номер строки (row = 0 — ещё не известен) станет известен, когда строка ляжет в лист:
+        # процессы бота дописывают строки каждый своей очередью, и порядок в листе заранее не известен
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO accounts (user_id, name, hourly_rate, balance, row) VALUES (?, ?, ?, ?, 0)",
+                            (str(user_id), name, hourly_rate, balance))
+        write_queue.append_row("accounts", [user_id, name, hourly_rate, balance])
+        return Account(str(user_id), name, hourly_rate, balance, 0)
+
+    def _accounts_appended(self, rows):
+        """Строки "Счета" легли в лист: запоминаем их номера. Если баланс успел измениться, пока номер
+           не был известен, в таблицу записывается текущий"""
+        for number, row in rows:
+            with self.lock, self.db:
+                self.db.execute("UPDATE accounts SET row = ? WHERE user_id = ?", (number, str(row[0])))
+                found = self.db.execute("SELECT balance FROM accounts WHERE user_id = ?", (str(row[0]),)).fetchone()
+            if found and found[0] != _to_float(row[3], 0):
+                write_queue.update_cell("accounts", number, 4, found[0])
+
+    def set_balance(self, user_id, balance):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT row FROM accounts WHERE user_id = ?", (str(user_id),)).fetchone()[0]
+            self.db.execute("UPDATE accounts SET balance = ? WHERE user_id = ?", (balance, str(user_id)))
+        if row:  # Иначе баланс запишет _accounts_appended, когда строка ляжет в лист
+            write_queue.update_cell("accounts", row, 4, balance)
+
+    def add_balance(self, user_id, amount):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")  # Другие процессы не изменят баланс до конца транзакции
+            try:
+                balance, row = self.db.execute("SELECT balance, row FROM accounts WHERE user_id = ?",
+                                               (str(user_id),)).fetchone()
+                balance += amount
+                self.db.execute("UPDATE accounts SET balance = ? WHERE user_id = ?", (balance, str(user_id)))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+        if row:  # Иначе баланс запишет _accounts_appended, когда строка ляжет в лист
+            write_queue.update_cell("accounts", row, 4, balance)
+        return balance
@@ -0,0 +1,152 @@
+"""Режим webhook: приём обновлений Telegram на локальном aiohttp-сервере и обработка в нескольких процессах.
+
+Основной процесс принимает обновления на WEBHOOK_HOST:WEBHOOK_PORT и раскладывает их по
+WEBHOOK_WORKERS процессам-обработчикам по user_id, поэтому обновления одного пользователя
+всегда попадают в один процесс и обрабатываются в порядке поступления. Разные пользователи
+обрабатываются параллельно — и внутри процесса, и на разных ядрах.
+
+Для нескольких процессов нужен STORAGE_BACKEND = "sqlite". Общая у процессов только база:
+события, счета и балансы (баланс меняется в ней атомарно), отчёты строятся по ней же,
+а сотрудник на время действия с его сменой или балансом блокируется в ней, так что выплата
+администратора из другого процесса не пересечётся с уходом сотрудника. Журнал отложенной записи
+у каждого процесса свой, журнал балансов общий (запись под блокировкой файла). Лимиты Telegram на уведомления делятся между процессами поровну.
+Фоновые задачи (архивирование, закрытие смен, синхронизация) и сообщение о запуске — только в первом процессе.
+
+Запуск из каталога bot (config.py лежит в корне репозитория):
+    PYTHONPATH=.. python webhook.py
+"""
+import asyncio
+import logging
+import multiprocessing
+from aiohttp import web
+from config import (TOKEN, STORAGE_BACKEND, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+                    WEBHOOK_SECRET, WEBHOOK_WORKERS)
+
+logger = logging.getLogger(__name__)
+
+
+def get_user_id(update):
+    """Пользователь, от которого пришло обновление (0, если его нет)"""
+    for key, value in update.items():
+        if key != "update_id" and isinstance(value, dict):
+            user = value.get("from") or value.get("user") or value.get("chat") or {}
+            return user.get("id", 0)
+    return 0
+
+
+def _worker(index, queue, processed):
+    """Процесс-обработчик: свой event loop, бот и диспетчер из main.py"""
+    import config
+    config.WRITE_JOURNAL_PATH += f".{index}"  # Очередь записи у каждого процесса своя; журнал балансов общий
+    if config.METRICS_PORT:
+        config.METRICS_PORT += index
+    # Лимиты Telegram общие для бота, поэтому у каждого процесса своя доля
+    config.NOTIFY_GLOBAL_RATE /= config.WEBHOOK_WORKERS
+    config.NOTIFY_CHAT_INTERVAL *= config.WEBHOOK_WORKERS
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(index, queue, processed))
+
+
+async def _serve(index, queue, processed):
+    import main
+    await main.start_services(primary=index == 0)
+    loop = asyncio.get_running_loop()
+    user_locks = {}
+    tasks = set()
+
+    async def process(user_id, update):
+        # asyncio.Lock пропускает ожидающих по очереди, так что порядок обновлений пользователя сохраняется
+        async with user_locks.setdefault(user_id, asyncio.Lock()):
+            try:
+                await main.dp.feed_raw_update(main.bot, update)
+            except Exception as e:
+                logger.exception("Ошибка обработки обновления %s: %s", update.get("update_id"), e)
+            finally:
+                with processed.get_lock():
+                    processed.value += 1
+
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            task = asyncio.create_task(process(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        await main.stop_services()
+        await main.bot.session.close()
+
+
+def create_app(queues, processed):
+    """aiohttp-приложение, раскладывающее обновления по очередям процессов.
+       GET WEBHOOK_PATH/processed возвращает число уже обработанных обновлений (для fake_updates.py)"""
+
+    def allowed(request):
+        return not WEBHOOK_SECRET or request.headers.get("X-Telegram-Bot-Api-Secret-Token") == WEBHOOK_SECRET
+
+    async def handle(request):
+        if not allowed(request):
+            return web.Response(status=403)
+        update = await request.json()
+        user_id = get_user_id(update)
+        queues[user_id % len(queues)].put((user_id, update))
+        return web.Response()
+
+    async def handle_processed(request):
+        if not allowed(request):
+            return web.Response(status=403)
+        return web.Response(text=str(processed.value))
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    app.router.add_get(WEBHOOK_PATH + "/processed", handle_processed)
+    return app
+
+
+async def _run_server(queues, processed):
+    runner = web.AppRunner(create_app(queues, processed))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("Webhook слушает %s:%s%s, процессов: %s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, len(queues))
+    if WEBHOOK_URL:
+        from aiogram import Bot
+        bot = Bot(token=TOKEN)
+        await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                              drop_pending_updates=True)
+        await bot.session.close()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if WEBHOOK_WORKERS > 1 and STORAGE_BACKEND != "sqlite":
+        raise SystemExit('Для WEBHOOK_WORKERS > 1 нужен STORAGE_BACKEND = "sqlite"')
+    if STORAGE_BACKEND == "sqlite":
+        import work_with_sheets
+        work_with_sheets.load_storage()  # Первичный перенос данных из таблицы в базу — один раз, до запуска процессов
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(WEBHOOK_WORKERS)]
+    processed = context.Value("q", 0)  # Сколько обновлений обработали все процессы
+    workers = [context.Process(target=_worker, args=(i, queue, processed), name=f"bot-worker-{i}")
+               for i, queue in enumerate(queues)]
+    for worker in workers:
+        worker.start()
+    try:
+        asyncio.run(_run_server(queues, processed))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,231 @@
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from config import SPREADSHEET_NAME, DEFAULT_HOURLY_RATE, DEFAULT_LUNCH_TIME, AUTO_CHECK_OUT_TIME, AUTO_CHECK_IN_TIME
+from config import STORAGE_BACKEND, SQLITE_PATH
 from datetime import datetime, timedelta
+import logging
+import threading
+from time import perf_counter
+import write_queue
+import metrics
+import sheets_scheduler
+import reports
+import ledger
+import sheet_sync
+from storage import SheetsStorage, SqliteStorage
+
+logger = logging.getLogger(__name__)
 
-# Авторизация в Google Sheets
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name("../data/credentials.json", scope)
-client = gspread.authorize(creds)
+WORKSHEET_TITLES = {"accounts": "Счета", "transactions": "Транзакции"}  # Лист событий — первый лист таблицы
 
-# Открываем таблицу
-spreadsheet = client.open(SPREADSHEET_NAME)
-sheet = client.open(SPREADSHEET_NAME).sheet1  # Лист для событий
-sheet_accounts = spreadsheet.worksheet("Счета")  # Лист для счетов
-sheet_transaction = spreadsheet.worksheet("Транзакции")  # Лист для истории транзакций
+# Подключение к таблице открывается при первом запросе, а не при импорте модуля,
+# поэтому бот (и buttons.py) запускается без сети, а при истёкшей авторизации переподключается
+client = None
+spreadsheet = None
+_worksheets = {}  # ключ -> worksheet gspread текущего подключения
+# Все листы таблицы по названию: список запрашивается один раз при подключении, а листы, которые создаёт
+# бот (архивные), добавляются в него сами. Лист, добавленный вручную, виден после переподключения
+_by_title = {}
+_connect_lock = threading.Lock()
+
+
+def connect(force=False):
+    """Авторизуется и открывает таблицу. При force=True переподключается, даже если подключение уже есть"""
+    global client, spreadsheet, _worksheets, _by_title
+    if _worksheets and not force:
+        return
+    with _connect_lock:
+        if _worksheets and not force:
+            return
+        started = perf_counter()
+        creds = ServiceAccountCredentials.from_json_keyfile_name("../data/credentials.json", scope)
+        client = gspread.authorize(creds)
+        spreadsheet = client.open(SPREADSHEET_NAME)
+        # Все листы приходят одним запросом метаданных вместо отдельного запроса на каждый лист
+        worksheets = spreadsheet.worksheets()
+        by_title = {worksheet.title: worksheet for worksheet in worksheets}
+        opened = {key: by_title[title] for key, title in WORKSHEET_TITLES.items()}
+        opened["events"] = worksheets[0]
+        _worksheets, _by_title = opened, by_title
+        logger.info("Таблица открыта за %.2f с", perf_counter() - started)
+
+
+def reconnect():
+    """Повторная авторизация, когда Google отвечает 401"""
+    logger.warning("Авторизация в Google Sheets истекла, переподключаемся")
+    connect(force=True)
+
+
+sheets_scheduler.set_reauthorize(reconnect)
+
+
+def get_spreadsheet():
+    connect()
+    return spreadsheet
+
+
+def get_worksheets():
+    """Листы таблицы по названию (без запроса к API)"""
+    connect()
+    return dict(_by_title)
+
+
+def add_worksheet(title, rows, cols):
+    worksheet = get_spreadsheet().add_worksheet(title=title, rows=rows, cols=cols)
+    _by_title[title] = worksheet
+    return worksheet
+
+
+class _LazyWorksheet:
+    """Лист текущего подключения: открывает таблицу при первом обращении и подменяется после переподключения"""
+
+    def __init__(self, key):
+        self._key = key
+
+    def __getattr__(self, item):
+        connect()
+        return getattr(_worksheets[self._key], item)
+
+
+class _LazySpreadsheet:
+    """Таблица текущего подключения (для запросов ко всей таблице и к Drive)"""
+
+    def __getattr__(self, item):
+        return getattr(get_spreadsheet(), item)
+
+
+def wrap_worksheet(worksheet):
+    """Все запросы к листу идут через планировщик квоты и замеряются"""
+    return sheets_scheduler.schedule(metrics.instrument(worksheet))
+
+
+sheet = wrap_worksheet(_LazyWorksheet("events"))  # Лист для событий
+sheet_accounts = wrap_worksheet(_LazyWorksheet("accounts"))  # Лист для счетов
+sheet_transaction = wrap_worksheet(_LazyWorksheet("transactions"))  # Лист для истории транзакций
+spreadsheet_api = wrap_worksheet(_LazySpreadsheet())  # Запросы ко всей таблице: тоже через планировщик и метрики
+
+# Запись в листы идёт через очередь отложенной записи
+write_queue.register("events", sheet)
+write_queue.register("accounts", sheet_accounts)
+write_queue.register("transactions", sheet_transaction)
+
+# Хранилище, через которое работают все функции ниже
+if STORAGE_BACKEND == "sqlite":
+    storage = SqliteStorage(SQLITE_PATH, sheet, sheet_accounts, sheet_transaction)  # Таблица — зеркало базы
+else:
+    storage = SheetsStorage(sheet, sheet_accounts)
+
+
+def _sync_events(appended, changed):
+    """Строки листа событий, дописанные вручную, попадают в хранилище (и через него в отчёты)"""
+    storage.sync_events(appended, changed)
+
+
+def _sync_accounts(appended, changed):
+    storage.sync_accounts(appended + changed)
+
+
+def _last_update_time():
+    """Время последнего изменения файла таблицы по данным Drive (None, если версия gspread его не отдаёт)"""
+    if not hasattr(get_spreadsheet(), "get_lastUpdateTime"):
+        return None
+    return spreadsheet_api.get_lastUpdateTime()
+
+
+def _read_ranges(ranges):
+    """Диапазоны разных листов одним запросом"""
+    response = spreadsheet_api.values_batch_get(ranges)
+    return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+
+
+# Ручные правки листов подтягиваются без полного перечитывания
+sheet_sync.register("events", sheet, "F", _sync_events)
+sheet_sync.register("accounts", sheet_accounts, "D", _sync_accounts)
+sheet_sync.set_revision(_last_update_time)
+sheet_sync.set_reader(_read_ranges)
 
 
 def log_event(user_id, name, event, time=None, work_hours=None, salary=None):
     """Записывает событие в таблицу. Если переданы work_hours и salary — записывает итоговый отчёт по смене."""
     if not time:
         time = datetime.now()  # Получаем текущее время
+    event_time = time.replace(microsecond=0)  # В таблицу время пишется с точностью до секунды
     time = time.strftime("%d-%m-%Y %H:%M:%S")
     if work_hours is None and salary is None:
         # Обычное событие (Приход, Начал обед, Закончил обед)
-        sheet.append_row([time, user_id, name, event])
+        storage.add_event([time, user_id, name, event], event_time)
     else:
         # Специальная запись для "Уход"
-        sheet.append_row([time, user_id, name, "Уход", work_hours, salary])
+        storage.add_event([time, user_id, name, "Уход", work_hours, salary], event_time)
+
+
+def load_storage():
+    """Подготавливает хранилище (индекс смен или локальную базу). Вызывается один раз при старте бота"""
+    storage.load()
+
+
+def get_shift_state(user_id):
+    """Возвращает состояние текущей смены пользователя"""
+    return storage.get_shift(user_id)
+
+def get_events(user_id, start=None, end=None):
+    """События сотрудника за период"""
+    return storage.get_events(user_id, start, end)
 
 def add_event_transaction(user_id, name, type ,salary, balance):
-   time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")  # Получаем текущее время
-   sheet_transaction.append_row([time, user_id, name, type, salary, balance])
+   now = datetime.now().replace(microsecond=0)
+   time = now.strftime("%d-%m-%Y %H:%M:%S")  # Получаем текущее время
+   storage.add_transaction([time, user_id, name, type, salary, balance])
+
+
+def read_report_rows():
+    """Строки событий и транзакций для отчётов: основные и архивные листы"""
+    with write_queue.exclusive():
+        events = write_queue.with_pending("events", sheet.get_all_values())
+        transactions = write_queue.with_pending("transactions", sheet_transaction.get_all_values())
+    for worksheet in get_worksheets().values():
+        if worksheet.title.startswith("События "):
+            events += wrap_worksheet(worksheet).get_all_values()
+        elif worksheet.title.startswith("Транзакции "):
+            transactions += wrap_worksheet(worksheet).get_all_values()
+    return events, transactions
+
+
+def get_report(period, date=None):
+    """Возвращает текст отчёта по сотрудникам за день, неделю или месяц"""
+    storage.update_reports(read_report_rows)
+    return reports.format_report(period, date or datetime.now())
 
 
 
 def get_user_name(user_id):
     """Возвращает имя сотрудника по user_id со второго листа таблицы."""
-    records = sheet_accounts.get_all_values()  # Загружаем данные второго листа
-
-    for row in records:
-        if row[0] == str(user_id):  # Первый столбец — user_id
-            return row[1]  # Второй столбец — имя
+    account = get_account(user_id)
+    if account:
+        return account.name
 
     return None  # Если сотрудник не найден
 
+
+def reload_accounts():
+    """Подхватывает ручные правки листа "Счета" """
+    storage.reload_accounts()
+
+
+def get_account(user_id):
+    """Возвращает запись сотрудника из листа 'Счета'"""
+    return storage.get_account(user_id)
+
 def check_and_fix_records(user_id, user_name, event):
     """Проверяет последнее событие и автоматически добавляет недостающие записи"""
-    records = sheet.get_all_values()
+    state = get_shift_state(user_id)
     last_event = None
     last_event_type = None
 
-    for row in reversed(records):
-        if row[1] == str(user_id):
-            last_event = datetime.strptime(row[0], "%d-%m-%Y %H:%M:%S")
-            last_event_type = row[3]
-            break
+    if state:
+        last_event = state.last_event_time
+        last_event_type = state.last_event_type
 
     if event == "Приход":
         if last_event_type != "Уход":
@@ -89,27 +261,32 @@ def calculate_work_time(user_id, end_time=None):
     if end_time is None:
         end_time = datetime.now()
 
-    records = sheet.get_all_values()
-    last_check_in = None
+    state = get_shift_state(user_id)
+    last_check_in = state.check_in if state else None
+    lunch_events = state.lunch_events if state else []
+
+    # Получаем почасовую ставку сотрудника
+    account = get_account(user_id)
+    hourly_rate = account.hourly_rate if account else DEFAULT_HOURLY_RATE  # Значение по умолчанию
+
+    return shift_work_time(last_check_in, lunch_events, end_time, hourly_rate)
+
+
+def shift_work_time(last_check_in, lunch_events, end_time, hourly_rate):
+    """Часы и зарплата за смену по времени прихода, событиям обеда и времени ухода"""
     lunch_start = None
     lunch_end = None
     total_lunch_time = 0  # Время обеда в секундах
 
-    for row in reversed(records):  # Читаем таблицу с конца
-        if row[1] == str(user_id):  # Запись для пользователя
-            time_event = datetime.strptime(row[0], "%d-%m-%Y %H:%M:%S")
-
-            if row[3] == "Приход":
-                last_check_in = time_event
-                break
-            elif row[3] == "Закончил обед":
-                lunch_end = time_event
-            elif row[3] == "Начал обед":
-                lunch_start = time_event
-                if lunch_end:
-                    total_lunch_time += (lunch_end - lunch_start).total_seconds()
-                    lunch_start = None
-                    lunch_end = None
+    for event_type, time_event in reversed(lunch_events):  # Обеды текущей смены, с конца
+        if event_type == "Закончил обед":
+            lunch_end = time_event
+        elif event_type == "Начал обед":
+            lunch_start = time_event
+            if lunch_end:
+                total_lunch_time += (lunch_end - lunch_start).total_seconds()
+                lunch_start = None
+                lunch_end = None
 
     # Если обед начался, но не закончился
     if lunch_start:
@@ -128,18 +305,6 @@ def calculate_work_time(user_id, end_time=None):
 
     work_hours = round(work_time.total_seconds() / 3600, 2)  # Время в часах
 
-    # Получаем почасовую ставку сотрудника
-    accounts = sheet_accounts.get_all_values()
-    hourly_rate = DEFAULT_HOURLY_RATE  # Значение по умолчанию
-
-    for row in accounts:
-        if row[0] == str(user_id):
-            try:
-                hourly_rate = float(row[2])
-            except (IndexError, ValueError):
-                pass
-            break
-
     salary = round(work_hours * hourly_rate, 2)  # Заработок
     return work_hours, salary
 
@@ -147,55 +312,44 @@ def calculate_work_time(user_id, end_time=None):
 def add_user(user_id, name):
     """Добавляет нового пользователя в таблицу 'Счета'.
        Возвращает сообщение о результате."""
-    accounts = sheet_accounts.get_all_values()
-
     # Проверяем, есть ли уже пользователь
-    for row in accounts:
-        if row and row[0] == str(user_id):
-            return 0  # Пользователь уже существует
+    if get_account(user_id):
+        return 0  # Пользователь уже существует
 
     # Если пользователя нет, добавляем
-    sheet_accounts.append_row([user_id, name, DEFAULT_HOURLY_RATE, 0])
+    storage.add_account(user_id, name, DEFAULT_HOURLY_RATE, 0)
     return 1  # Пользователь успешно добавлен
 
 
 def get_balance(user_id):
     """Возвращает текущий баланс сотрудника"""
-    accounts = sheet_accounts.get_all_values()
-    for row in accounts:
-        if row[0] == str(user_id):
-            return float(row[3])  # Возвращаем баланс
+    account = get_account(user_id)
+    if account:
+        return account.balance  # Возвращаем баланс
     return 0  # Если сотрудника нет, возвращаем 0
 
 
 def update_balance(user_id, amount):
     """Добавляет сумму из баланса сотрудника"""
-    accounts = sheet_accounts.get_all_values()
-    for i, row in enumerate(accounts):
-        if row[0] == str(user_id):
-            current_balance = float(row[3])
-            new_balance = current_balance + amount
-            sheet_accounts.update_cell(i + 1, 4, new_balance)  # Обновляем баланс
-            return new_balance
+    with ledger.user_lock(user_id):  # Начисление и выплата одному сотруднику не могут перетереть друг друга
+        if get_account(user_id):
+            # Хранилище меняет баланс (в режиме sqlite — атомарно в общей для процессов базе), журнал его записывает
+            return ledger.record(user_id, amount, storage.add_balance(user_id, amount))
     return None  # Если сотрудника нет
 
 
 def get_all_balances():
     """Возвращает список сотрудников с их балансами"""
-    accounts = sheet_accounts.get_all_values()[1:]  # Пропускаем заголовки
-    return [[row[1], row[3]] for row in accounts]
+    return [[account.name, account.balance] for account in storage.get_accounts()]
 
 
 def get_all_accounts():
-    return sheet_accounts.get_all_values()[1:]
+    return [account.to_row() for account in storage.get_accounts()]
 
 
 def get_last_event(user_id):
     """Возвращает тип и время последнего события пользователя"""
-    records = sheet.get_all_values()
-    for row in reversed(records):
-        if row[1] == str(user_id):
-            event_time = datetime.strptime(row[0], "%d-%m-%Y %H:%M:%S")
-            event_type = row[3]
-            return event_type, event_time
+    state = get_shift_state(user_id)
+    if state:
+        return state.last_event_type, state.last_event_time
     return None, None  # если записей нет
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import re
+import threading
+from gspread.utils import rowcol_to_a1
+from config import WRITE_JOURNAL_PATH, WRITE_FLUSH_INTERVAL
+from metrics import error_code
+
+logger = logging.getLogger(__name__)
+
+# Отложенная запись в таблицу. Каждое изменение сначала дописывается в локальный журнал (с fsync),
+# а фоновый поток раз в WRITE_FLUSH_INTERVAL секунд отправляет накопленное одним append_rows
+# и одним batch_update на лист. Если бот упал, не отправленные изменения берутся из журнала при старте.
+# append_rows не идемпотентен: если ответ на него потерян (таймаут, 5xx, падение до перезаписи журнала),
+# перед повторной отправкой конец листа сверяется с очередью, и уже записанные строки второй раз не уходят.
+_worksheets = {}  # ключ листа -> worksheet
+_pending = []  # Операции, ещё не записанные в таблицу, в порядке поступления
+_journal = None
+_lock = threading.Lock()
+_flush_lock = threading.RLock()
+_stop = threading.Event()
+_thread = None
+_on_flush = None  # Вызывается после успешной записи в лист, задаётся в sheet_sync
+_on_append = {}  # ключ листа -> функция, которой сообщаются номера дописанных строк
+_unconfirmed = set()  # Листы, для которых неизвестно, дошёл ли последний append_rows
+TAIL_SLACK = 200  # Сколько строк могли дописать в лист после наших, пока ответ не дошёл
+
+
+def register(key, worksheet):
+    """Регистрирует лист, в который будут отправляться операции с этим ключом"""
+    _worksheets[key] = worksheet
+
+
+def set_on_flush(func):
+    """func(key, appended_range, appended_count, updated_rows) вызывается после записи изменений в лист"""
+    global _on_flush
+    _on_flush = func
+
+
+def set_on_append(key, func):
+    """func([(номер строки, значения)]) вызывается, когда строки листа key дописаны и стали известны их номера.
+       Номера присваивает таблица: строки, поставленные в очередь, могут лечь не туда, куда ожидалось
+       (например, если в лист пишут несколько процессов бота)"""
+    _on_append[key] = func
+
+
+def _start_row(updated_range):
+    """Номер первой строки диапазона из ответа Sheets ("'Лист1'!A101:F105" -> 101)"""
+    match = re.search(r"![A-Z]+(\d+)", updated_range or "")
+    return int(match.group(1)) if match else None
+
+
+def _notify_appended(key, start, rows):
+    func = _on_append.get(key)
+    if func is None or start is None:
+        return
+    try:
+        func([(start + i, row) for i, row in enumerate(rows)])
+    except Exception as e:
+        logger.exception("Ошибка обработки дописанных строк листа %s: %s", key, e)
+
+
+def _open_journal():
+    """Загружает не отправленные операции из журнала и открывает его на дозапись"""
+    global _journal
+    if _journal is not None:
+        return
+    if os.path.exists(WRITE_JOURNAL_PATH):
+        with open(WRITE_JOURNAL_PATH, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    _pending.append(json.loads(line))
+                except ValueError:
+                    break  # Строка, недописанная при падении
+        if _pending:
+            logger.info("Из журнала восстановлено %s операций записи", len(_pending))
+            # Бот мог упасть после append_rows, но до перезаписи журнала
+            _unconfirmed.update(op["sheet"] for op in _pending if op["op"] == "append")
+    _journal = open(WRITE_JOURNAL_PATH, "a", encoding="utf-8")
+
+
+def _record(op):
+    with _lock:
+        _open_journal()
+        _journal.write(json.dumps(op, ensure_ascii=False) + "\n")
+        _journal.flush()
+        os.fsync(_journal.fileno())
+        _pending.append(op)
+
+
+def append_row(key, row):
+    """Ставит в очередь добавление строки в конец листа"""
+    _record({"op": "append", "sheet": key, "row": row})
+
+
+def update_cell(key, row, col, value):
+    """Ставит в очередь изменение ячейки"""
+    _record({"op": "update", "sheet": key, "row": row, "col": col, "value": value})
+
+
+def _same_value(sent, read):
+    if str(sent) == read:
+        return True
+    try:
+        return float(sent) == float(read.replace(",", "."))  # Таблица может отформатировать число по-своему
+    except (TypeError, ValueError):
+        return False
+
+
+def _same_row(sent, read):
+    read = list(read) + [""] * (len(sent) - len(read))  # Пустые ячейки в конце строки таблица не возвращает
+    return all(_same_value("" if value is None else value, read[i]) for i, value in enumerate(sent))
+
+
+def _find_sent(worksheet, rows):
+    """Ищет в конце листа первые строки rows. Возвращает (сколько строк уже записано, номер первой из них)"""
+    total = len(worksheet.col_values(1))
+    if not total:
+        return 0, None
+    start = max(1, total - len(rows) - TAIL_SLACK + 1)
+    tail = worksheet.get(f"A{start}:{rowcol_to_a1(total, max(len(row) for row in rows))}")
+    best, best_start = 0, None
+    for i in range(len(tail)):
+        count = 0
+        while count < len(rows) and i + count < len(tail) and _same_row(rows[count], tail[i + count]):
+            count += 1
+        if count > best:
+            best, best_start = count, start + i
+    return best, best_start
+
+
+def _confirm(key):
+    """Убирает из очереди строки листа, которые уже есть в таблице (вызывается под _flush_lock)"""
+    with _lock:
+        _open_journal()
+        appends = [op for op in _pending if op["sheet"] == key and op["op"] == "append"]
+    worksheet = _worksheets.get(key)
+    if appends and worksheet is not None:
+        sent, start = _find_sent(worksheet, [op["row"] for op in appends])
+        if sent:
+            logger.warning("В листе %s уже есть %s строк из очереди, повторно они не отправляются", key, sent)
+            sent_ops = {id(op) for op in appends[:sent]}
+            with _lock:
+                _pending[:] = [op for op in _pending if id(op) not in sent_ops]
+                _rewrite_journal()
+            if _on_flush:
+                _on_flush(key, f"!A{start}", sent, [])
+            _notify_appended(key, start, [op["row"] for op in appends[:sent]])
+    _unconfirmed.discard(key)
+
+
+def with_pending(key, records):
+    """Дополняет прочитанные из листа строки ещё не отправленными изменениями этого листа.
+       Лист нужно читать под exclusive(): иначе отправка между чтением и вызовом потеряет или удвоит строки"""
+    records = [list(r) for r in records]
+    with _flush_lock:
+        with _lock:
+            _open_journal()
+        if key in _unconfirmed:
+            _confirm(key)
+        with _lock:
+            ops = [op for op in _pending if op["sheet"] == key]
+    for op in ops:
+        if op["op"] == "append":
+            records.append([str(v) for v in op["row"]])
+        else:
+            while len(records) < op["row"]:
+                records.append([])
+            row = records[op["row"] - 1]
+            row.extend([""] * (op["col"] - len(row)))
+            row[op["col"] - 1] = str(op["value"])
+    return records
+
+
+def _rewrite_journal():
+    """Перезаписывает журнал оставшимися операциями (вызывается под _lock)"""
+    global _journal
+    tmp_path = WRITE_JOURNAL_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for op in _pending:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    _journal.close()
+    os.replace(tmp_path, WRITE_JOURNAL_PATH)
+    _journal = open(WRITE_JOURNAL_PATH, "a", encoding="utf-8")
+
+
+def flush():
+    """Отправляет накопленные операции в таблицу: по одному append_rows и batch_update на лист"""
+    with _flush_lock:
+        with _lock:
+            _open_journal()
+        skipped = set()
+        for key in list(_unconfirmed):
+            try:
+                _confirm(key)
+            except Exception as e:
+                skipped.add(key)  # Не отправляем вслепую: строки могли уже лежать в листе
+                logger.warning("Не удалось сверить лист %s с очередью: %s", key, e)
+        with _lock:
+            batch = list(_pending)
+        if not batch:
+            return
+
+        done = set()
+        for key in dict.fromkeys(op["sheet"] for op in batch if op["sheet"] not in skipped):
+            ops = [op for op in batch if op["sheet"] == key]
+            appends = [op for op in ops if op["op"] == "append"]
+            cells = {}  # Несколько изменений одной ячейки схлопываются в последнее
+            for op in ops:
+                if op["op"] == "update":
+                    cells[(op["row"], op["col"])] = op["value"]
+            try:
+                worksheet = _worksheets[key]
+                if appends:
+                    try:
+                        response = worksheet.append_rows([op["row"] for op in appends])
+                    except Exception as e:
+                        if not error_code(e).startswith("4"):  # Ошибки 4xx — запрос точно отклонён
+                            _unconfirmed.add(key)
+                        raise
+                    done.update(id(op) for op in appends)
+                    # В ответе Sheets — диапазон, куда легли строки ("'Лист1'!A101:F105")
+                    updated_range = (response or {}).get("updates", {}).get("updatedRange")
+                    if _on_flush:
+                        _on_flush(key, updated_range, len(appends), [])
+                    _notify_appended(key, _start_row(updated_range), [op["row"] for op in appends])
+                if cells:
+                    worksheet.batch_update([{"range": rowcol_to_a1(row, col), "values": [[value]]}
+                                            for (row, col), value in cells.items()])
+                    if _on_flush:
+                        _on_flush(key, None, 0, sorted({row for row, _ in cells}))
+                done.update(id(op) for op in ops)
+            except Exception as e:
+                # Оставляем операции листа в очереди до следующей попытки
+                logger.warning("Не удалось записать изменения в лист %s: %s", key, e)
+
+        if done:
+            with _lock:
+                _pending[:len(batch)] = [op for op in batch if id(op) not in done]
+                _rewrite_journal()
+
+
+def exclusive():
+    """Блокировка, на время которой фоновая отправка приостанавливается (например, пока лист читается
+       или переписывается). Повторный вход из того же потока разрешён"""
+    return _flush_lock
+
+
+def _run():
+    while not _stop.wait(WRITE_FLUSH_INTERVAL):
+        flush()
+
+
+def start():
+    """Восстанавливает операции из журнала и запускает фоновую отправку"""
+    global _thread
+    with _lock:
+        _open_journal()
+    if _thread is None:
+        _stop.clear()
+        _thread = threading.Thread(target=_run, name="sheets-writer", daemon=True)
+        _thread.start()
+
+
+def stop():
+    """Останавливает фоновую отправку и записывает всё, что осталось в очереди"""
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
+    flush()
@@ -2,4 +2,59 @@ TOKEN = ""
 ADMINS_ID = []  # ID администраторов
 SPREADSHEET_NAME = ""  # Название Google-таблицы
 
-DEFAULT_HOURLY_RATE = 1000  # Дефолтная почасовая ставка (изменить при необходимости)
\ No newline at end of file
+DEFAULT_HOURLY_RATE = 1000  # Дефолтная почасовая ставка (изменить при необходимости)
+DEFAULT_LUNCH_TIME = 3600  # Длительность обеда по умолчанию, в секундах
+AUTO_CHECK_IN_TIME = "09:00"  # Время прихода, подставляемое автоматически
+AUTO_CHECK_OUT_TIME = "23:00"  # Время, в которое незакрытые смены закрываются автоматически
+
+SHEETS_MAX_IN_FLIGHT = 4  # Максимум одновременных запросов к Google Sheets (и размер пула потоков для них)
+
+ACCOUNTS_CACHE_TTL = 300  # Через сколько секунд перечитывать лист "Счета" (подхватить ручные правки ставок)
+
+WRITE_JOURNAL_PATH = "../data/write_journal.jsonl"  # Журнал ещё не записанных в таблицу изменений
+WRITE_FLUSH_INTERVAL = 2  # Как часто (в секундах) отправлять накопленные изменения в таблицу
+
+STORAGE_BACKEND = "sheets"  # "sheets" — данные в Google-таблице, "sqlite" — локальная база, таблица как зеркало
+SQLITE_PATH = "../data/work_time.db"  # Файл базы для STORAGE_BACKEND = "sqlite"
+
+METRICS_HOST = "127.0.0.1"  # Адрес локального сервера метрик
+METRICS_PORT = 9100  # Порт сервера метрик (/metrics), None — не запускать
+SLOW_CALL_THRESHOLD = 2  # Писать в лог обработчики и запросы к таблице дольше стольких секунд, None — не писать
+SHEETS_QUOTA_PER_MINUTE = 60  # Запросов в минуту на чтение и отдельно на запись: квота Sheets API на пользователя (сервисный аккаунт); квота проекта — 300
+SHEETS_BURST = 10  # Сколько запросов можно отправить подряд без ожидания квоты
+DRIVE_QUOTA_PER_MINUTE = 120  # Запросов в минуту к Drive API (время изменения файла для синхронизации), у Drive своя квота
+SHEETS_MAX_RETRIES = 5  # Сколько раз повторять запрос при ответе 429 или 5xx
+SHEETS_BACKOFF_BASE = 1  # Начальная задержка перед повтором, в секундах (удваивается с каждой попыткой)
+SHEETS_BACKOFF_MAX = 32  # Максимальная задержка перед повтором, в секундах
+
+NOTIFY_CHAT_INTERVAL = 1  # Минимальный интервал между уведомлениями в один чат, в секундах
+NOTIFY_GLOBAL_RATE = 25  # Максимум уведомлений в секунду по всем чатам
+NOTIFY_DIGEST_WINDOW = 0  # Объединять уведомления за столько секунд в одну сводку, 0 — отправлять сразу
+
+ARCHIVE_AFTER_DAYS = 60  # Закрытые смены и транзакции старше стольких дней переносятся в помесячные листы
+ARCHIVE_INTERVAL = 24 * 3600  # Как часто запускать архивирование, в секундах
+
+LEDGER_PATH = "../data/ledger.jsonl"  # Журнал изменений балансов (история для проверки, общий для всех процессов)
+LEDGER_SNAPSHOT_PATH = "../data/ledger_snapshot.json"  # Снимок последних балансов журнала, чтобы не читать его целиком
+LEDGER_SNAPSHOT_EVERY = 500  # Сохранять снимок балансов каждые столько записей журнала
+
+PICKER_PAGE_SIZE = 8  # Сотрудников на одной странице списка для выплаты и ручной записи
+
+WEBHOOK_HOST = "127.0.0.1"  # Адрес, на котором webhook.py принимает обновления
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_URL = ""  # Внешний адрес (https://...), который регистрируется в Telegram; пусто — не регистрировать
+WEBHOOK_SECRET = ""  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = 1  # Число процессов-обработчиков; больше одного — только с STORAGE_BACKEND = "sqlite"
+
+FSM_STORAGE_PATH = "../data/fsm.db"  # Состояния диалогов (выплата, ручная запись)
+FSM_FLUSH_INTERVAL = 1  # Раз во сколько секунд изменённые состояния записываются в базу
+FSM_STATE_TTL = 24 * 3600  # Через сколько секунд без действий диалог считается брошенным
+
+SYNC_INTERVAL = 5  # Раз во сколько секунд подтягивать ручные правки таблицы (0 — не подтягивать)
+SYNC_BLOCK_SIZE = 500  # Строк в блоке, по которому проверяются контрольные суммы
+SYNC_VERIFY_BLOCKS = 2  # Сколько блоков каждого листа проверять за синхронизацию, пока файл меняется
+# За сколько секунд после изменения файла проверяется весь лист: остаток круга читается одним запросом
+# (0 — только SYNC_VERIFY_BLOCKS блоков за синхронизацию, тогда правка старой строки находится
+# за ceil(блоков / SYNC_VERIFY_BLOCKS) * SYNC_INTERVAL секунд)
+SYNC_VERIFY_PERIOD = 300
@@ -0,0 +1,88 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bot")]
+
+import pytest  # noqa: E402
+import fake_sheets  # noqa: E402
+
+EVENTS_HEADER = ["Время", "ID", "Имя", "Событие", "Часы", "Зарплата"]
+ACCOUNTS_HEADER = ["ID", "Имя", "Ставка", "Баланс"]
+TRANSACTIONS_HEADER = ["Время", "ID", "Имя", "Тип", "Сумма", "Баланс"]
+
+
+@pytest.fixture
+def write_queue(tmp_path, monkeypatch):
+    """Очередь записи с журналом во временном каталоге и без операций от прошлых тестов"""
+    import write_queue
+
+    monkeypatch.setattr(write_queue, "WRITE_JOURNAL_PATH", str(tmp_path / "write_journal.jsonl"))
+    restart(write_queue)
+    yield write_queue
+    restart(write_queue)
+
+
+def restart(write_queue):
+    """Забывает состояние очереди в памяти, как после перезапуска бота (журнал на диске остаётся)"""
+    if write_queue._journal is not None:
+        write_queue._journal.close()
+    write_queue._journal = None
+    write_queue._pending.clear()
+    write_queue._unconfirmed.clear()
+
+
+def make_spreadsheet(events=(), accounts=()):
+    """Имитация таблицы бота: лист событий (первый), "Счета" и "Транзакции" """
+    spreadsheet = fake_sheets.FakeSpreadsheet(fake_sheets.LatencyModel(scale=0))
+    spreadsheet.sheet1.rows = [EVENTS_HEADER] + [[str(v) for v in row] for row in events]
+    spreadsheet.add_worksheet("Счета", values=[ACCOUNTS_HEADER] + list(accounts))
+    spreadsheet.add_worksheet("Транзакции", values=[TRANSACTIONS_HEADER])
+    return spreadsheet
+
+
+@pytest.fixture(params=["sheets", "sqlite"])
+def bot(request, tmp_path, monkeypatch, write_queue):
+    """Возвращает функцию, которая подключает work_with_sheets к имитации таблицы с хранилищем
+       request.param и без состояния от прошлых тестов"""
+    import accounts_cache
+    import event_store
+    import ledger
+    import reports
+    import sheet_sync
+    import sheets_scheduler
+    import shift_index
+    import work_with_sheets
+    from storage import SheetsStorage, SqliteStorage
+
+    monkeypatch.setattr(ledger, "LEDGER_PATH", str(tmp_path / "ledger.jsonl"))
+    monkeypatch.setattr(ledger, "LEDGER_SNAPSHOT_PATH", str(tmp_path / "ledger_snapshot.json"))
+    monkeypatch.setattr(ledger, "_loaded", False)
+    monkeypatch.setattr(ledger, "_journal", None)
+    for kind in ("read", "write", "drive"):  # Квота Sheets в тестах не ждёт
+        monkeypatch.setitem(sheets_scheduler._buckets, kind, sheets_scheduler.TokenBucket(10 ** 6, 10 ** 6))
+
+    def connect(spreadsheet):
+        fake_sheets.install(spreadsheet)
+        work_with_sheets.connect(force=True)
+        accounts_cache.invalidate()
+        shift_index.reset()
+        event_store.reset()
+        monkeypatch.setattr(reports, "_built", False)
+        for replica in sheet_sync._replicas.values():
+            replica.hashes = None
+        monkeypatch.setattr(sheet_sync, "_last_revision", None)
+        if request.param == "sqlite":
+            storage = SqliteStorage(":memory:", work_with_sheets.sheet, work_with_sheets.sheet_accounts,
+                                    work_with_sheets.sheet_transaction)
+        else:
+            storage = SheetsStorage(work_with_sheets.sheet, work_with_sheets.sheet_accounts)
+        monkeypatch.setattr(work_with_sheets, "storage", storage)
+        work_with_sheets.load_storage()
+        work_with_sheets.reload_accounts()
+        sheet_sync.sync()  # Точка отсчёта контрольных сумм
+        return work_with_sheets
+
+    yield connect
+    if ledger._journal is not None:
+        ledger._journal.close()
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+import auto_close
+import shift_index
+from conftest import make_spreadsheet
+
+EVENTS = [
+    ["19-03-2025 09:00:00", "1", "Анна", "Приход", "", ""],
+    ["19-03-2025 09:00:00", "2", "Борис", "Приход", "", ""],
+    ["19-03-2025 12:00:00", "2", "Борис", "Начал обед", "", ""],
+    ["19-03-2025 10:00:00", "3", "Вера", "Приход", "", ""],
+    ["19-03-2025 18:00:00", "3", "Вера", "Уход", "8", "800"],
+    ["19-03-2025 23:30:00", "4", "Глеб", "Приход", "", ""],
+]
+ACCOUNTS = [["1", "Анна", "100", "0"], ["2", "Борис", "100", "0"], ["3", "Вера", "100", "800"],
+            ["4", "Глеб", "100", "0"]]
+
+
+@pytest.fixture
+def ws(bot, monkeypatch):
+    monkeypatch.setattr(auto_close, "AUTO_CHECK_OUT_TIME", "23:00")
+    monkeypatch.setattr(auto_close, "DEFAULT_LUNCH_TIME", 3600)
+    return bot(make_spreadsheet(EVENTS, ACCOUNTS))
+
+
+def state(event_type, event_time):
+    result = shift_index.ShiftState()
+    result.apply(event_type, datetime.strptime(event_time, shift_index.TIME_FORMAT))
+    return result
+
+
+def test_close_time(monkeypatch):
+    monkeypatch.setattr(auto_close, "AUTO_CHECK_OUT_TIME", "23:00")
+    assert auto_close._close_time(state("Приход", "19-03-2025 09:00:00")) == datetime(2025, 3, 19, 23, 0)
+    assert auto_close._close_time(state("Приход", "19-03-2025 23:00:00")) == datetime(2025, 3, 19, 23, 0)
+    # Приход после времени закрытия закрывается на следующий день
+    assert auto_close._close_time(state("Приход", "19-03-2025 23:30:00")) == datetime(2025, 3, 20, 23, 0)
+
+
+def test_find_due(ws):
+    assert auto_close.find_due(datetime(2025, 3, 19, 22, 59)) == []
+    assert auto_close.find_due(datetime(2025, 3, 19, 23, 0)) == ["1", "2"]
+    assert auto_close.find_due(datetime(2025, 3, 20, 23, 0)) == ["1", "2", "4"]
+
+
+def test_close_shifts_writes_check_out_and_closes_lunch(ws):
+    now = datetime(2025, 3, 19, 23, 0)
+    closed = auto_close.close_shifts(auto_close.find_due(now), now)
+
+    assert [(user_id, name, close_time) for user_id, name, close_time, *_ in closed] == \
+        [("1", "Анна", now), ("2", "Борис", now)]
+    assert [e.event for e in ws.get_events("2", datetime(2025, 3, 19), now)] == \
+        ["Приход", "Начал обед", "Закончил обед", "Уход"]
+    assert ws.get_events("2", datetime(2025, 3, 19), now)[2].time == datetime(2025, 3, 19, 13, 0)
+    for user_id, name, close_time, work_hours, salary, balance in closed:
+        assert ws.get_shift_state(user_id).last_event_type == "Уход"
+        assert ws.get_balance(user_id) == balance == salary
+    # С 09:00 до 23:00 за вычетом часа обеда: у Анны — обеда по умолчанию, у Бориса — закрытого проходом
+    assert [(work_hours, salary) for _, _, _, work_hours, salary, _ in closed] == [(13.0, 1300.0), (13.0, 1300.0)]
+
+    rows = ws.sheet.get_all_values()
+    assert rows[-1][:4] == ["19-03-2025 23:00:00", "2", "Борис", "Уход"]
+    assert auto_close.find_due(now) == []
+
+
+def test_close_shifts_skips_shift_closed_meanwhile(ws):
+    now = datetime(2025, 3, 19, 23, 0)
+    ws.log_event("1", "Анна", "Уход", datetime(2025, 3, 19, 22, 0), 13, 1300)
+
+    closed = auto_close.close_shifts(["1", "2"], now)
+    assert [user_id for user_id, *_ in closed] == ["2"]
+    assert [e.event for e in ws.get_events("1", datetime(2025, 3, 19), now)] == ["Приход", "Уход"]
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pytest
+import archiver
+import reports
+import sheet_sync
+from conftest import make_spreadsheet
+
+NOW = datetime(2025, 3, 20, 12, 0)
+EVENTS = [
+    ["01-03-2025 09:00:00", "1", "Анна", "Приход", "", ""],
+    ["01-03-2025 10:00:00", "2", "Борис", "Приход", "", ""],
+    ["01-03-2025 17:00:00", "1", "Анна", "Уход", "8", "800"],
+    ["01-03-2025 18:00:00", "2", "Борис", "Уход", "8", "800"],
+    ["20-03-2025 08:00:00", "1", "Анна", "Приход", "", ""],
+    ["20-03-2025 09:00:00", "2", "Борис", "Приход", "", ""],
+    ["20-03-2025 10:00:00", "1", "Анна", "Уход", "2", "200"],
+    ["20-03-2025 11:00:00", "2", "Борис", "Начал обед", "", ""],
+]
+ACCOUNTS = [["1", "Анна", "100", "1000"], ["2", "Борис", "100", "800"]]
+
+
+@pytest.fixture
+def archived(bot, monkeypatch):
+    """Таблица, из которой смены 1 марта уже перенесены в архив: строки событий сдвинулись на 4 вверх"""
+    monkeypatch.setattr(archiver, "ARCHIVE_AFTER_DAYS", 7)
+    spreadsheet = make_spreadsheet(EVENTS, ACCOUNTS)
+    ws = bot(spreadsheet)
+    assert archiver.archive(NOW) == 4
+    assert spreadsheet.sheet1.rows[1:] == EVENTS[4:]
+    return spreadsheet, ws
+
+
+def day_totals(ws, day):
+    ws.storage.update_reports(ws.read_report_rows)
+    return {name: (totals.shifts, totals.hours, totals.earnings) for name, totals in reports.report("day", day)}
+
+
+def edit(spreadsheet, number, values):
+    spreadsheet.sheet1.rows[number - 1] = values
+    spreadsheet.revision += 1  # Прямая правка rows не меняет ревизию имитации
+    sheet_sync.sync()
+
+
+def test_edit_after_archive_replaces_event_of_shifted_row(archived):
+    spreadsheet, ws = archived
+    assert day_totals(ws, NOW)["Анна"] == (1, 2.0, 200.0)
+
+    # Строка 4 — уход Анны 20 марта, до архивирования это была строка 8
+    edit(spreadsheet, 4, ["20-03-2025 10:00:00", "1", "Анна", "Уход", "2", "500"])
+
+    events = ws.get_events("1", datetime(2025, 3, 20), NOW)
+    assert [(e.event, e.salary) for e in events] == [("Приход", None), ("Уход", 500.0)]
+    assert day_totals(ws, NOW)["Анна"] == (1, 2.0, 500.0)
+    assert ws.get_shift_state("2").last_event_type == "Начал обед"  # Соседние строки не задеты
+    assert ws.get_balance("1") == 1000  # Правка событий баланс не меняет
+
+
+def test_cleared_row_removes_event_and_reopens_shift(archived):
+    spreadsheet, ws = archived
+    assert ws.get_shift_state("1").last_event_type == "Уход"
+
+    edit(spreadsheet, 4, [""] * 6)
+
+    assert [e.event for e in ws.get_events("1", datetime(2025, 3, 20), NOW)] == ["Приход"]
+    assert ws.get_shift_state("1").last_event_type == "Приход"
+    assert "Анна" not in day_totals(ws, NOW)
+
+
+def test_archive_retry_after_crash_does_not_duplicate(bot, monkeypatch):
+    monkeypatch.setattr(archiver, "ARCHIVE_AFTER_DAYS", 7)
+    spreadsheet = make_spreadsheet(EVENTS, ACCOUNTS)
+    bot(spreadsheet)
+    rewrite = archiver._rewrite
+
+    def crash(*args):
+        raise TimeoutError("read timed out")
+
+    # Строки уже дописаны в помесячный лист и итоги записаны, а основной лист не переписан
+    monkeypatch.setattr(archiver, "_rewrite", crash)
+    with pytest.raises(TimeoutError):
+        archiver.archive(NOW)
+    monkeypatch.setattr(archiver, "_rewrite", rewrite)
+    assert archiver.archive(NOW) == 4
+
+    assert spreadsheet.worksheet("События 03-2025").rows[1:] == EVENTS[:4]
+    summary = spreadsheet.worksheet(archiver.SUMMARY_TITLE).rows
+    assert summary[1:] == [["03-2025", "1", "Анна", "1", "8.0", "800.0"],
+                           ["03-2025", "2", "Борис", "1", "8.0", "800.0"]]
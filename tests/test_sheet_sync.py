@@ -0,0 +1,93 @@
+import pytest
+import fake_sheets
+import sheet_sync
+
+
+def make_replica(rows, on_sync=None):
+    spreadsheet = fake_sheets.FakeSpreadsheet(fake_sheets.LatencyModel(scale=0))
+    worksheet = spreadsheet.add_worksheet("Тест", rows=len(rows), values=rows)  # Без свободных строк в сетке
+    replica = sheet_sync.Replica("test", worksheet, "B", on_sync)
+    replica.baseline(worksheet.get_all_values())
+    return spreadsheet, worksheet, replica
+
+
+def sync(replica, modified, now=0):
+    ranges = replica.plan(modified, now)
+    return replica.read(ranges) if ranges else ([], [])
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(sheet_sync, "SYNC_BLOCK_SIZE", 10)
+    monkeypatch.setattr(sheet_sync, "SYNC_VERIFY_BLOCKS", 1)
+    monkeypatch.setattr(sheet_sync, "SYNC_VERIFY_PERIOD", 0)
+
+
+ROWS = [[str(i), f"строка {i}"] for i in range(1, 46)]  # 5 блоков по 10 строк
+
+
+def test_edit_is_found_by_block_checksums():
+    spreadsheet, worksheet, replica = make_replica(ROWS)
+    worksheet.rows[33][1] = "правка"  # Строка 34, блок 3
+
+    found = []
+    for _ in range(5):  # За круг из 5 синхронизаций проверяется каждый блок
+        appended, changed = sync(replica, modified=not found and _ == 0)
+        assert not appended
+        found += changed
+    assert found == [(34, ["34", "правка"])]
+
+
+def test_tail_is_read_from_last_known_row_without_spare_grid_rows():
+    spreadsheet, worksheet, replica = make_replica(ROWS)
+    worksheet.append_rows([["46", "вручную"]])
+
+    appended, changed = sync(replica, modified=True)
+    assert appended == [(46, ["46", "вручную"])]
+    assert not changed
+
+
+def test_own_writes_are_not_reported_as_edits():
+    spreadsheet, worksheet, replica = make_replica(ROWS)
+    response = worksheet.append_rows([["46", "бот"]])
+    worksheet.update_cell(5, 2, "бот")
+    replica.note_write(int(response["updates"]["updatedRange"].split("!A")[1].split(":")[0]), 1, [5])
+
+    for _ in range(5):
+        assert sync(replica, modified=True) == ([], [])
+
+
+def test_rows_appended_before_own_rows_are_found():
+    spreadsheet, worksheet, replica = make_replica(ROWS)
+    worksheet.append_rows([["46", "вручную"]])
+    worksheet.append_rows([["47", "бот"]])
+    replica.note_write(47, 1, [])
+
+    appended, changed = sync(replica, modified=True)
+    assert appended == [(46, ["46", "вручную"])]
+
+
+def test_unchanged_revision_reads_nothing_until_deadline(monkeypatch):
+    monkeypatch.setattr(sheet_sync, "SYNC_VERIFY_PERIOD", 300)
+    spreadsheet, worksheet, replica = make_replica(ROWS)
+    worksheet.rows[43][1] = "правка"  # Строка 44, последний блок
+
+    assert sync(replica, modified=True, now=0) == ([], [])  # Проверен только первый блок круга
+    reads = spreadsheet.stats["batch_get"]
+    assert sync(replica, modified=False, now=100) == ([], [])
+    assert spreadsheet.stats["batch_get"] == reads  # Файл не менялся — запросов к листу нет
+
+    assert sync(replica, modified=False, now=300) == ([], [(44, ["44", "правка"])])
+    assert spreadsheet.stats["batch_get"] == reads + 1  # Остаток круга одним запросом
+    assert replica.verify_left == 0
+
+
+def test_deleted_rows_fall_back_to_full_read():
+    spreadsheet, worksheet, replica = make_replica(ROWS)
+    worksheet.delete_rows(41, 45)
+    reads = spreadsheet.stats["get_all_values"]
+
+    sync(replica, modified=True)  # Известный конец листа за пределами сетки — ответ 400
+    assert spreadsheet.stats["get_all_values"] == reads + 1
+    assert len(replica.hashes) == 40
+    assert sync(replica, modified=True) == ([], [])
@@ -0,0 +1,106 @@
+import fake_sheets
+from conftest import restart
+
+ROW_A = ["01-03-2025 09:00:00", "1", "Анна", "Приход"]
+ROW_B = ["01-03-2025 09:05:00", "2", "Борис", "Приход"]
+ROW_C = ["01-03-2025 09:10:00", "3", "Вера", "Приход"]
+OTHER = ["01-03-2025 09:07:00", "4", "Глеб", "Приход"]
+
+
+class TimeoutOnce:
+    """Лист, у которого первый append_rows записывает строки, но ответ на него теряется"""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.failed = False
+
+    def append_rows(self, values, **kwargs):
+        response = self.worksheet.append_rows(values, **kwargs)
+        if not self.failed:
+            self.failed = True
+            raise TimeoutError("read timed out")
+        return response
+
+    def __getattr__(self, item):
+        return getattr(self.worksheet, item)
+
+
+def make_sheet(*rows):
+    spreadsheet = fake_sheets.FakeSpreadsheet(fake_sheets.LatencyModel(scale=0))
+    worksheet = spreadsheet.add_worksheet("Тест", values=[["Время", "ID", "Имя", "Событие"]] + list(rows))
+    return spreadsheet, worksheet
+
+
+def test_append_is_not_repeated_after_timeout(write_queue):
+    spreadsheet, worksheet = make_sheet()
+    write_queue.register("test", TimeoutOnce(worksheet))
+    write_queue.append_row("test", ROW_A)
+    write_queue.append_row("test", ROW_B)
+
+    write_queue.flush()  # Строки легли в лист, но ответа нет — операции остаются в очереди
+    assert write_queue._pending
+    assert "test" in write_queue._unconfirmed
+
+    write_queue.flush()  # Перед повтором конец листа сверяется с очередью
+    assert worksheet.rows[1:] == [ROW_A, ROW_B]
+    assert not write_queue._pending
+    assert spreadsheet.stats["append_rows"] == 1
+
+
+def test_partial_match_in_tail_sends_only_missing_rows(write_queue):
+    # В лист уже легли первые две строки очереди, после них другой процесс дописал свою
+    spreadsheet, worksheet = make_sheet(ROW_A, ROW_B, OTHER)
+    write_queue.register("test", worksheet)
+    for row in (ROW_A, ROW_B, ROW_C):
+        write_queue.append_row("test", row)
+    write_queue._unconfirmed.add("test")
+
+    write_queue.flush()
+    assert worksheet.rows[1:] == [ROW_A, ROW_B, OTHER, ROW_C]
+    assert not write_queue._pending
+
+
+def test_tail_without_queued_rows_sends_everything(write_queue):
+    spreadsheet, worksheet = make_sheet(OTHER)
+    write_queue.register("test", worksheet)
+    write_queue.append_row("test", ROW_A)
+    write_queue._unconfirmed.add("test")
+
+    write_queue.flush()
+    assert worksheet.rows[1:] == [OTHER, ROW_A]
+
+
+def test_journal_is_replayed_after_restart(write_queue):
+    spreadsheet, worksheet = make_sheet()
+    write_queue.register("test", worksheet)
+    write_queue.append_row("test", ROW_A)
+    write_queue.update_cell("test", 2, 4, "Уход")
+    restart(write_queue)  # Бот упал до отправки
+
+    write_queue.flush()
+    assert worksheet.rows[1:] == [ROW_A[:3] + ["Уход"]]
+    assert not write_queue._pending
+
+
+def test_restart_after_unacknowledged_append_does_not_duplicate(write_queue):
+    # Бот упал после append_rows, но до того, как убрал строки из журнала
+    spreadsheet, worksheet = make_sheet()
+    write_queue.register("test", worksheet)
+    write_queue.append_row("test", ROW_A)
+    write_queue.append_row("test", ROW_B)
+    worksheet.append_rows([ROW_A, ROW_B])
+    restart(write_queue)
+
+    write_queue.flush()
+    assert worksheet.rows[1:] == [ROW_A, ROW_B]
+    assert not write_queue._pending
+
+
+def test_with_pending_adds_queued_rows(write_queue):
+    spreadsheet, worksheet = make_sheet(ROW_A)
+    write_queue.register("test", worksheet)
+    write_queue.append_row("test", ROW_B)
+    write_queue.update_cell("test", 2, 3, "Аня")
+
+    records = write_queue.with_pending("test", worksheet.get_all_values())
+    assert records[1:] == [["01-03-2025 09:00:00", "1", "Аня", "Приход"], ROW_B]